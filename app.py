@@ -6,18 +6,25 @@ import os
 import tkinter as tk
 from tkinter.font import Font
 from tkinter import ttk, filedialog, messagebox
-import json
-import datetime
-import copy # Import copy
 from ttkbootstrap import Style
 
 from project_manager import ProjectManager
 from file_operations import FileOperations
-from ui_dialogs import ProjectManagerDialog, FileTypeDialog, ProgressDialog
+from ui_dialogs import FileTypeDialog, MergeOptionsDialog
+from ignore_rules import IgnoreMatcher, DEFAULT_IGNORED_FILE_TYPES
+from metadata_cache import MetadataCache
+from stats_engine import StatsAggregator
+from selection_model import SelectionModel
+from project_store import DEFAULT_MERGE_OPTIONS
+from merge_engine import BUDGET_PRIORITIES
+from token_estimator import format_tokens
 # Import format_size here as it's used for display
-from utils import calculate_project_size, update_ui_status, count_characters_in_files, format_size
+from utils import update_ui_status, format_size
 
 class FileMergerApp:
+    FILTER_DELAY_MS = 150 # Typing pause before the filter box runs its query
+    MAX_FILTER_ROWS = 1000 # Matches listed at once; "Select Matches" still selects them all
+
     def __init__(self, root):
         self.root = root
         self.style = Style("flatly") # Example theme
@@ -34,31 +41,15 @@ class FileMergerApp:
         # Core state management
         self.current_project = "Default"
         self.projects = {}
-        # Default ignored types - consider moving to a config or default project settings
-        self.ignored_file_types = [
-            # Version control
-            ".git", ".gitignore", ".gitattributes", ".svn", ".hg",
-            # IDE/Editor specific
-            ".vscode", ".idea", ".project", ".settings", "__pycache__", "*.pyc", "*.pyo",
-            # Compiled/Binary
-            "*.dll", "*.exe", "*.so", "*.o", "*.obj", "*.class", "*.jar",
-            # Archives
-            "*.zip", "*.tar", "*.gz", "*.rar", "*.7z",
-            # Images (often large and not useful for merging text)
-            ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".svg",
-            # Media
-            "*.mp3", "*.wav", "*.mp4", "*.avi", "*.mov",
-            # Docs/Other Binary Formats
-            "*.pdf", "*.doc", "*.docx", "*.xls", "*.xlsx", "*.ppt", "*.pptx", "*.odt", "*.ods",
-            # Logs (can be large, maybe optional)
-            # "*.log"
-             # OS specific
-             "Thumbs.db", ".DS_Store"
-        ]
+        self.ignored_file_types = list(DEFAULT_IGNORED_FILE_TYPES)
+        self.ignore_matcher = IgnoreMatcher(self.ignored_file_types) # Compiled form, rebuilt by set_ignored_file_types
+        self.respect_gitignore = False # Prune paths excluded by .gitignore files (per project)
+        self.merge_options = dict(DEFAULT_MERGE_OPTIONS) # Token budget settings (per project)
         self.root_dir = os.path.expanduser("~") # Default root
         self.output_dir = os.path.join(os.path.expanduser("~"), "Merged_Files") # Default output
-        self.stats = {"files": 0, "selected": 0, "size": 0, "chars": 0}
+        self.stats = {"files": 0, "selected": 0, "size": 0, "chars": 0, "tokens": 0}
         self.pending_selected_paths = set() # Initialize pending paths set
+        self.pending_excluded_paths = set() # Paths deselected inside pending selected folders
 
         # Setup main window
         self.root.title("File Merger Pro")
@@ -67,6 +58,11 @@ class FileMergerApp:
 
         # Initialize managers (pass self/app instance)
         self.project_manager = ProjectManager(self)
+        self.metadata_cache = MetadataCache(self.project_manager.config_dir)
+        self.selection = SelectionModel() # Checked paths; the 'selected' row tag is only the visual
+        self.stats_engine = StatsAggregator(self.root, self.metadata_cache, self.selection,
+                                            lambda folder, skip: self.file_operations.walk_files(folder, skip),
+                                            on_change=self.update_project_stats)
         self.file_operations = FileOperations(self)
 
         # Initialize UI components
@@ -82,10 +78,11 @@ class FileMergerApp:
             except Exception as e: print(f"Could not create initial output directory {self.output_dir}: {e}")
 
         # Build initial tree, passing any pending selections from loaded project
-        self.file_operations.build_tree(self.root_dir, self.pending_selected_paths)
+        self.file_operations.build_tree(self.root_dir, self.pending_selected_paths, self.pending_excluded_paths)
         # App's responsibility to clear its own pending_selected_paths after they've been passed for a build.
         # This is important so subsequent partial updates (like user clicking) don't try to re-apply old project load selections.
         self.pending_selected_paths = set() 
+        self.pending_excluded_paths = set()
 
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing) # Handle window close
 
@@ -112,6 +109,9 @@ class FileMergerApp:
         project_menu.add_command(label="Save Project", command=self.project_manager.save_current_project_explicitly) # New Save Project
         project_menu.add_separator()
         project_menu.add_command(label="Edit Ignored File Types/Names", command=self.edit_filetypes) # Updated label
+        self.respect_gitignore_var = tk.BooleanVar(value=self.respect_gitignore)
+        project_menu.add_checkbutton(label="Respect .gitignore Files", variable=self.respect_gitignore_var, command=self.toggle_respect_gitignore)
+        project_menu.add_command(label="Merge Options (Token Budget)...", command=self.edit_merge_options)
 
         # --- Main Paned Window ---
         self.paned_window = ttk.PanedWindow(self.root, orient=tk.HORIZONTAL)
@@ -135,6 +135,22 @@ class FileMergerApp:
         ttk.Button(self.tree_nav_frame, text="Browse", command=lambda: self.change_root_directory(None)).pack(side=tk.LEFT, padx=5) # Pass None to trigger browse
         ttk.Button(self.tree_nav_frame, text="Refresh", command=self.refresh_directory).pack(side=tk.LEFT, padx=5)
 
+        # Filter box: finds files anywhere below the root without expanding folders
+        self.filter_frame = ttk.Frame(self.left_frame)
+        self.filter_frame.pack(fill=tk.X, pady=(0, 5))
+        ttk.Label(self.filter_frame, text="Filter:").pack(side=tk.LEFT, padx=(0, 5))
+        self.filter_var = tk.StringVar()
+        self.filter_entry = ttk.Entry(self.filter_frame, textvariable=self.filter_var)
+        self.filter_entry.pack(side=tk.LEFT, fill=tk.X, expand=True, padx=5)
+        self.filter_var.trace_add("write", lambda *args: self.schedule_filter())
+        self.filter_entry.bind("<Return>", lambda e: self.reveal_filter_match())
+        self.filter_entry.bind("<Escape>", lambda e: self.clear_filter())
+        ttk.Button(self.filter_frame, text="Select Matches", command=self.select_filter_matches).pack(side=tk.LEFT, padx=5)
+        ttk.Button(self.filter_frame, text="Clear", command=self.clear_filter).pack(side=tk.LEFT, padx=5)
+        self.filter_matches = [] # FileIndex lines of the files matching the filter
+        self.filter_shown = False # True while the match list replaces the tree
+        self._filter_after = None
+
         # Treeview with scrollbars
         tree_container = ttk.Frame(self.left_frame)
         tree_container.pack(fill=tk.BOTH, expand=True)
@@ -143,7 +159,7 @@ class FileMergerApp:
         self.tree_scrollbar_x = ttk.Scrollbar(tree_container, orient=tk.HORIZONTAL)
 
         self.tree = ttk.Treeview(tree_container,
-                                 yscrollcommand=self.tree_scrollbar_y.set,
+                                 yscrollcommand=self.on_tree_yscroll,
                                  xscrollcommand=self.tree_scrollbar_x.set,
                                  selectmode="browse") # Changed to "browse" for focus indication
 
@@ -154,6 +170,19 @@ class FileMergerApp:
         self.tree_scrollbar_x.pack(side=tk.BOTTOM, fill=tk.X)
         self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
 
+        # Flat list of filter matches, shown in place of the tree while the filter has text
+        self.filter_results = ttk.Treeview(tree_container, columns=("select", "folder"),
+                                           yscrollcommand=self.tree_scrollbar_y.set, selectmode="browse")
+        self.filter_results.column("#0", width=300, minwidth=150, stretch=tk.YES)
+        self.filter_results.column("select", width=40, minwidth=40, anchor=tk.CENTER, stretch=tk.NO)
+        self.filter_results.column("folder", width=400, minwidth=150, anchor=tk.W, stretch=tk.YES)
+        self.filter_results.heading("#0", text="Name", anchor=tk.W)
+        self.filter_results.heading("select", text="", anchor=tk.CENTER)
+        self.filter_results.heading("folder", text="Folder", anchor=tk.W)
+        self.filter_results.bind("<ButtonRelease-1>", self.on_filter_result_click)
+        self.filter_results.bind("<Double-Button-1>", lambda e: self.reveal_filter_match(self.filter_results.identify_row(e.y)))
+        self.filter_results.bind("<Return>", lambda e: self.reveal_filter_match())
+
 
         # Define Treeview columns
         self.tree["columns"] = ("select", "size", "date_modified")
@@ -176,6 +205,8 @@ class FileMergerApp:
             self.tree.tag_configure('text', foreground=self.style.colors.info)
             self.tree.tag_configure('image', foreground=self.style.colors.warning)
             self.tree.tag_configure('error', foreground=self.style.colors.danger)
+            self.tree.tag_configure('binary', foreground=self.style.colors.secondary)
+            self.tree.tag_configure('more', foreground=self.style.colors.secondary)
             # Configure 'selected' tag for row highlighting (checkbox selection)
             # Ensure this does not conflict with the default "browse" mode selection highlight
             self.tree.tag_configure('selected', background=self.style.colors.selectbg, foreground=self.style.colors.selectfg)
@@ -187,6 +218,8 @@ class FileMergerApp:
              self.tree.tag_configure('text', foreground='darkblue')
              self.tree.tag_configure('image', foreground='purple')
              self.tree.tag_configure('error', foreground='red')
+             self.tree.tag_configure('binary', foreground='gray')
+             self.tree.tag_configure('more', foreground='gray')
              # Fallback 'selected' tag configuration
              self.tree.tag_configure('selected', background='lightblue', foreground='black')
 
@@ -214,13 +247,15 @@ class FileMergerApp:
         self.stats_frame = ttk.LabelFrame(self.right_frame, text="Statistics", padding=10)
         self.stats_frame.pack(fill=tk.X, pady=5)
         self.files_count_var = tk.StringVar(value="Total Items: 0")
-        self.selected_count_var = tk.StringVar(value="Selected Items: 0")
+        self.selected_count_var = tk.StringVar(value="Selected Files: 0")
         self.size_var = tk.StringVar(value="Selected Files Size: 0 B")
         self.chars_count_var = tk.StringVar(value="Selected Files Chars: 0")
+        self.tokens_count_var = tk.StringVar(value="Selected Files Tokens: ~0")
         ttk.Label(self.stats_frame, textvariable=self.files_count_var).pack(anchor=tk.W, padx=5, pady=1)
         ttk.Label(self.stats_frame, textvariable=self.selected_count_var).pack(anchor=tk.W, padx=5, pady=1)
         ttk.Label(self.stats_frame, textvariable=self.size_var).pack(anchor=tk.W, padx=5, pady=1)
         ttk.Label(self.stats_frame, textvariable=self.chars_count_var).pack(anchor=tk.W, padx=5, pady=1)
+        ttk.Label(self.stats_frame, textvariable=self.tokens_count_var).pack(anchor=tk.W, padx=5, pady=1)
 
         # Operations frame
         operations_frame = ttk.LabelFrame(self.right_frame, text="Operations", padding=10)
@@ -315,8 +350,8 @@ class FileMergerApp:
     def context_open_in_explorer(self):
         """Context menu action: Open the item's location in file explorer."""
         item_id = self.tree.focus() 
-        if item_id and item_id in self.file_operations.file_paths:
-            path = self.file_operations.file_paths[item_id]
+        path = self.file_operations.path_of(item_id) if item_id else None
+        if path:
             if os.path.exists(path):
                  try:
                      if os.path.isdir(path):
@@ -333,7 +368,7 @@ class FileMergerApp:
         """Recursively expand a tree node and its children."""
         if not self.tree.exists(item_id): return
         self.tree.item(item_id, open=True)
-        self.file_operations.on_tree_open(None) 
+        self.file_operations.load_children(item_id, background=False) 
         for child_id in self.tree.get_children(item_id):
             self.expand_recursive(child_id)
 
@@ -350,12 +385,12 @@ class FileMergerApp:
         """Handle left-click events. Toggles selection if any part of the row is clicked."""
         item_id = self.tree.identify_row(event.y)
         
+        if item_id and self.page_virtual_listing(item_id):
+            return "break"
         if item_id:
             # With selectmode="browse", a single click also focuses the item.
             # We use this click to toggle our custom selection state.
-            current_tags = list(self.tree.item(item_id, "tags"))
-            is_selected = "selected" in current_tags
-            new_select_state = not is_selected
+            new_select_state = not self.is_item_selected(item_id)
             self.update_item_selection(item_id, new_select_state)
             self.update_project_stats()
             # Return "break" might not be strictly necessary with "browse" mode
@@ -363,6 +398,21 @@ class FileMergerApp:
             # However, to ensure only our logic dictates the "selected" tag, keeping "break" is safer.
             return "break" 
         
+    def on_tree_yscroll(self, first, last):
+        """Scrollbar update from the tree; also lets huge folders page in rows as they scroll into view."""
+        if not self.filter_shown:
+            self.tree_scrollbar_y.set(first, last)
+        self.file_operations.on_tree_scrolled()
+
+    def page_virtual_listing(self, item_id):
+        """If item_id is a "more entries" row of a huge folder, show that part of it. Returns True if it was one."""
+        listing = self.file_operations.listing_for_row(item_id)
+        if listing is None:
+            return False
+        self.file_operations.page_listing(listing, forward=(item_id == listing.after_id))
+        self.update_project_stats()
+        return True
+
     def on_tree_double_click(self, event):
         """Handle double-clicks to open folders or files."""
         item_id = self.tree.identify_row(event.y)
@@ -372,7 +422,7 @@ class FileMergerApp:
             current_open_state = self.tree.item(item_id, "open")
             self.tree.item(item_id, open=not current_open_state)
         elif "file" in self.tree.item(item_id, "tags"):
-            path = self.file_operations.file_paths.get(item_id)
+            path = self.file_operations.path_of(item_id)
             if path and os.path.exists(path):
                 try:
                     os.startfile(path)
@@ -387,37 +437,70 @@ class FileMergerApp:
         if not self.tree.exists(item_id):
              return
 
+        # Record the change as one rule; a folder's unloaded contents follow it implicitly
+        # (placeholder/error rows have no path and are never part of the selection)
+        path = self.file_operations.path_of(item_id)
+        if path is not None:
+            is_dir = "folder" in self.tree.item(item_id, "tags")
+            was_fully_selected = self.selection.is_selected(path) and not self.selection.rules_below(path)
+            if should_select:
+                self.selection.select(path, is_dir)
+                if not was_fully_selected:
+                    self.stats_engine.add(path)
+            else:
+                self.selection.deselect(path, is_dir)
+                self.stats_engine.remove(path)
+
+        self._update_item_selection_recursive(item_id, should_select)
+
+        # Parent folders show a partial checkbox when only some of their contents are selected
+        parent_id = self.tree.parent(item_id)
+        while parent_id:
+            self.update_selection_indicator(parent_id)
+            parent_id = self.tree.parent(parent_id)
+
+
+    def _update_item_selection_recursive(self, item_id, should_select):
+        """Update the 'selected' tag and checkbox of an item and its loaded descendants."""
         current_tags = list(self.tree.item(item_id, "tags"))
+        is_currently_selected_via_tag = "selected" in current_tags
         current_tags = [tag for tag in current_tags if tag != 'selected']
-        # Check current "selected" state based on tags *before* modification
-        is_currently_selected_via_tag = "selected" in self.tree.item(item_id, "tags")
 
-        needs_tag_update = False
         if should_select:
-            if not is_currently_selected_via_tag:
-                current_tags.append("selected")
-                needs_tag_update = True
-        else: 
-            if is_currently_selected_via_tag:
-                needs_tag_update = True # Tag list is already prepared without 'selected'
-
-        if needs_tag_update:
-             self.tree.item(item_id, tags=tuple(current_tags))
-             self.update_selection_indicator(item_id) 
+            current_tags.append("selected")
+        if should_select != is_currently_selected_via_tag:
+            self.tree.item(item_id, tags=tuple(current_tags))
+        self.update_selection_indicator(item_id) 
 
-             if "folder" in current_tags or "folder" in self.tree.item(item_id, "tags"): # check original tags too
-                 for child_id in self.tree.get_children(item_id):
-                     self.update_item_selection(child_id, should_select)
+        # Recurse even if this row was unchanged: descendants may have had their own state
+        if "folder" in current_tags:
+            for child_id in self.tree.get_children(item_id):
+                self._update_item_selection_recursive(child_id, should_select)
 
 
     def update_selection_indicator(self, item_id):
         """Update the checkbox visual in the 'select' column."""
-        if not self.tree.exists(item_id): return
+        path = self.file_operations.path_of(item_id)
+        if path is None: return
+        self.tree.set(item_id, "select", self.selection_symbol(path)) 
+
+
+    def selection_symbol(self, path):
+        """Checkbox character for a path's selection state."""
+        state = self.selection.folder_state(path)
+        if state == "all":
+            return "☑"
+        elif state == "partial":
+            return "▣"
+        return "☐"
 
-        if "selected" in self.tree.item(item_id, "tags"):
-            self.tree.set(item_id, "select", "☑") 
-        else:
-            self.tree.set(item_id, "select", "☐") 
+
+    def is_item_selected(self, item_id):
+        """True if the entry shown in a tree row is selected (rows without a path go by their tag)."""
+        path = self.file_operations.path_of(item_id)
+        if path is None:
+            return self.tree.exists(item_id) and "selected" in self.tree.item(item_id, "tags")
+        return self.selection.is_selected(path)
 
 
     def toggle_selection_spacebar(self, event):
@@ -425,10 +508,10 @@ class FileMergerApp:
         item_id = self.tree.focus() 
         if not item_id:
             return
+        if self.page_virtual_listing(item_id):
+            return
 
-        current_tags = list(self.tree.item(item_id, "tags"))
-        is_selected = "selected" in current_tags
-        new_select_state = not is_selected
+        new_select_state = not self.is_item_selected(item_id)
 
         self.update_item_selection(item_id, new_select_state)
         self.update_project_stats()
@@ -464,6 +547,135 @@ class FileMergerApp:
         for item_id in self.tree.get_children(""):
             deselect_recursive(item_id) # update_item_selection will recurse
 
+        # Anything left is selected but not loaded in the tree
+        self.selection.clear()
+        self.stats_engine.reset()
+
+        self.update_project_stats()
+
+
+    def select_paths(self, paths, should_select=True):
+        """Select or deselect files by path, whether or not they have rows in the tree."""
+        changed = [path for path in paths if self.selection.is_selected(path) != should_select]
+        for path in changed:
+            if should_select:
+                self.selection.select(path, False)
+            else:
+                self.selection.deselect(path, False)
+                self.stats_engine.remove(path)
+        if should_select:
+            self.stats_engine.add_files(changed)
+
+        # Loaded rows of the files, then the checkboxes of the loaded folders above them
+        folders = set()
+        for path in changed:
+            item_id = self.file_operations.row_for(path)
+            if item_id is not None:
+                self._update_item_selection_recursive(item_id, should_select)
+            folder = os.path.dirname(path)
+            while folder not in folders and folder.startswith(self.root_dir):
+                folders.add(folder)
+                folder = os.path.dirname(folder)
+        for folder in folders:
+            item_id = self.file_operations.row_for(folder)
+            if item_id is not None:
+                self.update_selection_indicator(item_id)
+
+
+    def schedule_filter(self):
+        """Run the filter query once typing pauses."""
+        if self._filter_after is not None:
+            self.root.after_cancel(self._filter_after)
+        self._filter_after = self.root.after(self.FILTER_DELAY_MS, self.apply_filter)
+
+
+    def apply_filter(self):
+        """List the files matching the filter box in place of the tree (the tree again when it is empty)."""
+        self._filter_after = None
+        query = self.filter_var.get().strip()
+        if not query:
+            self.filter_matches = []
+            self.show_filter_results(False)
+            return
+        matches = self.file_operations.search_files(query)
+        if matches is None:
+            update_ui_status(self, "Indexing files for the filter...")
+            return # Runs again when the index is ready
+
+        self.filter_matches = matches
+        index = self.file_operations.file_index
+        self.filter_results.delete(*self.filter_results.get_children())
+        for row, line in enumerate(matches[:self.MAX_FILTER_ROWS]):
+            path = index.path(line)
+            check = "☑" if self.selection.is_selected(path) else "☐"
+            folder = os.path.relpath(os.path.dirname(path), self.root_dir)
+            self.filter_results.insert("", "end", iid=str(row), text=os.path.basename(path), values=(check, folder))
+        self.show_filter_results(True)
+        shown = f" (showing the first {self.MAX_FILTER_ROWS:,})" if len(matches) > self.MAX_FILTER_ROWS else ""
+        update_ui_status(self, f"{len(matches):,} file(s) match '{query}'{shown}.")
+
+
+    def show_filter_results(self, show):
+        """Swap the match list and the tree."""
+        if show == self.filter_shown:
+            return
+        self.filter_shown = show
+        if show:
+            self.tree.pack_forget()
+            self.filter_results.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self.tree_scrollbar_y.config(command=self.filter_results.yview)
+        else:
+            self.filter_results.pack_forget()
+            self.tree.pack(side=tk.LEFT, fill=tk.BOTH, expand=True)
+            self.tree_scrollbar_y.config(command=self.tree.yview)
+
+
+    def clear_filter(self):
+        """Empty the filter box and show the tree again."""
+        if self._filter_after is not None:
+            self.root.after_cancel(self._filter_after)
+        self.filter_var.set("")
+        self.apply_filter()
+
+
+    def on_filter_result_click(self, event):
+        """Toggle the selection of a match when its checkbox column is clicked."""
+        row = self.filter_results.identify_row(event.y)
+        if not row or self.filter_results.identify_column(event.x) != "#1":
+            return
+        path = self.file_operations.file_index.path(self.filter_matches[int(row)])
+        should_select = not self.selection.is_selected(path)
+        self.select_paths([path], should_select)
+        self.filter_results.set(row, "select", "☑" if should_select else "☐")
+        self.update_project_stats()
+
+
+    def select_filter_matches(self):
+        """Select every file matching the filter, including those not listed or loaded in the tree."""
+        if not self.filter_shown or not self.filter_matches:
+            return
+        index = self.file_operations.file_index
+        self.select_paths([index.path(line) for line in self.filter_matches], True)
+        for row in self.filter_results.get_children():
+            self.filter_results.set(row, "select", "☑")
+        self.update_project_stats()
+        update_ui_status(self, f"Selected {len(self.filter_matches):,} matching files.")
+
+
+    def reveal_filter_match(self, row=None):
+        """Show a match (the focused one, else the first) in the tree, loading only the folders above it."""
+        if not self.filter_shown or not self.filter_matches:
+            return
+        row = row or self.filter_results.focus() or "0"
+        path = self.file_operations.file_index.path(self.filter_matches[int(row)])
+        self.clear_filter()
+        item_id = self.file_operations.reveal_path(path)
+        if item_id is None:
+            update_ui_status(self, f"Could not show {path} in the tree.")
+            return
+        self.tree.see(item_id)
+        self.tree.focus(item_id)
+        self.tree.selection_set(item_id)
         self.update_project_stats()
 
 
@@ -482,12 +694,38 @@ class FileMergerApp:
         dialog = FileTypeDialog(self.root, self.ignored_file_types)
         self.root.wait_window(dialog)
         if dialog.result is not None: 
-            self.ignored_file_types = dialog.result
-            current_selections = set(self.file_operations.get_selected_paths())
-            self.file_operations.build_tree(self.root_dir, current_selections) 
+            self.set_ignored_file_types(dialog.result)
+            current_selections = self.file_operations.get_selected_paths()
+            self.file_operations.build_tree(self.root_dir, current_selections, self.file_operations.get_excluded_paths())
             self.project_manager.save_preferences() 
 
 
+    def edit_merge_options(self):
+        """Open dialog to edit the token budget used when merging."""
+        dialog = MergeOptionsDialog(self.root, self.merge_options, BUDGET_PRIORITIES)
+        self.root.wait_window(dialog)
+        if dialog.result is not None:
+            self.merge_options = dialog.result
+            self.update_project_stats()
+            self.project_manager._update_current_project_data()
+            self.project_manager.save_preferences()
+
+
+    def toggle_respect_gitignore(self):
+        """Turn .gitignore pruning on/off for the current project and rebuild the tree."""
+        self.respect_gitignore = self.respect_gitignore_var.get()
+        current_selections = self.file_operations.get_selected_paths()
+        self.file_operations.build_tree(self.root_dir, current_selections, self.file_operations.get_excluded_paths())
+        self.project_manager._update_current_project_data()
+        self.project_manager.save_preferences()
+
+
+    def set_ignored_file_types(self, ignored_file_types):
+        """Replace the ignored types/names list and recompile its matcher."""
+        self.ignored_file_types = ignored_file_types
+        self.ignore_matcher = IgnoreMatcher(ignored_file_types)
+
+
     def change_root_directory(self, path=None):
         """Change the root directory being displayed in the tree."""
         new_path_selected = False
@@ -513,6 +751,7 @@ class FileMergerApp:
         self.path_var.set(norm_path) 
 
         self.pending_selected_paths = set()
+        self.pending_excluded_paths = set()
         self.file_operations.build_tree(self.root_dir) 
 
         self.project_manager._update_current_project_data()
@@ -535,67 +774,45 @@ class FileMergerApp:
 
 
     def update_project_stats(self):
-        """Update the statistics display based on current selections."""
-        selected_paths = self.file_operations.get_selected_paths()
-        selected_files_only = self.file_operations.get_selected_files_only()
-
-        total_items_in_view = len(self.file_operations.file_paths)
+        """Update the statistics display from the running totals kept by stats_engine."""
+        engine = self.stats_engine
+        total_items_in_view = self.file_operations.item_count()
 
         self.stats["files"] = total_items_in_view
-        self.stats["selected"] = len(selected_paths) 
-        self.stats["size"] = calculate_project_size(self) 
-        self.stats["chars"] = count_characters_in_files(self) 
+        self.stats["selected"] = len(engine.counted) 
+        self.stats["size"] = engine.total_size 
+        self.stats["chars"] = engine.total_chars 
+        self.stats["tokens"] = engine.total_tokens
 
         size_str = format_size(self.stats['size']) 
         chars_str = f"{self.stats['chars']:,}" 
+        computing_str = " (computing…)" if engine.computing else ""
 
         self.files_count_var.set(f"Total Items: {self.stats['files']}")
-        self.selected_count_var.set(f"Selected Items: {self.stats['selected']}")
-        self.size_var.set(f"Selected Files Size: {size_str}")
-        self.chars_count_var.set(f"Selected Files Chars: {chars_str}")
+        binary_str = f" (+{len(engine.binary_files)} binary)" if engine.binary_files else ""
+        self.selected_count_var.set(f"Selected Files: {self.stats['selected']}{binary_str}{computing_str}")
+        self.size_var.set(f"Selected Files Size: {size_str}{computing_str}")
+        self.chars_count_var.set(f"Selected Files Chars: {chars_str}{computing_str}")
+        budget = self.merge_options.get("token_budget")
+        budget_str = f" of {budget:,} budget" if budget else ""
+        self.tokens_count_var.set(f"Selected Files Tokens: {format_tokens(self.stats['tokens'])}{budget_str}{computing_str}")
 
 
     def refresh_directory(self):
-        """Refresh the current directory view, preserving selections and open states."""
+        """Refresh the current directory view, patching only rows that changed on disk."""
         current_dir = self.root_dir
+        if self.file_operations.row_for(os.path.normpath(current_dir)) is None:
+            self.file_operations.build_tree(current_dir, self.file_operations.get_selected_paths(), self.file_operations.get_excluded_paths())
+            return
         update_ui_status(self, f"Refreshing directory: {current_dir}...")
 
-        previously_selected_paths = set(self.file_operations.get_selected_paths())
-        all_existing_paths_in_map = set(self.file_operations.file_paths.values())
+        new_rows = self.file_operations.refresh_tree()
 
-        open_paths = set()
-        def find_open_paths_recursive(parent_id):
-            for item_id in self.tree.get_children(parent_id):
-                if self.tree.exists(item_id) and self.tree.item(item_id, 'open'):
-                    path = self.file_operations.file_paths.get(item_id)
-                    if path and os.path.isdir(path): 
-                        open_paths.add(path)
-                        find_open_paths_recursive(item_id) 
-
-        find_open_paths_recursive("") 
-
-        self.file_operations.build_tree(current_dir, previously_selected_paths)
-        
         newly_selected_count = 0
-        for item_id, path in self.file_operations.file_paths.items():
-             if path not in all_existing_paths_in_map and path != current_dir:
-                if self.tree.exists(item_id) and "selected" not in self.tree.item(item_id, "tags"):
-                    self.update_item_selection(item_id, True) 
-                    newly_selected_count += 1
-
-        for path in open_paths:
-            new_item_id = path
-            if self.tree.exists(new_item_id):
-                try:
-                    if 'folder' in self.tree.item(new_item_id, 'tags'):
-                        self.tree.item(new_item_id, open=True)
-                        children = self.tree.get_children(new_item_id)
-                        if children and self.tree.exists(children[0]) and self.tree.item(children[0], "text") == "Loading...":
-                            self.tree.delete(children[0])
-                            self.file_operations.process_directory(path, new_item_id, depth=self.file_operations.get_item_depth(new_item_id))
-                except tk.TclError as e:
-                    print(f"Warning: Could not re-open item {new_item_id} for path {path}: {e}")
-
+        for item_id in new_rows:
+            if self.tree.exists(item_id) and not self.is_item_selected(item_id):
+                self.update_item_selection(item_id, True) 
+                newly_selected_count += 1
 
         self.update_project_stats() 
         restored_selection_count = len(self.file_operations.get_selected_paths())
@@ -610,8 +827,14 @@ class FileMergerApp:
         """Handle application close event."""
         try:
              self.project_manager._update_current_project_data()
-             self.project_manager.save_preferences()
+             self.project_manager.flush_preferences(wait=True)
         except Exception as e:
              print(f"Error saving preferences on close: {e}") 
         finally:
+            try:
+                self.stats_engine.shutdown()
+                self.file_operations.watcher.stop()
+                self.metadata_cache.close()
+            except Exception as e:
+                print(f"Error closing metadata cache: {e}")
             self.root.destroy() 
\ No newline at end of file
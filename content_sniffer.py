@@ -0,0 +1,56 @@
+import codecs
+
+SNIFF_SIZE = 8192 # Bytes read from the start of a file to classify it
+
+# Signatures of common binary formats that may lack a NUL byte in their first block
+MAGIC_NUMBERS = (
+    b"\x89PNG\r\n\x1a\n", b"\xff\xd8\xff", b"GIF87a", b"GIF89a", b"II*\x00", b"MM\x00*",
+    b"%PDF-", b"PK\x03\x04", b"PK\x05\x06", b"\x1f\x8b", b"\xfd7zXZ\x00", b"7z\xbc\xaf\x27\x1c",
+    b"Rar!\x1a\x07", b"\x7fELF", b"\xca\xfe\xba\xbe", b"\xcf\xfa\xed\xfe", b"\xce\xfa\xed\xfe",
+    b"\x00asm", b"SQLite format 3\x00", b"OggS", b"RIFF", b"fLaC", b"\x1a\x45\xdf\xa3",
+    b"\xd0\xcf\x11\xe0\xa1\xb1\x1a\xe1", b"wOFF", b"wOF2",
+)
+# Short signatures a text file could also start with; only trusted with a control byte nearby
+WEAK_MAGIC_NUMBERS = (b"MZ", b"BM", b"BZh", b"ID3")
+
+
+def _utf16_without_bom(head):
+    """Return "utf-16-le"/"utf-16-be" if head looks like mostly-ASCII UTF-16 text without a BOM"""
+    if len(head) < 4:
+        return None
+    even = head[0::2]
+    odd = head[1::2]
+    # ASCII in UTF-16 has a NUL in every other byte and none in between
+    if odd.count(0) >= len(odd) * 0.9 and even.count(0) == 0:
+        return "utf-16-le"
+    if even.count(0) >= len(even) * 0.9 and odd.count(0) == 0:
+        return "utf-16-be"
+    return None
+
+
+def sniff_bytes(head):
+    """Classify the first bytes of a file. Returns (encoding, is_binary); encoding is None for binaries"""
+    if head.startswith(codecs.BOM_UTF8):
+        return "utf-8-sig", False
+    if head.startswith(codecs.BOM_UTF16_LE) or head.startswith(codecs.BOM_UTF16_BE):
+        return "utf-16", False
+    if head.startswith(MAGIC_NUMBERS):
+        return None, True
+    if head.startswith(WEAK_MAGIC_NUMBERS) and any(b < 9 for b in head[:64]):
+        return None, True
+    if b"\x00" in head:
+        encoding = _utf16_without_bom(head)
+        return (encoding, False) if encoding else (None, True)
+    try:
+        head.decode("utf-8")
+    except UnicodeDecodeError as e:
+        # A multi-byte character cut off at the end of the sample is still valid UTF-8
+        if e.start < len(head) - 3:
+            return "latin-1", False
+    return "utf-8", False
+
+
+def sniff_file(path):
+    """Read only the first SNIFF_SIZE bytes of path and classify it (see sniff_bytes)"""
+    with open(path, "rb") as f:
+        return sniff_bytes(f.read(SNIFF_SIZE))
@@ -0,0 +1,229 @@
+"""Headless exports without Tk, for scripts, CI and cron jobs.
+
+    python -m export_cli --project "My Project" [-o out.txt]
+    python -m export_cli --root ~/src/app --include "*.py" --exclude "tests/*" -o out.txt
+
+Saved projects are read from ~/.filemerger/preferences.json (see --config) and
+exported exactly as the GUI would merge their saved selection.
+"""
+import os
+import sys
+import fnmatch
+import argparse
+
+import merge_engine
+import project_store
+from gitignore import GitIgnoreRules
+from ignore_rules import IgnoreMatcher, DEFAULT_IGNORED_FILE_TYPES
+from content_sniffer import sniff_file
+from metadata_cache import MetadataCache, analyze_file, hash_file
+from scanner import walk_files
+from selection_model import SelectionModel
+
+
+def _filters(root, ignored_file_types, respect_gitignore):
+    """The is_ignored/gitignore filters the file tree would use for root"""
+    matcher = IgnoreMatcher(ignored_file_types)
+    gitignore = GitIgnoreRules(root) if respect_gitignore else None
+    return matcher.is_ignored, gitignore
+
+
+def collect_project_files(project_data):
+    """Return (root, files) for the saved selection of a project"""
+    root = os.path.normpath(project_data.get("root_dir", os.getcwd()))
+    is_ignored, gitignore = _filters(
+        root,
+        project_data.get("ignored_file_types", DEFAULT_IGNORED_FILE_TYPES),
+        project_data.get("respect_gitignore", False)
+    )
+    selection = SelectionModel()
+    selection.load(*project_store.saved_selection(project_data, root))
+    walk = lambda folder, skip: walk_files(folder, skip, is_ignored, gitignore)
+    files = [f for f in selection.iter_selected_files(walk) if gitignore is None or not gitignore.is_excluded(f)]
+    return root, files
+
+
+def _matches(rel_path, patterns):
+    """Match a "/"-separated relative path, or its basename for patterns without "/", against globs"""
+    name = rel_path.rsplit("/", 1)[-1]
+    for pattern in patterns:
+        if fnmatch.fnmatch(rel_path, pattern) or ("/" not in pattern and fnmatch.fnmatch(name, pattern)):
+            return True
+    return False
+
+
+def collect_glob_files(root, include=("*",), exclude=(), ignored_file_types=None, respect_gitignore=False):
+    """Return the files below root whose relative paths match include and not exclude"""
+    root = os.path.normpath(root)
+    if ignored_file_types is None:
+        ignored_file_types = DEFAULT_IGNORED_FILE_TYPES
+    is_ignored, gitignore = _filters(root, ignored_file_types, respect_gitignore)
+    files = []
+    for file_path in walk_files(root, (), is_ignored, gitignore):
+        rel_path = os.path.relpath(file_path, root).replace(os.sep, "/")
+        if _matches(rel_path, include) and not _matches(rel_path, exclude):
+            files.append(file_path)
+    return files
+
+
+def export_files(files, output_path, prompt="", project_rules="", options=None, on_progress=None):
+    """Merge files into output_path with merge options (token budget, per-file caps, duplicates).
+
+    Returns (path written, number of files merged); with export_mode "changes"
+    only files changed since the last full export are written, to the path
+    from merge_engine.changes_path. Encodings, token counts and hashes come
+    from the metadata cache when ~/.filemerger exists.
+    """
+    output_dir = os.path.dirname(os.path.abspath(output_path))
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    options = dict(project_store.DEFAULT_MERGE_OPTIONS, **(options or {}))
+    cache = MetadataCache(project_store.CONFIG_DIR) if os.path.isdir(project_store.CONFIG_DIR) else None
+    try:
+        record_for = cache.lookup if cache is not None else None
+        analyze = cache.analyze if cache is not None else _analyze_uncached
+        if options.get("binary_files") == "skip":
+            files = [f for f in files if not _is_binary(cache, f)]
+        content_hash = cache.content_hash if cache is not None else hash_file
+        keep_manifest = bool(options.get("reuse_unchanged") or options.get("export_mode") == "changes")
+        change_notes = []
+        if options.get("export_mode") == "changes":
+            changes = merge_engine.plan_changes(files, output_path, content_hash)
+            if changes is None:
+                options["export_mode"] = "full"
+            else:
+                files, change_notes = changes
+                output_path = merge_engine.changes_path(output_path)
+        duplicates = {}
+        if options.get("deduplicate"):
+            duplicates = merge_engine.find_duplicates(
+                [f for f in files if not _is_binary(cache, f)], os.path.getsize, content_hash
+            )
+        files, max_lines, notes = merge_engine.apply_token_budget(files, options, analyze, prompt, project_rules, duplicates)
+        duplicates = merge_engine.resolve_duplicates(files, duplicates)
+        notes = change_notes + notes + merge_engine.duplicates_note(duplicates)
+        merge_engine.merge_files(files, output_path, prompt, project_rules, record_for=record_for,
+                                 on_progress=on_progress, max_lines=max_lines, notes=notes, limits=options,
+                                 duplicates=duplicates, reuse_previous=options.get("reuse_unchanged"),
+                                 hash_of=content_hash if keep_manifest else None,
+                                 write_manifest=keep_manifest and options.get("export_mode") != "changes")
+    finally:
+        if cache is not None:
+            cache.close()
+    return output_path, len(files)
+
+
+def _is_binary(cache, path):
+    if cache is not None:
+        return cache.is_binary(path)
+    try:
+        return sniff_file(path)[1]
+    except OSError:
+        return False
+
+
+def _analyze_uncached(path):
+    record = analyze_file(path)
+    stats = os.stat(path)
+    record["size"] = stats.st_size
+    record["mtime"] = stats.st_mtime
+    return record
+
+
+def export_project(project_name, output_path=None, config_file=project_store.PREFERENCES_FILE, options=None):
+    """Export a saved project. Returns (path written, number of files). Raises KeyError for unknown projects
+
+    `options` override the project's saved merge options (e.g. {"token_budget": 8000}).
+    """
+    projects, _ = project_store.load_preferences(config_file)
+    if project_name not in projects:
+        raise KeyError(project_name)
+    project_data = projects[project_name]
+    root, files = collect_project_files(project_data)
+    if output_path is None:
+        output_dir = project_data.get("output_dir", os.path.join(os.path.expanduser("~"), "Merged_Files"))
+        output_path = os.path.join(output_dir, f"{project_name}.txt")
+    merge_options = project_store.merge_options(project_data)
+    merge_options.update(options or {})
+    return export_files(
+        files, output_path,
+        project_data.get("prompt", "").strip(),
+        project_store.project_rules_text(project_data).strip(),
+        merge_options
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m export_cli", description="Merge files into a single export without the GUI.")
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--project", help="name of a project saved by the GUI")
+    source.add_argument("--root", help="directory to export instead of a saved project")
+    source.add_argument("--list-projects", action="store_true", help="list saved projects and exit")
+    parser.add_argument("-o", "--output", help="output file (default: <project output dir>/<project>.txt)")
+    parser.add_argument("--include", action="append", help="glob of files to include with --root (repeatable, default: *)")
+    parser.add_argument("--exclude", action="append", default=[], help="glob of files to leave out with --root (repeatable)")
+    parser.add_argument("--gitignore", action="store_true", help="skip paths excluded by .gitignore files (with --root)")
+    parser.add_argument("--prompt", default="", help="goal text written at the top of the export (with --root)")
+    parser.add_argument("--rules", default="", help="rules text written at the top of the export (with --root)")
+    parser.add_argument("--token-budget", type=int, help="max estimated tokens in the export (0 = no limit)")
+    parser.add_argument("--budget-priority", choices=sorted(merge_engine.BUDGET_PRIORITIES), help="order in which files claim the token budget")
+    parser.add_argument("--skip-over-budget", action="store_true", help="skip files that do not fit instead of truncating one")
+    parser.add_argument("--skip-binary", action="store_true", help="leave binary files out instead of writing a one-line note")
+    parser.add_argument("--keep-duplicates", action="store_true", help="write files with identical content in full every time")
+    parser.add_argument("--changes-only", action="store_true", help="write only files added, modified or removed since the last full export, to <output>.changes.txt")
+    parser.add_argument("--no-reuse", action="store_true", help="re-read every file instead of copying unchanged blocks from the previous export")
+    parser.add_argument("--max-file-bytes", type=int, help="keep only the head and tail of files larger than this many bytes")
+    parser.add_argument("--max-file-lines", type=int, help="keep only the head and tail of files longer than this many lines")
+    parser.add_argument("--max-file-tokens", type=int, help="keep only the head and tail of files over this many estimated tokens")
+    parser.add_argument("--config", default=project_store.PREFERENCES_FILE, help="preferences file to read projects from")
+    parser.add_argument("-q", "--quiet", action="store_true", help="only print errors")
+    args = parser.parse_args(argv)
+
+    if args.list_projects:
+        index, current_project, _ = project_store.load_index(args.config)
+        for name in sorted(index):
+            marker = "*" if name == current_project else " "
+            print(f"{marker} {name}\t{index[name].get('root_dir', '')}")
+        return 0
+
+    options = {}
+    if args.token_budget is not None:
+        options["token_budget"] = args.token_budget
+    if args.budget_priority:
+        options["budget_priority"] = args.budget_priority
+    if args.skip_over_budget:
+        options["budget_overflow"] = "skip"
+    if args.skip_binary:
+        options["binary_files"] = "skip"
+    if args.changes_only:
+        options["export_mode"] = "changes"
+    if args.no_reuse:
+        options["reuse_unchanged"] = False
+    if args.keep_duplicates:
+        options["deduplicate"] = False
+    for key in merge_engine.LIMIT_KEYS:
+        if getattr(args, key) is not None:
+            options[key] = getattr(args, key)
+
+    if args.project:
+        try:
+            output_path, count = export_project(args.project, args.output, args.config, options)
+        except KeyError:
+            print(f"Error: No saved project named '{args.project}' in {args.config}", file=sys.stderr)
+            return 1
+    else:
+        if not os.path.isdir(args.root):
+            print(f"Error: Not a directory: {args.root}", file=sys.stderr)
+            return 1
+        if not args.output:
+            parser.error("--output is required with --root")
+        files = collect_glob_files(args.root, args.include or ["*"], args.exclude, respect_gitignore=args.gitignore)
+        output_path, count = export_files(files, args.output, args.prompt.strip(), args.rules.strip(), options)
+
+    if not args.quiet:
+        print(f"Merged {count} files into {output_path}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
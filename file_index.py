@@ -0,0 +1,238 @@
+import os
+import re
+import queue
+import threading
+import time
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+
+_GLOB_CHARS = set("*?[")
+_GLOB_SPLIT = re.compile(r"\*|\?|\[[^\]]*\]")
+
+
+def _translate_glob(pattern):
+    """Translate a glob into a regex fragment that stays within one line of the index.
+
+    Like fnmatch (and export_cli --include), "*" also matches "/".
+    """
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            parts.append("[^\n]*")
+        elif c == "?":
+            parts.append("[^\n]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^\n" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+def _fuzzy(query):
+    """Regex fragment matching lines that contain the characters of query in order"""
+    parts = [re.escape(query[0])]
+    for c in query[1:]:
+        # A class excluding the next character keeps the match linear (no backtracking)
+        parts.append("[^" + re.escape(c) + "\n]*" + re.escape(c))
+    return "".join(parts)
+
+
+class FileIndex:
+    """Every file below the tree's root, for the filter box above the tree.
+
+    The relative paths are kept as one newline-joined string (plus one of the
+    lower-cased file names) with an array of line offsets, instead of a list
+    of path strings: a query is a single str.find or regex scan over that text
+    in C, so substring, glob and fuzzy queries take milliseconds even for a
+    million files, and the index costs little more than the paths' characters.
+    It is built by a background walk and swapped in on the Tk thread, from a
+    root.after() poll loop like DirectoryScanner's.
+    """
+    POLL_MS = 50
+    REBUILD_SECONDS = 10.0 # Least time between builds of an index that is only stale (see mark_stale)
+
+    def __init__(self, root):
+        self.root = root
+        self.generation = 0 # Bumped by invalidate(); builds of older generations are dropped
+        self.building_folder = None
+        self.stale = True
+        self.building = False
+        self.changes = 0 # Bumped by mark_stale()
+        self._built_at = None # time.monotonic() of the last build start, for the rate limit
+        self._rebuild_after = None
+        self._results = queue.Queue()
+        self._polling = False
+        self._on_ready = None
+        self._set_data(None, "", "", "", array("q", [0]), array("q", [0]))
+
+    def _set_data(self, folder, paths, lower_paths, names, path_starts, name_starts):
+        self.folder = folder # Folder the indexed paths are relative to
+        self._paths = paths # Relative "/"-separated paths, one per line, in tree order
+        self._lower_paths = lower_paths # The same, lower-cased for matching
+        self._names = names # Lower-cased file names, same lines
+        self._path_starts = path_starts # Offset of each line of _paths, plus the length of _paths at the end
+        self._name_starts = name_starts # Same for _names
+
+    def __len__(self):
+        return len(self._path_starts) - 1
+
+    def invalidate(self):
+        """Mark the index out of date (files were added, removed or filtered differently)"""
+        self.generation += 1
+        self.stale = True
+        self.building = False
+        self._built_at = None # The next build starts at once
+        if self._rebuild_after is not None:
+            self.root.after_cancel(self._rebuild_after)
+            self._rebuild_after = None
+
+    def mark_stale(self):
+        """Note that files were added or removed below the folder (e.g. by the watcher).
+
+        Unlike invalidate(), the index and any build in progress are kept:
+        queries are answered from them meanwhile, and the next build starts
+        no sooner than REBUILD_SECONDS after the previous one, so a stream of
+        changes does not re-walk the whole folder every time.
+        """
+        self.changes += 1
+        self.stale = True
+
+    def build(self, folder, walk_files, on_ready=None):
+        """Index the files walk_files(folder) yields in the background; on_ready() runs on the Tk thread when done"""
+        if (self.building and folder == self.building_folder) or self._rebuild_after is not None:
+            self._on_ready = on_ready or self._on_ready
+            return
+        if folder == self.folder and self._built_at is not None:
+            wait = self._built_at + self.REBUILD_SECONDS - time.monotonic()
+            if wait > 0:
+                self._on_ready = on_ready or self._on_ready
+                self._rebuild_after = self.root.after(int(wait * 1000) + 1, self._rebuild, folder, walk_files)
+                return
+        self.invalidate()
+        self.building_folder = folder
+        self.building = True
+        self._built_at = time.monotonic()
+        self._on_ready = on_ready
+        threading.Thread(target=self._worker, args=(folder, walk_files, self.generation, self.changes), daemon=True).start()
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.POLL_MS, self._poll)
+
+    def _rebuild(self, folder, walk_files):
+        self._rebuild_after = None
+        if self.stale:
+            self.build(folder, walk_files, self._on_ready)
+
+    def _worker(self, folder, walk_files, generation, changes):
+        try:
+            prefix_len = len(os.path.join(folder, ""))
+            rel_paths = []
+            for path in walk_files(folder):
+                if generation != self.generation:
+                    return # Invalidated meanwhile; a newer build replaces this one
+                rel_paths.append(path[prefix_len:].replace(os.sep, "/"))
+            names = [rel_path.rsplit("/", 1)[-1].lower() for rel_path in rel_paths]
+            paths = "".join(rel_path + "\n" for rel_path in rel_paths)
+            self._results.put((generation, changes, (
+                folder,
+                paths,
+                paths.lower(),
+                "".join(name + "\n" for name in names),
+                array("q", accumulate((len(rel_path) + 1 for rel_path in rel_paths), initial=0)),
+                array("q", accumulate((len(name) + 1 for name in names), initial=0)),
+            )))
+        except Exception as e:
+            print(f"Warning: Could not index files below {folder}: {e}")
+            self._results.put((generation, changes, None))
+
+    def _poll(self):
+        while True:
+            try:
+                generation, changes, data = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if generation != self.generation:
+                continue
+            self.building = False
+            if data is not None:
+                self._set_data(*data)
+                self.stale = changes != self.changes # Changed again while walking: rebuild on a later query
+            if self._on_ready is not None:
+                self._on_ready()
+
+        if self.building:
+            self.root.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+    def search(self, query):
+        """Line numbers of the files matching query, in tree order (see path()).
+
+        Matching is case-insensitive. A query containing "/" is matched against
+        relative paths, otherwise against file names. Queries with *, ? or [
+        are globs that must match the whole name/path; other text matches
+        anywhere in it, and if nothing contains it, names (or paths) holding its
+        characters in that order are returned instead (fuzzy matching).
+        """
+        query = query.strip().lower().replace("\\", "/")
+        if not query or not len(self):
+            return []
+        if "/" in query:
+            text, starts = self._lower_paths, self._path_starts
+        else:
+            text, starts = self._names, self._name_starts
+        if _GLOB_CHARS & set(query):
+            regex = re.compile(_translate_glob(query))
+            # Only lines containing the glob's longest literal part can match; find those first
+            literal = max(_GLOB_SPLIT.split(query), key=len)
+            if not literal:
+                return self._lines_matching(text, starts, re.compile("^" + regex.pattern + "$", re.MULTILINE))
+            return [line for line in self._lines_with(text, starts, literal)
+                    if regex.fullmatch(text, starts[line], starts[line + 1] - 1)]
+        lines = self._lines_with(text, starts, query)
+        if not lines:
+            lines = self._lines_matching(text, starts, re.compile(_fuzzy(query)))
+        return lines
+
+    @staticmethod
+    def _lines_with(text, starts, needle):
+        """Lines of text containing needle, each once"""
+        lines = []
+        pos = text.find(needle)
+        while pos != -1:
+            line = bisect_right(starts, pos) - 1
+            lines.append(line)
+            pos = text.find(needle, starts[line + 1])
+        return lines
+
+    @staticmethod
+    def _lines_matching(text, starts, regex):
+        """Lines of text where regex matches, each once"""
+        lines = []
+        end = -1
+        for match in regex.finditer(text):
+            if match.start() < end:
+                continue
+            if match.start() >= len(text):
+                break # An empty match after the last line
+            line = bisect_right(starts, match.start()) - 1
+            lines.append(line)
+            end = starts[line + 1]
+        return lines
+
+    def path(self, line):
+        """Full path of the file on a line returned by search()"""
+        rel_path = self._paths[self._path_starts[line]:self._path_starts[line + 1] - 1]
+        return os.path.join(self.folder, rel_path.replace("/", os.sep))
@@ -1,29 +1,54 @@
 import os
 import datetime
-import shutil
 import threading
 import tkinter as tk
 from tkinter import messagebox, filedialog
 import time
 
+import merge_engine
 from ui_dialogs import ProgressDialog
+from scanner import DirectoryScanner, scan_directory, scan_entry, walk_files
+from fs_watcher import DirectoryWatcher
+from virtual_listing import VirtualListing, kind_of, KIND_FILE, KIND_DIR, KIND_ERROR
+from node_store import NodeStore
+from file_index import FileIndex
+from gitignore import GitIgnoreRules
 from utils import update_ui_status, format_size # Added format_size import if needed here, though likely used more in app.py
 
 class FileOperations:
+    PROGRESS_INTERVAL = 0.05 # Seconds between merge progress redraws
+    VIRTUAL_THRESHOLD = 2000 # Folders with more entries only get rows for a window of them
+    WINDOW_ROWS = 1000 # Most rows such a folder shows at once
+    PAGE_ROWS = 250 # Rows added (and dropped at the other end) when its window moves
+
     def __init__(self, app):
         self.app = app
-        self.file_paths = {}  # Maps tree IDs (which are paths) to file paths
-        self.pending_selection_restore = set() # Store paths to select during build and subsequent lazy loads for that cycle
-
-    def build_tree(self, path, selected_paths_to_restore=None):
+        self.nodes = NodeStore() # Entries with tree rows; a row's iid is its node id (see row_for/path_of)
+        self.scanner = DirectoryScanner(app.root) # Background os.scandir listings for expanded folders
+        self.gitignore = None # GitIgnoreRules for the current root when app.respect_gitignore is on
+        self.watcher = DirectoryWatcher(app.root, self.apply_changes) # Keeps loaded folders in sync with the disk
+        self.listings = {} # Folder id -> VirtualListing for folders too big to show in full
+        self._window_check_pending = False
+        self.file_index = FileIndex(app.root) # File names below the root for the filter box, built on first use
+
+    def build_tree(self, path, selected_paths_to_restore=None, excluded_paths_to_restore=None):
         """Build the file tree from the given root path, applying selection state during build."""
-        self.pending_selection_restore = selected_paths_to_restore if selected_paths_to_restore is not None else set()
+        self.scanner.cancel_all() # Rows from scans of the old tree must not land in the new one
+        self.watcher.unwatch_all()
+
+        # The selection is kept as rules (see SelectionModel), so folders that are never
+        # expanded still keep, count and merge their saved selections
+        self.app.selection.load(selected_paths_to_restore or (), excluded_paths_to_restore or ())
+        self.app.stats_engine.reset()
+        for selected_path in self.app.selection.included_paths():
+            self.app.stats_engine.add(selected_path)
 
         for item in self.app.tree.get_children():
             if self.app.tree.exists(item): 
                 self.app.tree.delete(item)
 
-        self.file_paths = {} 
+        self.nodes.clear()
+        self.listings = {}
 
         try:
             norm_path = os.path.normpath(path)
@@ -40,175 +65,699 @@ class FileOperations:
                      return 
 
             root_name = os.path.basename(norm_path) or norm_path 
+            # Re-read .gitignore files on every build so edits to them are picked up
+            self.gitignore = GitIgnoreRules(norm_path) if self.app.respect_gitignore else None
+            self.file_index.invalidate()
         except Exception as e:
             messagebox.showerror("Error Setting Root", f"Failed to set root path '{path}': {e}")
             return 
 
-        self.add_node("", root_name, norm_path, "directory") 
+        root_id = self.add_node("", root_name, norm_path, "directory") 
 
-        if self.app.tree.exists(norm_path): 
-             self.app.tree.item(norm_path, open=True) 
-             self.process_directory(norm_path, norm_path) 
+        if root_id is not None: 
+             self.app.tree.item(root_id, open=True) 
+             self.process_directory(norm_path, root_id) 
+             self.watcher.watch(norm_path)
         else:
             messagebox.showerror("Error", f"Failed to insert root node for path: {norm_path}")
-            self.pending_selection_restore = set() 
             return 
 
         update_ui_status(self.app, f"Loaded directory: {self.app.root_dir}")
         self.app.update_project_stats()
+        self.app.apply_filter()
 
     def process_directory(self, path, parent_id, depth=0):
         """Process the contents of a directory for the tree view"""
         try:
-            if depth > 15:  
-                error_text = "Max depth reached"
-                error_iid = f"{path}_error_max_depth_{depth}"
-                self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
+            if depth > 15:
+                self._insert_listing_error(path, parent_id, None, depth)
                 return
 
             try:
-                items = os.listdir(path)
-            except PermissionError:
-                 error_text = "Permission denied"
-                 error_iid = f"{path}_error_permission"
-                 self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
-                 return
-            except FileNotFoundError:
-                error_text = "Not Found"
-                error_iid = f"{path}_error_notfound"
-                self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
-                return
+                entries = scan_directory(path, **self.scan_options())
             except Exception as e:
-                 error_text = f"Error listing: {e}"
-                 error_iid = f"{path}_error_listing_{type(e).__name__}"
-                 self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
-                 return
+                self._insert_listing_error(path, parent_id, e)
+                return
 
-            items.sort(key=lambda x: (not os.path.isdir(os.path.join(path, x)), x.lower()))
-
-            for item in items:
-                full_path = os.path.join(path, item)
-                norm_full_path = os.path.normpath(full_path) 
-
-                base_name = os.path.basename(item)
-                ext = os.path.splitext(item)[1].lower()
-                if base_name.startswith(".") or \
-                   any(ignore.lower() == base_name.lower() for ignore in self.app.ignored_file_types) or \
-                   any(ignore.lower() == ext for ignore in self.app.ignored_file_types if ignore.startswith('.')):
-                    continue
-
-                try:
-                    stats = os.stat(norm_full_path) 
-                    size = stats.st_size
-                    modified = datetime.datetime.fromtimestamp(stats.st_mtime).strftime("%Y-%m-%d %H:%M")
-
-                    if os.path.isdir(norm_full_path):
-                        node_id = self.add_node(parent_id, item, norm_full_path, "directory")
-                        if node_id: 
-                            placeholder_iid = f"{norm_full_path}_placeholder"
-                            self.app.tree.insert(node_id, "end", iid=placeholder_iid, text="Loading...", values=("", "", ""))
-                    else:
-                        size_str = format_size(size)
-                        self.add_node(parent_id, item, norm_full_path, "file", size_str, modified)
-                except PermissionError:
-                    self.add_node(parent_id, item + " (Access Denied)", norm_full_path, "error")
-                except FileNotFoundError:
-                     self.add_node(parent_id, item + " (Not Found)", norm_full_path, "error")
-                except Exception as e:
-                    print(f"Warning: Could not process item {norm_full_path}: {e}") 
-                    self.add_node(parent_id, item + f" (Error: {type(e).__name__})", norm_full_path, "error")
-                    continue
+            self.start_listing(parent_id, len(entries))
+            self.insert_entries(parent_id, entries)
+            self.classify_later(entries)
         except Exception as e:
             print(f"Error processing directory {path}: {e}") 
             error_text=f"Error: {str(e)}"
-            error_iid = f"{path}_error_processing_{type(e).__name__}"
+            error_iid = f"{parent_id}_error_processing_{type(e).__name__}"
             self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
 
-    def add_node(self, parent_iid, text, norm_full_path, node_type, size_str="", modified=""):
-        """Add a node to the tree view using the normalized path as iid"""
-        if self.app.tree.exists(norm_full_path):
-            return norm_full_path 
+    def process_directory_async(self, path, parent_id, depth=0):
+        """List a directory on a worker thread and stream its rows into the tree"""
+        if depth > 15:
+            self._insert_listing_error(path, parent_id, None, depth)
+            return
+
+        update_ui_status(self.app, f"Loading {path}...")
+        self.scanner.scan_async(
+            path,
+            on_batch=lambda entries: self._on_scan_batch(parent_id, entries),
+            on_done=lambda: self._on_scan_done(path),
+            on_error=lambda e: self._on_scan_error(path, parent_id, e),
+            on_listed=lambda total: self._on_scan_listed(parent_id, total),
+            **self.scan_options(background=True)
+        )
+
+    def _on_scan_listed(self, parent_id, total):
+        if self.app.tree.exists(parent_id):
+            self.start_listing(parent_id, total)
+
+    def _on_scan_batch(self, parent_id, entries):
+        if self.app.tree.exists(parent_id):
+            self.insert_entries(parent_id, entries)
 
+    def _on_scan_done(self, path):
+        self.app.metadata_cache.flush() # Binary checks made by the scan
+        update_ui_status(self.app, f"Loaded directory: {path}")
+        self.app.update_project_stats()
+
+    def _on_scan_error(self, path, parent_id, error):
+        if self.app.tree.exists(parent_id):
+            self._insert_listing_error(path, parent_id, error)
+        update_ui_status(self.app)
+
+    def is_ignored(self, name):
+        """Return True if a directory entry should be hidden from the tree"""
+        return self.app.ignore_matcher.is_ignored(name)
+
+    def scan_options(self, background=False):
+        """Filters and checks passed to scanner.scan_directory for the current tree.
+
+        Only background scans sniff files for binary content; listings made on
+        the Tk thread use cached results and leave the rest to classify_later.
+        """
+        cache = self.app.metadata_cache
+        return {"is_ignored": self.is_ignored, "gitignore": self.gitignore,
+                "is_binary": cache.is_binary if background else cache.cached_is_binary}
+
+    def classify_later(self, entries):
+        """Sniff the files of a Tk-thread listing that the cache could not classify, then re-tag their rows"""
+        paths = [entry.path for entry in entries if entry.is_binary is None]
+        if paths:
+            self.scanner.run_async(self._sniff_files, self._apply_binary_checks, paths)
+
+    def _sniff_files(self, paths):
+        """Worker side of classify_later: [(path, is_binary)]"""
+        cache = self.app.metadata_cache
+        checks = [(path, cache.is_binary(path)) for path in paths]
+        cache.flush()
+        return checks
+
+    def _apply_binary_checks(self, checks):
+        """Set the "binary" tag of rows (and virtual listing entries) of files classified after they were listed"""
+        tree = self.app.tree
+        by_folder = {}
+        for path, is_binary in checks:
+            row_id = self.row_for(path)
+            if row_id is not None:
+                tags = tuple(tree.item(row_id, "tags"))
+                if ("binary" in tags) != is_binary:
+                    tree.item(row_id, tags=tuple(t for t in tags if t != "binary") + (("binary",) if is_binary else ()))
+            by_folder.setdefault(os.path.dirname(path), {})[os.path.basename(path)] = is_binary
+        for folder, flags in by_folder.items():
+            listing = self.listings.get(self.row_for(folder))
+            if listing is not None:
+                listing.set_binary(flags)
+
+    def is_excluded_by_gitignore(self, path):
+        """Return True if .gitignore mode is on and excludes path (or a folder above it)"""
+        return self.gitignore is not None and self.gitignore.is_excluded(path)
+
+    def insert_entries(self, parent_id, entries):
+        """Insert scanned entries (see scanner.ScanEntry) under parent_id"""
+        listing = self.listings.get(parent_id)
+        if listing is not None:
+            listing.extend(entries)
+            self._fill_window(listing)
+            return
+        for entry in entries:
+            self.insert_entry(parent_id, entry)
+
+    def start_listing(self, parent_id, total):
+        """Switch a folder about to receive `total` entries to a windowed listing if it is huge"""
+        if total > self.VIRTUAL_THRESHOLD:
+            self.listings[parent_id] = VirtualListing(self.path_of(parent_id), parent_id)
+
+    def row_for(self, path):
+        """Tree row id of the entry at a normalized path, or None if it has no row"""
+        node_id = self.nodes.find(path)
+        return None if node_id is None else str(node_id)
+
+    def path_of(self, row_id):
+        """Path of the entry shown in a tree row, or None for placeholder, error and "more entries" rows"""
+        node_id = self._node(row_id)
+        return None if node_id is None else self.nodes.path(node_id)
+
+    def _node(self, row_id):
+        """Node id of an entry's tree row, or None for other rows"""
+        if not row_id.isdigit():
+            return None
+        node_id = int(row_id)
+        return node_id if node_id in self.nodes else None
+
+    def _child_row(self, parent_id, name):
+        """Row id of the entry called name in folder row parent_id, or None"""
+        node_id = self.nodes.child(int(parent_id), name)
+        return None if node_id is None else str(node_id)
+
+    def item_count(self):
+        """Number of entries known in the tree, including those of virtual folders without rows"""
+        return len(self.nodes) + sum(len(listing) - (listing.end - listing.start) for listing in self.listings.values())
+
+    def _fill_window(self, listing):
+        """Give rows to newly listed entries until the window is full"""
+        offset = 1 if listing.start > 0 else 0
+        while listing.end < len(listing) and listing.end - listing.start < self.WINDOW_ROWS:
+            self.insert_entry(listing.folder_id, listing.entry(listing.end), offset + listing.end - listing.start)
+            listing.end += 1
+        self._update_window_rows(listing)
+
+    def _update_window_rows(self, listing):
+        """Show the "more entries" rows above and below a virtual folder's window as needed"""
+        tree = self.app.tree
+        for row_id, count, index, arrow, where in (
+                (listing.before_id, listing.start, 0, "▲", "earlier"),
+                (listing.after_id, len(listing) - listing.end, "end", "▼", "more")):
+            if count <= 0:
+                if tree.exists(row_id):
+                    tree.delete(row_id)
+                continue
+            text = f"{arrow} {count:,} {where} entries (scroll or click to show)"
+            if tree.exists(row_id):
+                tree.item(row_id, text=text)
+            else:
+                tree.insert(listing.folder_id, index, iid=row_id, text=text, values=("", "", ""), tags=("more",))
+
+    def listing_for_row(self, row_id):
+        """The VirtualListing a "more entries" row belongs to, or None for other rows"""
+        for suffix in ("_placeholder_before", "_placeholder_after"):
+            if row_id.endswith(suffix):
+                listing = self.listings.get(row_id[:-len(suffix)])
+                if listing is not None and row_id in (listing.before_id, listing.after_id):
+                    return listing
+        return None
+
+    def page_listing(self, listing, forward=True):
+        """Move a virtual folder's window by PAGE_ROWS, keeping at most WINDOW_ROWS rows"""
+        tree = self.app.tree
+        had_before_row = listing.start > 0
+        if forward:
+            new_end = min(len(listing), listing.end + self.PAGE_ROWS)
+            offset = 1 if had_before_row else 0
+            for i in range(listing.end, new_end):
+                self.insert_entry(listing.folder_id, listing.entry(i), offset + i - listing.start)
+            listing.end = new_end
+            excess = listing.end - listing.start - self.WINDOW_ROWS
+            if excess > 0:
+                for name in listing.window_names()[:excess]:
+                    self._forget_rows(self._child_row(listing.folder_id, name))
+                listing.start += excess
+            self._update_window_rows(listing)
+            # Rows dropped above the view would make it jump; scroll back by as many rows
+            shift = max(excess, 0) - (0 if had_before_row or listing.start == 0 else 1)
+            if shift > 0:
+                tree.yview_scroll(-shift, "units")
+        else:
+            new_start = max(0, listing.start - self.PAGE_ROWS)
+            added = listing.start - new_start
+            offset = 1 if had_before_row else 0
+            for i in range(new_start, listing.start):
+                self.insert_entry(listing.folder_id, listing.entry(i), offset + i - new_start)
+            listing.start = new_start
+            excess = listing.end - listing.start - self.WINDOW_ROWS
+            if excess > 0:
+                for name in listing.window_names()[-excess:]:
+                    self._forget_rows(self._child_row(listing.folder_id, name))
+                listing.end -= excess
+            self._update_window_rows(listing)
+            # Rows added above the view push it down; scroll forward by as many rows
+            shift = added - (1 if had_before_row and listing.start == 0 else 0)
+            if shift > 0:
+                tree.yview_scroll(shift, "units")
+
+    def on_tree_scrolled(self):
+        """Called whenever the tree's view moves; pages virtual folders whose edge rows came into view"""
+        if self.listings and not self._window_check_pending:
+            self._window_check_pending = True
+            self.app.root.after_idle(self._check_windows)
+
+    def _check_windows(self):
+        self._window_check_pending = False
+        tree = self.app.tree
+        for listing in list(self.listings.values()):
+            if tree.exists(listing.after_id) and tree.bbox(listing.after_id):
+                self.page_listing(listing, forward=True)
+            elif tree.exists(listing.before_id) and tree.bbox(listing.before_id):
+                self.page_listing(listing, forward=False)
+
+    def insert_entry(self, parent_id, entry, index="end"):
+        """Insert one scanned entry under parent_id at the given row index"""
+        if entry.error:
+            return self.add_node(parent_id, f"{entry.name} ({entry.error})", entry.path, "error", index=index)
+        if entry.is_dir:
+            node_id = self.add_node(parent_id, entry.name, entry.path, "directory", index=index)
+            if node_id: 
+                placeholder_iid = f"{node_id}_placeholder"
+                self.app.tree.insert(node_id, "end", iid=placeholder_iid, text="Loading...", values=("", "", ""))
+            return node_id
+        size_str, modified = self._stat_columns(entry)
+        return self.add_node(parent_id, entry.name, entry.path, "file", size_str, modified, entry.is_binary, index)
+
+    def _stat_columns(self, entry):
+        """Size and Date Modified column text of a file entry"""
+        return format_size(entry.size), datetime.datetime.fromtimestamp(entry.mtime).strftime("%Y-%m-%d %H:%M")
+
+    def is_loaded(self, folder_id):
+        """True if a folder row exists and its contents have been listed (no "Loading..." placeholder)"""
+        node_id = self._node(folder_id)
+        if node_id is None or not self.nodes.is_dir(node_id):
+            return False
+        return not self.app.tree.exists(f"{folder_id}_placeholder")
+
+    def apply_changes(self, paths, rescan=()):
+        """Patch the tree for paths reported by the watcher (see fs_watcher.DirectoryWatcher).
+
+        Each changed path only touches its own row: it is inserted, updated or
+        removed, and the selection totals follow. Changes inside folders that
+        were never expanded are ignored; those folders are listed when opened.
+        """
+        changed = 0
+        rescan = set(rescan)
+        unclassified = []
+        for path in sorted(paths):
+            if path == self.app.root_dir:
+                continue
+            parent_id = self.row_for(os.path.dirname(path))
+            if parent_id is None or not self.is_loaded(parent_id):
+                continue
+            entry = scan_entry(path, **self.scan_options())
+            if entry is not None and entry.is_binary is None:
+                unclassified.append(entry)
+            if parent_id in self.listings:
+                changed += self._patch_listing(self.listings[parent_id], path, entry)
+                continue
+            row_id = self._child_row(parent_id, os.path.basename(path))
+            if entry is None:
+                if row_id is not None:
+                    self.remove_node(row_id)
+                    changed += 1
+            elif row_id is not None:
+                changed += self._update_entry(parent_id, row_id, entry)
+            else:
+                self.insert_entry(parent_id, entry, self._insert_index(parent_id, entry))
+                self._count_new(entry.path)
+                changed += 1
+        for folder in rescan:
+            folder_id = self.row_for(folder)
+            if folder_id is not None and self.is_loaded(folder_id):
+                changed += self.sync_directory(folder_id)
+        self.classify_later(unclassified)
+        if changed:
+            self.app.metadata_cache.flush()
+            update_ui_status(self.app, f"Applied {changed} file system change(s).")
+            self.app.update_project_stats()
+            self.file_index.mark_stale()
+            if self.app.filter_shown:
+                # Rebuilt at most every FileIndex.REBUILD_SECONDS; the matches are redrawn when it is ready
+                self.file_index.build(self.app.root_dir, self.walk_files, on_ready=self.app.apply_filter)
+
+    def refresh_tree(self):
+        """Re-list the loaded folders and patch only the rows that changed. Returns the ids of inserted rows.
+
+        Unlike build_tree, unchanged rows (and their open state) are left alone,
+        so the cost follows the number of changes rather than of rows shown.
+        """
+        # Re-read .gitignore files so edits to them are picked up
+        self.gitignore = GitIgnoreRules(self.app.root_dir) if self.app.respect_gitignore else None
+        self.file_index.invalidate()
+        inserted = []
+        # Parents first, so folders that disappeared are removed before anything inside them is listed
+        for folder_id in [str(node_id) for node_id in self.nodes.folders()]:
+            if self.is_loaded(folder_id):
+                self.sync_directory(folder_id, inserted)
+        self.app.metadata_cache.flush()
+
+        # Recount the selection: files inside folders that were never expanded may have changed too
+        self.app.stats_engine.reset()
+        for selected_path in self.app.selection.included_paths():
+            self.app.stats_engine.add(selected_path)
+        return [row_id for row_id in map(self.row_for, inserted) if row_id is not None]
+
+    def sync_directory(self, folder_id, inserted=None):
+        """Bring the rows of a loaded folder in line with a fresh listing. Returns the number of rows changed.
+
+        Paths of inserted entries are appended to `inserted` if given.
+        """
+        path = self.path_of(folder_id)
         try:
-            node_id = self.app.tree.insert(parent_iid, "end", text=text, values=("☐", size_str, modified), iid=norm_full_path)
-        except tk.TclError as e:
-             print(f"Error inserting node with iid='{norm_full_path}': {e}. Skipping item.")
-             return None
+            entries = scan_directory(path, **self.scan_options())
+        except OSError:
+            return 0 # Gone or unreadable: the parent folder's change removes or marks it
+        self.classify_later(entries)
+        if folder_id in self.listings:
+            return self._sync_listing(self.listings[folder_id], entries, inserted)
+        listed = {entry.name for entry in entries}
+        changed = 0
+        for child_id in self.app.tree.get_children(folder_id):
+            node_id = self._node(child_id)
+            if node_id is None or self.nodes.names[node_id] not in listed:
+                self.remove_node(child_id)
+                changed += 1
+        # Rows and listing are sorted alike, so new rows go in at the current position
+        index = 0
+        for entry in entries:
+            row_id = self._child_row(folder_id, entry.name)
+            if row_id is not None:
+                changed += self._update_entry(folder_id, row_id, entry)
+            else:
+                self.insert_entry(folder_id, entry, index)
+                self._count_new(entry.path)
+                if inserted is not None:
+                    inserted.append(entry.path)
+                changed += 1
+            index += 1
+        return changed
+
+    def _sync_listing(self, listing, entries, inserted=None):
+        """sync_directory for a virtual folder: diff the listings, then patch only the window rows that changed.
+
+        The window keeps showing the entries it showed; entries added or
+        removed around it only move its ends, as in _patch_listing.
+        """
+        folder_id = listing.folder_id
+        new_listing = VirtualListing(listing.folder, folder_id)
+        new_listing.extend(entries)
+        new_listing.copy_binary(listing) # Files not classified yet keep their known state until classify_later
+        old_state = listing.state()
+        positions = {name: i for i, name in enumerate(new_listing.names)}
+        changed = 0
+        for name in old_state.keys() - positions.keys():
+            row_id = self._child_row(folder_id, name)
+            if row_id is not None:
+                self.remove_node(row_id)
+            else:
+                path = os.path.join(listing.folder, name)
+                self.app.stats_engine.remove(path)
+                self.watcher.unwatch(path)
+            changed += 1
+        if not changed and len(old_state) == len(new_listing) and all(
+                old_state[name] == new_listing.state_of(i) for i, name in enumerate(new_listing.names)):
+            return 0
+        self.listings[folder_id] = new_listing
+        kept = [positions[name] for name in listing.window_names() if name in positions]
+        if kept:
+            new_listing.start, new_listing.end = kept[0], kept[-1] + 1
+        else:
+            new_listing.start = new_listing.end = max(0, min(listing.start, len(new_listing) - self.WINDOW_ROWS))
+        offset = 1 if self.app.tree.exists(new_listing.before_id) else 0
+        for i, name in enumerate(new_listing.names):
+            old = old_state.get(name)
+            state = new_listing.state_of(i)
+            in_window = new_listing.start <= i < new_listing.end
+            if old == state and not (in_window and old is None):
+                continue
+            path = os.path.join(listing.folder, name)
+            changed += 1
+            if old is None:
+                if in_window:
+                    self.insert_entry(folder_id, new_listing.entry(i), offset + i - new_listing.start)
+                self._count_new(path)
+                if inserted is not None:
+                    inserted.append(path)
+            elif in_window:
+                self._update_entry(folder_id, self._child_row(folder_id, name), new_listing.entry(i))
+            elif state[0] == KIND_FILE and self.app.selection.is_selected(path):
+                self.app.stats_engine.remove(path)
+                self.app.stats_engine.add(path)
+        self._refit_window(new_listing)
+        return changed
+
+    def _patch_listing(self, listing, path, entry):
+        """apply_changes for a virtual folder: update one path's listing entry, and its row if it has one.
+
+        Entries added or removed above the window shift it rather than
+        redrawing it. Returns 1 if anything changed, else 0.
+        """
+        folder_id = listing.folder_id
+        name = os.path.basename(path)
+        index = listing.index_of(name)
+        if index is not None and entry is not None and kind_of(entry) == listing.kinds[index]:
+            old = listing.state_of(index)
+            listing.replace(index, entry)
+            if listing.state_of(index) == old:
+                return 0
+            if listing.start <= index < listing.end:
+                self._update_entry(folder_id, self._child_row(folder_id, name), listing.entry(index))
+            elif not entry.is_dir and self.app.selection.is_selected(path):
+                self.app.stats_engine.remove(path)
+                self.app.stats_engine.add(path)
+            return 1
+        if index is not None:
+            row_id = self._child_row(folder_id, name)
+            if row_id is not None:
+                self.remove_node(row_id)
+            else:
+                self.app.stats_engine.remove(path)
+                self.watcher.unwatch(path)
+            listing.remove(index)
+            if index < listing.end:
+                listing.end -= 1
+            if index < listing.start:
+                listing.start -= 1
+        if entry is not None:
+            index = listing.position(entry)
+            listing.insert(index, entry)
+            if index < listing.start or (index == listing.start and listing.start > 0):
+                listing.start += 1
+                listing.end += 1
+            elif index < listing.end or (index == listing.end and listing.end == len(listing) - 1):
+                offset = 1 if self.app.tree.exists(listing.before_id) else 0
+                self.insert_entry(folder_id, entry, offset + index - listing.start)
+                listing.end += 1
+            self._count_new(path)
+        self._refit_window(listing)
+        return 1
+
+    def _refit_window(self, listing):
+        """After rows were patched: drop rows beyond WINDOW_ROWS, top the window up and update its "more entries" rows"""
+        excess = listing.end - listing.start - self.WINDOW_ROWS
+        if excess > 0:
+            for name in listing.window_names()[-excess:]:
+                self._forget_rows(self._child_row(listing.folder_id, name))
+            listing.end -= excess
+        self._update_window_rows(listing)
+        self._fill_window(listing)
+
+    def _move_window(self, listing, start):
+        """Redraw a virtual folder's rows with its window starting at entry `start` (or as close as fits)"""
+        for row_id in self.app.tree.get_children(listing.folder_id):
+            self._forget_rows(row_id)
+        listing.start = listing.end = max(0, min(start, len(listing) - self.WINDOW_ROWS))
+        self._fill_window(listing)
+
+    def _update_entry(self, parent_id, row_id, entry):
+        """Update an existing row from a fresh entry. Returns 1 if anything changed, else 0"""
+        tree = self.app.tree
+        node_id = int(row_id)
+        was_dir = self.nodes.is_dir(node_id)
+        was_error = self.nodes.is_error(node_id)
+        if was_dir != entry.is_dir or was_error != bool(entry.error):
+            # Replaced by a different kind of entry (e.g. a folder by a file): re-insert the row
+            self.remove_node(row_id)
+            self.insert_entry(parent_id, entry, self._insert_index(parent_id, entry))
+            self._count_new(entry.path)
+            return 1
+        if entry.is_dir or entry.error:
+            return 0
+        size_str, modified = self._stat_columns(entry)
+        item = tree.item(row_id)
+        tags = item["tags"]
+        # Not classified yet (Tk-thread listing): keep the row's tag until classify_later knows
+        is_binary = ("binary" in tags) if entry.is_binary is None else entry.is_binary
+        if tuple(item["values"][1:3]) == (size_str, modified) and ("binary" in tags) == is_binary:
+            return 0
+        tree.set(row_id, "size", size_str)
+        tree.set(row_id, "date_modified", modified)
+        if ("binary" in tags) != is_binary:
+            tree.item(row_id, tags=tuple(t for t in tags if t != "binary") + (("binary",) if is_binary else ()))
+        if self.app.selection.is_selected(entry.path):
+            # Recount the new content
+            self.app.stats_engine.remove(entry.path)
+            self.app.stats_engine.add(entry.path)
+        return 1
+
+    def _count_new(self, path):
+        """Add a newly appeared file or folder to the totals if the selection covers it"""
+        if self.app.selection.is_selected(path):
+            self.app.stats_engine.add(path)
+
+    def remove_node(self, row_id):
+        """Delete a row with its loaded descendants and drop them from the node store, watcher and totals"""
+        path = self.path_of(row_id)
+        parent_id = self.app.tree.parent(row_id)
+        self._forget_rows(row_id)
+        if path is not None:
+            self.app.stats_engine.remove(path)
+        while parent_id:
+            self.app.update_selection_indicator(parent_id)
+            parent_id = self.app.tree.parent(parent_id)
+
+    def _forget_rows(self, row_id):
+        """Delete a row and its loaded descendants from the tree, the node store, the watcher and the listings"""
+        node_id = self._node(row_id)
+        if self.listings:
+            stack = [row_id]
+            while stack:
+                current = stack.pop()
+                self.listings.pop(current, None)
+                stack.extend(self.app.tree.get_children(current))
+        self.app.tree.delete(row_id)
+        if node_id is not None:
+            if self.nodes.is_dir(node_id):
+                self.watcher.unwatch(self.nodes.path(node_id))
+            self.nodes.remove(node_id)
+
+    def _insert_index(self, parent_id, entry):
+        """Row index that keeps parent_id's children sorted like scan_directory (folders first, then by name)"""
+        key = (not entry.is_dir, entry.name.lower())
+        for index, child_id in enumerate(self.app.tree.get_children(parent_id)):
+            node_id = self._node(child_id)
+            if node_id is None:
+                if child_id.endswith("_placeholder_before"):
+                    continue # A virtual folder's "more entries" row above its window
+                return index # Error rows stay last
+            child_key = (not self.nodes.is_dir(node_id), self.nodes.names[node_id].lower())
+            if child_key > key:
+                return index
+        return "end"
+
+    def _insert_listing_error(self, path, parent_id, error, depth=None):
+        """Insert an error row for a directory that could not be listed"""
+        if error is None:
+            error_text = "Max depth reached"
+            error_iid = f"{parent_id}_error_max_depth_{depth}"
+        elif isinstance(error, PermissionError):
+            error_text = "Permission denied"
+            error_iid = f"{parent_id}_error_permission"
+        elif isinstance(error, FileNotFoundError):
+            error_text = "Not Found"
+            error_iid = f"{parent_id}_error_notfound"
+        else:
+            error_text = f"Error listing: {error}"
+            error_iid = f"{parent_id}_error_listing_{type(error).__name__}"
+        if not self.app.tree.exists(error_iid):
+            self.app.tree.insert(parent_id, "end", iid=error_iid, text=error_text, values=("", "", ""), tags=("error",))
+
+    def add_node(self, parent_iid, text, norm_full_path, node_type, size_str="", modified="", is_binary=False, index="end"):
+        """Add a node for norm_full_path to the node store and the tree view. Returns its row id.
 
-        self.file_paths[node_id] = norm_full_path
+        Tags and the checkbox are worked out first so each row costs a single Tk
+        insert; entries already in the store are skipped without asking Tk.
+        """
+        parent = int(parent_iid) if parent_iid else None
+        name = os.path.basename(norm_full_path) if parent is not None else norm_full_path
+        existing = self.nodes.child(parent, name) if parent is not None else self.nodes.root
+        if existing is not None:
+            return str(existing)
 
         tags_to_apply = []
         if node_type == "directory":
             tags_to_apply.append("folder")
+            kind = KIND_DIR
         elif node_type == "file":
             tags_to_apply.append("file")
+            kind = KIND_FILE
             ext = os.path.splitext(text)[1].lower()
             if ext in (".py", ".pyw"): tags_to_apply.append("python")
             elif ext in (".txt", ".md", ".log", ".json", ".yaml", ".yml", ".csv", ".xml"): tags_to_apply.append("text")
             elif ext in (".jpg", ".jpeg", ".png", ".gif", ".bmp", ".svg", ".ico"): tags_to_apply.append("image")
-        elif node_type == "error":
+            if is_binary: tags_to_apply.append("binary")
+        else:
             tags_to_apply.append("error")
-        self.app.tree.item(node_id, tags=tuple(tags_to_apply))
-
-        # Determine selection state for this new node
-        should_select_node = False
-        if norm_full_path in self.pending_selection_restore:
-            # This node itself was in the saved selection list
-            should_select_node = True
-        elif parent_iid and self.app.tree.exists(parent_iid):
-            # Check if the parent was *explicitly* in the saved selection list
-            # This prevents inheriting "selected" state if the parent was selected due to other reasons
-            # (e.g. user clicked it after load but before this child was lazy-loaded).
-            # For load/restore, selection should primarily come from pending_selection_restore.
-            if parent_iid in self.pending_selection_restore and "folder" in self.app.tree.item(parent_iid, "tags"):
-                 # If parent folder was in the restore list, its children should also be selected.
-                 should_select_node = True
-            # Removed general check for parent's current "selected" tag here to avoid
-            # overly aggressive selection during lazy load if parent was selected interactively.
-            # The primary mechanism for selection propagation is app.update_item_selection when user interacts.
-
-        if should_select_node:
-            # Use app.update_item_selection which handles recursion and UI update correctly.
-            # This is crucial: if norm_full_path is a folder from pending_selection_restore,
-            # this call will make it selected AND its children (if any are loaded immediately after)
-            # will also get selected via this same add_node logic seeing their parent (norm_full_path)
-            # was in pending_selection_restore.
-            self.app.update_item_selection(node_id, True)
-
-        return node_id
+            kind = KIND_ERROR
+        # Selection comes from the rules in app.selection: a node is checked if it, or the
+        # nearest folder above it with a rule, was selected - even before its row existed
+        if self.app.selection.is_selected(norm_full_path):
+            tags_to_apply.append("selected")
+        check = self.app.selection_symbol(norm_full_path) if node_type == "directory" else ("☑" if "selected" in tags_to_apply else "☐")
+
+        node_id = self.nodes.add(parent, name, kind)
+        try:
+            self.app.tree.insert(parent_iid, index, iid=str(node_id), text=text,
+                                 values=(check, size_str, modified), tags=tuple(tags_to_apply))
+        except tk.TclError as e:
+             print(f"Error inserting node for '{norm_full_path}': {e}. Skipping item.")
+             self.nodes.remove(node_id)
+             return None
+        return str(node_id)
 
     def on_tree_open(self, event):
         """Handle tree open events - load contents when directory is expanded"""
         item = self.app.tree.focus() 
         if not item or not self.app.tree.exists(item):
             return
+        self.load_children(item)
 
-        path = item
-        if not path: return # Should not happen with valid item
-        
-        # Check if path is a directory before processing
-        is_dir = False
-        try:
-            if os.path.isdir(path):
-                is_dir = True
-        except OSError: # Path too long, etc.
-            return 
-
-        if not is_dir:
-             # If it's an error node or something else, don't try to process as directory
-            if "_error_" in path or "_placeholder" in path or "file" in self.app.tree.item(item, "tags"):
-                return
-            # If it's somehow not a dir and not an error/placeholder, also return.
-            # This might indicate an issue with iid management if 'item' is not a path.
-            return
+    def load_children(self, item, background=True):
+        """Replace a folder's "Loading..." placeholder with its real contents"""
+        node_id = self._node(item)
+        if node_id is None or not self.nodes.is_dir(node_id):
+            return # Files, error and placeholder rows have nothing to load
+        path = self.nodes.path(node_id)
 
         children = self.app.tree.get_children(item)
         if children:
             first_child_id = children[0]
             if self.app.tree.exists(first_child_id) and self.app.tree.item(first_child_id, "text") == "Loading...":
                 self.app.tree.delete(first_child_id)
-                self.process_directory(path, item, depth=self.get_item_depth(item))
-
+                self.watcher.watch(path)
+                if background:
+                    self.process_directory_async(path, item, depth=self.get_item_depth(item))
+                else:
+                    self.process_directory(path, item, depth=self.get_item_depth(item))
+
+
+    def search_files(self, query):
+        """Index lines of the files below the root matching a filter query (see FileIndex.search).
+
+        Returns None while the index is first built; app.apply_filter runs again once it is ready.
+        Use file_index.path(line) for the paths.
+        """
+        index = self.file_index
+        if index.stale:
+            index.build(self.app.root_dir, self.walk_files, on_ready=self.app.apply_filter)
+            if index.folder != self.app.root_dir:
+                return None
+            # Meanwhile answer from the previous index of this root
+        return index.search(query)
+
+    def reveal_path(self, path):
+        """Load the folders above path (paging huge ones) until it has a row. Returns the row id or None"""
+        row_id = self.row_for(path)
+        if row_id is not None:
+            return row_id
+        root = self.app.root_dir
+        if self.nodes.root is None or not path.startswith(os.path.join(root, "")):
+            return None
+        row_id = str(self.nodes.root)
+        for name in os.path.relpath(path, root).split(os.sep):
+            self.load_children(row_id, background=False)
+            self.app.tree.item(row_id, open=True)
+            child_id = self._child_row(row_id, name)
+            listing = self.listings.get(row_id)
+            if child_id is None and listing is not None and name in listing.names:
+                self._move_window(listing, listing.names.index(name) - self.PAGE_ROWS)
+                child_id = self._child_row(row_id, name)
+            if child_id is None:
+                return None
+            row_id = child_id
+        return row_id
 
     def get_item_depth(self, item):
         """Get the depth of an item in the tree"""
@@ -225,9 +774,7 @@ class FileOperations:
 
     def merge_files(self):
         """Prepare and execute file merge operation"""
-        selected_files_only = self.get_selected_files_only()
-
-        if not selected_files_only:
+        if not self.get_selected_paths():
             messagebox.showinfo("No Files Selected", "Please select one or more files to merge.")
             return
 
@@ -248,174 +795,138 @@ class FileOperations:
         if not output_filename:
             return 
 
-        progress_dialog = ProgressDialog(self.app.root, "Merging Files", len(selected_files_only))
+        # Selected folders are enumerated on the worker thread, from a snapshot of the selection
+        prompt = self.app.prompt_text.get("1.0", tk.END).strip()
+        project_rules = self.app.project_rules_text.get("1.0", tk.END).strip()
+        progress_dialog = ProgressDialog(self.app.root, "Merging Files", 1)
         merge_thread = threading.Thread(
-            target=self._perform_merge,
-            args=(selected_files_only, output_filename, progress_dialog), 
+            target=self._collect_and_merge,
+            args=(self.app.selection.copy(), dict(self.app.merge_options), prompt, project_rules, output_filename, progress_dialog), 
             daemon=True 
         )
         merge_thread.start()
 
+    def _collect_and_merge(self, selection, options, prompt, project_rules, output_path, progress_dialog):
+        """Enumerate the selected files, apply the token budget, then merge them (runs on the merge thread).
 
-    def _perform_merge(self, files, output_path, progress_dialog):
-        """Perform the actual file merge operation"""
+        Any error, while planning or merging, is shown and closes the progress dialog.
+        """
         try:
-            output_dir = os.path.dirname(output_path)
-            if not os.path.exists(output_dir):
-                os.makedirs(output_dir)
-
-            prompt = self.app.prompt_text.get("1.0", tk.END).strip()
-            project_rules = self.app.project_rules_text.get("1.0", tk.END).strip()
-
-            total_files = len(files)
-            with open(output_path, 'w', encoding='utf-8', errors='replace') as outfile:
-                outfile.write("--- START OF FILE export.txt ---\n\n") 
-
-                if prompt:
-                    if not prompt.startswith("GOAL:"): prompt = "GOAL:\n" + prompt
-                    outfile.write(prompt + "\n")
-                    outfile.write("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-
-                if project_rules:
-                    if not project_rules.startswith("RULES:"): project_rules = "RULES:\n" + project_rules
-                    outfile.write(project_rules + "\n")
-                    outfile.write("~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~\n")
-
-                outfile.write("="*80 + "\n")
-                outfile.write(f"MERGED FILE - Created {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                outfile.write(f"Contains {total_files} files\n")
-                outfile.write("="*80 + "\n\n")
-
-                directory_structure = self.generate_file_structure(files)
-                outfile.write(directory_structure)
-                outfile.write("\n\n" + "="*80 + "\n")
-
-                for i, file_path in enumerate(files):
-                    if progress_dialog.cancelled:
-                        update_ui_status(self.app, "Merge cancelled by user.")
-                        return 
-
-                    progress_dialog.update_progress(i + 1, f"Processing {os.path.basename(file_path)}")
-
-                    outfile.write("\n" + "-"*80 + "\n")
-                    outfile.write(f"FILE: {os.path.normpath(file_path)}\n")
-                    outfile.write("-"*80 + "\n\n")
-
-                    try:
-                        self.write_content(file_path, outfile)
-                    except Exception as e:
-                        outfile.write(f"\nERROR: Could not read file '{os.path.basename(file_path)}': {str(e)}\n")
-                    outfile.write("\n\n") 
-                outfile.write("\n--- END OF FILE export.txt ---\n")
-
-            if not progress_dialog.cancelled:
-                 progress_dialog.update_progress(total_files, "Merge complete!", True)
-                 self.app.root.after(100, lambda: update_ui_status(self.app, f"Files merged successfully to: {output_path}"))
-                 self.app.root.after(150, lambda: self.safe_startfile(output_dir)) 
-                 self.app.root.after(200, lambda: self.app.project_manager._update_current_project_data())
-                 self.app.root.after(250, lambda: self.app.project_manager.save_preferences())
+            progress_dialog.update_progress(0, "Collecting selected files...")
+            timings = merge_engine.MergeTimings()
+            with timings.timed("listing"):
+                files = [f for f in selection.iter_selected_files(self.walk_files) if not self.is_excluded_by_gitignore(f)]
+                if options.get("binary_files") == "skip":
+                    files = [f for f in files if not self.app.metadata_cache.is_binary(f)]
+            if not files:
+                progress_dialog.update_progress(0, "No files to merge", True)
+                self.app.root.after(100, lambda: messagebox.showinfo("No Files Selected", "The selection contains no files to merge."))
+                return
+            planning_started = time.monotonic()
+            cache = self.app.metadata_cache
+            # Only reuse and change exports read the manifest back, so only they pay for hashing and writing it
+            keep_manifest = bool(options.get("reuse_unchanged") or options.get("export_mode") == "changes")
+            change_notes = []
+            if options.get("export_mode") == "changes":
+                changes = merge_engine.plan_changes(files, output_path, cache.content_hash)
+                if changes is None:
+                    # Nothing to compare with yet: write a full export that later ones can build on
+                    options["export_mode"] = "full"
+                else:
+                    files, change_notes = changes
+                    output_path = merge_engine.changes_path(output_path)
+            duplicates = {}
+            if options.get("deduplicate"):
+                progress_dialog.update_progress(0, "Looking for duplicate files...")
+                duplicates = merge_engine.find_duplicates(
+                    [f for f in files if not cache.is_binary(f)], os.path.getsize, cache.content_hash
+                )
+            if options.get("token_budget"):
+                progress_dialog.update_progress(0, "Fitting files into the token budget...")
+            files, max_lines, notes = merge_engine.apply_token_budget(
+                files, options, cache.analyze, prompt, project_rules, duplicates
+            )
+            duplicates = merge_engine.resolve_duplicates(files, duplicates)
+            notes = change_notes + notes + merge_engine.duplicates_note(duplicates)
+            timings.add("planning", time.monotonic() - planning_started)
+            progress_dialog.set_maximum(len(files))
+            self._perform_merge(files, output_path, progress_dialog, prompt, project_rules, max_lines, notes, options, duplicates, timings, keep_manifest)
         except Exception as e:
              error_msg = f"Failed to merge files: {str(e)}"
              print(f"Merge Error: {error_msg}") 
-             if progress_dialog:
-                 progress_dialog.update_progress(progress_dialog.current, f"Error: {e}", True) 
+             progress_dialog.update_progress(progress_dialog.current, f"Error: {e}", True) 
              self.app.root.after(100, lambda: messagebox.showerror("Merge Error", error_msg))
              self.app.root.after(150, lambda: update_ui_status(self.app, "Merge failed."))
         finally:
-            if progress_dialog and progress_dialog.winfo_exists():
-                progress_dialog.after(500, progress_dialog.destroy) 
+            # Runs on the merge thread: leave closing the window to the dialog's own loop
+            progress_dialog.close(500)
+
+
+    def _perform_merge(self, files, output_path, progress_dialog, prompt="", project_rules="", max_lines=None, notes=(), options=None, duplicates=None, timings=None, keep_manifest=False):
+        """Perform the actual file merge operation; errors are reported by _collect_and_merge"""
+        options = options or {}
+        output_dir = os.path.dirname(output_path)
+        if not os.path.exists(output_dir):
+            os.makedirs(output_dir)
+
+        total_files = len(files)
+        timings = timings or merge_engine.MergeTimings()
+        last_update = [0.0]
+        def on_progress(done, file_path, bytes_written):
+            # Queueing an event per file would cost more than merging small files; the dialog shows the latest anyway
+            now = time.monotonic()
+            if now - last_update[0] >= self.PROGRESS_INTERVAL or done == total_files:
+                last_update[0] = now
+                progress_dialog.update_progress(done, f"Processing {os.path.basename(file_path)}", bytes_done=bytes_written,
+                                                detail=timings.describe(done, total_files, bytes_written))
+
+        completed = merge_engine.merge_files(
+            files, output_path, prompt, project_rules,
+            record_for=self.app.metadata_cache.lookup,
+            on_progress=on_progress,
+            is_cancelled=lambda: progress_dialog.cancelled,
+            max_lines=max_lines,
+            notes=notes,
+            limits=options,
+            duplicates=duplicates,
+            reuse_previous=options.get("reuse_unchanged"),
+            hash_of=self.app.metadata_cache.content_hash if keep_manifest else None,
+            write_manifest=keep_manifest and options.get("export_mode") != "changes",
+            timings=timings
+        )
+        if not completed:
+            self.app.root.after(100, lambda: update_ui_status(self.app, "Merge cancelled by user."))
+            return
 
+        if not progress_dialog.cancelled:
+             elapsed = timings.elapsed()
+             progress_dialog.update_progress(total_files, "Merge complete!", True)
+             self.app.root.after(100, lambda: update_ui_status(self.app, f"Files merged successfully to: {output_path} ({elapsed:.1f} s)"))
+             self.app.root.after(150, lambda: self.safe_startfile(output_dir)) 
+             self.app.root.after(200, lambda: self.app.project_manager._update_current_project_data())
+             self.app.root.after(250, lambda: self.app.project_manager.save_preferences())
 
-    def write_content(self, file_path, outfile):
-        """Write file content to the output file with line numbers"""
-        line_number = 1
-        try:
-            with open(file_path, 'r', encoding='utf-8', errors='replace') as infile:
-                for line in infile:
-                    outfile.write(f"{line_number:5d} {line.rstrip()}\n")
-                    line_number += 1
-        except Exception as e:
-            outfile.write(f"ERROR reading file content: {e}\n")
 
     def get_selected_paths(self):
-        """Get a list of paths for all selected items (files and directories) in the tree"""
-        selected_paths = []
-        def collect_paths_recursive(node_id):
-            if not self.app.tree.exists(node_id):
-                return
-            item_tags = self.app.tree.item(node_id, "tags")
-            path = node_id 
-            if path: 
-                if "selected" in item_tags:
-                    if "_error_" not in path and "_placeholder" not in path:
-                        selected_paths.append(path)
-                for child in self.app.tree.get_children(node_id):
-                    collect_paths_recursive(child)
-        for item in self.app.tree.get_children(""): 
-            collect_paths_recursive(item)
-        return list(set(selected_paths))
+        """Get the paths selected with their contents (files and directories), including ones not loaded yet"""
+        return self.app.selection.included_paths()
 
+    def get_excluded_paths(self):
+        """Get the paths deselected inside selected directories"""
+        return self.app.selection.excluded_paths()
 
     def get_selected_files_only(self):
-        """Get a list of selected files (not directories) in the tree"""
-        selected_files = []
-        def collect_files_recursive(node_id):
-             if not self.app.tree.exists(node_id): return
-             item_tags = self.app.tree.item(node_id, "tags")
-             path = node_id 
-             if path:
-                 if "selected" in item_tags and "file" in item_tags:
-                    try:
-                        if os.path.isfile(path):
-                            selected_files.append(path)
-                    except OSError: 
-                        pass
-                 for child in self.app.tree.get_children(node_id):
-                     collect_files_recursive(child)
-        for item in self.app.tree.get_children(""):
-            collect_files_recursive(item)
-        return list(set(selected_files))
+        """Get a list of selected files (not directories), walking selected directories on disk"""
+        files = self.app.selection.iter_selected_files(self.walk_files)
+        return [f for f in files if not self.is_excluded_by_gitignore(f)]
+
+    def walk_files(self, folder, skip=()):
+        """Yield the files below folder that the tree would show (same ignore/.gitignore filters)"""
+        return walk_files(folder, skip, self.is_ignored, self.gitignore)
 
     def generate_file_structure(self, files):
         """Generate a text representation of the file structure based on a list of file paths"""
-        if not files:
-            return "DIRECTORY STRUCTURE:\n(No files selected)"
-        try:
-            norm_files = [os.path.normpath(f) for f in files]
-            existing_files = [f for f in norm_files if os.path.exists(f)]
-            if not existing_files: common_path = None 
-            else:
-                 common_path = os.path.commonpath(existing_files)
-                 if common_path and not os.path.isdir(common_path):
-                      common_path = os.path.dirname(common_path)
-        except ValueError:
-             common_path = None 
-        dirs = {}
-        for file_path in files:
-             norm_file_path = os.path.normpath(file_path)
-             dir_path = os.path.dirname(norm_file_path)
-             if common_path and norm_file_path.startswith(common_path + os.sep): # Ensure common_path is prefix
-                 relative_dir = os.path.relpath(dir_path, common_path)
-                 # Handle dir_path being the same as common_path (files in the common root)
-                 display_dir_name = relative_dir if relative_dir != '.' else os.path.basename(common_path) # or just common_path
-                 # This needs to be robust for display
-                 if relative_dir == '.': display_dir = common_path
-                 else: display_dir = os.path.join(common_path, relative_dir) # Reconstruct with common_path for full display path
-
-             else: # No common path or different drives
-                 display_dir = dir_path
-             
-             display_dir = os.path.normpath(display_dir) # Normalize for dictionary key consistency
-
-             if display_dir not in dirs:
-                 dirs[display_dir] = []
-             dirs[display_dir].append(os.path.basename(norm_file_path))
-        output = ["DIRECTORY STRUCTURE:"]
-        for dir_path_key in sorted(dirs.keys()):
-            output.append(f"\nDirectory: {dir_path_key}")
-            for file_item in sorted(dirs[dir_path_key]):
-                output.append(f"  |- {file_item}")
-        return "\n".join(output)
+        return merge_engine.generate_file_structure(files)
 
     def safe_startfile(self, path):
         """Attempt to open a file or directory safely."""
@@ -0,0 +1,279 @@
+import os
+import sys
+import time
+import errno
+import queue
+import select
+import struct
+import threading
+import ctypes
+import ctypes.util
+
+# inotify event bits (see inotify(7))
+IN_MODIFY = 0x00000002
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+
+WATCH_MASK = (IN_MODIFY | IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO
+              | IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF | IN_ONLYDIR)
+EVENT_HEADER = struct.Struct("iIII") # wd, mask, cookie, len
+
+
+class InotifyBackend:
+    """Watches directories with Linux inotify through ctypes. Raises OSError where inotify is unavailable.
+
+    `report(paths, rescan)` is called from the reader thread with the changed
+    paths; `rescan` lists watched folders whose events were lost (queue overflow).
+    """
+    READ_SIZE = 64 * 1024
+
+    def __init__(self, report):
+        if not sys.platform.startswith("linux"):
+            raise OSError(errno.ENOSYS, "inotify is only available on Linux")
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            self._rm_watch = libc.inotify_rm_watch
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise OSError(errno.ENOSYS, f"inotify is not available: {e}")
+        if fd < 0:
+            raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+        self._fd = fd
+        self._report = report
+        self._lock = threading.Lock()
+        self._paths = {} # Watch descriptor -> watched folder
+        self._wds = {} # Watched folder -> watch descriptor
+        self._stopped = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, path):
+        """Watch a folder. Raises OSError (e.g. ENOSPC when out of watches)"""
+        wd = self._add_watch(self._fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            error = ctypes.get_errno()
+            raise OSError(error, os.strerror(error), path)
+        with self._lock:
+            self._paths[wd] = path
+            self._wds[path] = wd
+
+    def remove(self, path):
+        with self._lock:
+            wd = self._wds.pop(path, None)
+            if wd is None:
+                return
+            self._paths.pop(wd, None)
+        self._rm_watch(self._fd, wd)
+
+    def stop(self):
+        self._stopped = True
+
+    def _run(self):
+        try:
+            while not self._stopped:
+                ready, _, _ = select.select([self._fd], [], [], 0.5)
+                if not ready:
+                    continue
+                try:
+                    data = os.read(self._fd, self.READ_SIZE)
+                except BlockingIOError:
+                    continue
+                self._parse(data)
+        except OSError as e:
+            print(f"Warning: File watcher stopped: {e}")
+        finally:
+            os.close(self._fd)
+
+    def _parse(self, data):
+        paths = set()
+        rescan = set()
+        offset = 0
+        with self._lock:
+            while offset + EVENT_HEADER.size <= len(data):
+                wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b"\0")
+                offset += EVENT_HEADER.size + length
+                if mask & IN_Q_OVERFLOW:
+                    rescan.update(self._wds)
+                    continue
+                folder = self._paths.get(wd)
+                if folder is None:
+                    continue
+                if mask & IN_IGNORED:
+                    # The folder was deleted or unmounted; the kernel dropped its watch
+                    del self._paths[wd]
+                    self._wds.pop(folder, None)
+                    continue
+                paths.add(os.path.join(folder, os.fsdecode(name)) if name else folder)
+        if paths or rescan:
+            self._report(paths, rescan)
+
+
+class PollingBackend:
+    """Watches directories by re-listing them every `interval` seconds and diffing the listings"""
+
+    def __init__(self, report, interval=2.0):
+        self._report = report
+        self.interval = interval
+        self._lock = threading.Lock()
+        self._snapshots = {} # Watched folder -> {name: (is_dir, size, mtime_ns)}, None until first listed
+        self._stopped = False
+        threading.Thread(target=self._run, daemon=True).start()
+
+    def add(self, path):
+        with self._lock:
+            self._snapshots.setdefault(path, None)
+
+    def remove(self, path):
+        with self._lock:
+            self._snapshots.pop(path, None)
+
+    def stop(self):
+        self._stopped = True
+
+    @staticmethod
+    def _snapshot(path):
+        snapshot = {}
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    stats = entry.stat()
+                    snapshot[entry.name] = (entry.is_dir(), stats.st_size, stats.st_mtime_ns)
+                except OSError:
+                    snapshot[entry.name] = None
+        return snapshot
+
+    def _run(self):
+        while not self._stopped:
+            time.sleep(self.interval)
+            with self._lock:
+                folders = list(self._snapshots.items())
+            paths = set()
+            for folder, old in folders:
+                try:
+                    new = self._snapshot(folder)
+                except OSError:
+                    new = None
+                with self._lock:
+                    if folder not in self._snapshots:
+                        continue # Unwatched meanwhile
+                    self._snapshots[folder] = new
+                if new is None:
+                    paths.add(folder) # Gone or unreadable: its parent decides what to show
+                elif old is not None:
+                    paths.update(os.path.join(folder, name) for name in old.keys() | new.keys()
+                                 if old.get(name) != new.get(name))
+            if paths:
+                self._report(paths, set())
+
+
+class DirectoryWatcher:
+    """Watches the folders loaded in the tree and reports changes to them on the Tk thread.
+
+    Uses inotify on Linux, and polls directory listings elsewhere or for folders
+    inotify cannot watch (e.g. when the watch limit is reached). Events arrive on
+    a worker thread, are queued, and are delivered in debounced batches from a
+    root.after() poll loop as on_changes(paths, rescan): `paths` were created,
+    deleted, modified or renamed; `rescan` folders may have missed events.
+    """
+    POLL_MS = 100
+    DEBOUNCE = 0.25 # Seconds without new events before a batch is delivered
+    MAX_DELAY = 1.0 # Deliver at least this often while events keep coming
+
+    def __init__(self, root, on_changes, use_inotify=True, poll_interval=2.0):
+        self.root = root
+        self.on_changes = on_changes
+        self._events = queue.Queue()
+        self._paths = set()
+        self._rescan = set()
+        self._first_event = self._last_event = 0
+        self._watched = set()
+        self.inotify = None
+        if use_inotify:
+            try:
+                self.inotify = InotifyBackend(self._put)
+            except OSError as e:
+                print(f"Note: {e}. Watching folders by polling instead.")
+        self.poll_interval = poll_interval
+        self.polling = None # Started the first time a folder has to be polled
+        self._polled = set() # Folders watched by polling
+        self._stopped = False
+        self.root.after(self.POLL_MS, self._poll)
+
+    def _put(self, paths, rescan):
+        self._events.put((paths, rescan))
+
+    def watch(self, path):
+        """Start reporting changes to the entries of folder `path`"""
+        if path in self._watched:
+            return
+        self._watched.add(path)
+        if self.inotify is not None:
+            try:
+                self.inotify.add(path)
+                return
+            except OSError as e:
+                if e.errno == errno.ENOSPC and not self._polled:
+                    print("Warning: Out of inotify watches; polling the remaining folders instead.")
+                elif e.errno != errno.ENOSPC:
+                    self._watched.discard(path)
+                    return
+        if self.polling is None:
+            self.polling = PollingBackend(self._put, self.poll_interval)
+        self.polling.add(path)
+        self._polled.add(path)
+
+    def unwatch(self, path):
+        """Stop watching folder `path` and every folder below it"""
+        prefix = path.rstrip(os.sep) + os.sep
+        for folder in [p for p in self._watched if p == path or p.startswith(prefix)]:
+            self._watched.discard(folder)
+            if folder in self._polled:
+                self._polled.discard(folder)
+                self.polling.remove(folder)
+            elif self.inotify is not None:
+                self.inotify.remove(folder)
+
+    def unwatch_all(self):
+        for folder in list(self._watched):
+            self.unwatch(folder)
+
+    def stop(self):
+        self._stopped = True
+        self.unwatch_all()
+        if self.inotify is not None:
+            self.inotify.stop()
+        if self.polling is not None:
+            self.polling.stop()
+
+    def _poll(self):
+        if self._stopped:
+            return
+        now = time.monotonic()
+        while True:
+            try:
+                paths, rescan = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if not self._paths and not self._rescan:
+                self._first_event = now
+            self._paths.update(paths)
+            self._rescan.update(rescan)
+            self._last_event = now
+        if (self._paths or self._rescan) and (now - self._last_event >= self.DEBOUNCE or now - self._first_event >= self.MAX_DELAY):
+            paths, rescan = self._paths, self._rescan
+            self._paths, self._rescan = set(), set()
+            try:
+                self.on_changes(paths, rescan)
+            except Exception as e:
+                print(f"Error applying file changes: {e}")
+        self.root.after(self.POLL_MS, self._poll)
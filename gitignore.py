@@ -0,0 +1,146 @@
+import os
+import re
+
+_IGNORECASE = re.IGNORECASE if os.name == "nt" else 0
+
+
+def _translate(pattern):
+    """Translate the body of a .gitignore pattern into a regex fragment"""
+    parts = []
+    i, n = 0, len(pattern)
+    while i < n:
+        c = pattern[i]
+        if c == "*":
+            if pattern[i:i + 3] == "**/":
+                parts.append("(?:.*/)?")
+                i += 3
+                continue
+            if pattern[i:i + 2] == "**":
+                parts.append(".*")
+                i += 2
+                continue
+            parts.append("[^/]*")
+        elif c == "?":
+            parts.append("[^/]")
+        elif c == "[":
+            end = pattern.find("]", i + 1)
+            if end == -1:
+                parts.append(re.escape(c))
+            else:
+                body = pattern[i + 1:end]
+                if body.startswith("!"):
+                    body = "^" + body[1:]
+                parts.append("[" + body.replace("\\", "\\\\") + "]")
+                i = end
+        elif c == "\\" and i + 1 < n:
+            i += 1
+            parts.append(re.escape(pattern[i]))
+        else:
+            parts.append(re.escape(c))
+        i += 1
+    return "".join(parts)
+
+
+def parse_gitignore(lines):
+    """Parse .gitignore lines into (regex, negate, dir_only) rules, in file order"""
+    rules = []
+    for line in lines:
+        line = line.rstrip("\n").rstrip("\r")
+        if not line or line.startswith("#"):
+            continue
+        # Trailing spaces are ignored unless escaped with a backslash
+        while line.endswith(" ") and not line.endswith("\\ "):
+            line = line[:-1]
+        if not line:
+            continue
+
+        negate = line.startswith("!")
+        if negate:
+            line = line[1:]
+        elif line.startswith("\\!") or line.startswith("\\#"):
+            line = line[1:]
+
+        dir_only = line.endswith("/")
+        line = line.rstrip("/")
+        if not line:
+            continue
+
+        # A slash at the start or in the middle anchors the pattern to the .gitignore's folder
+        anchored = "/" in line
+        line = line.lstrip("/")
+        regex = _translate(line)
+        if not anchored:
+            regex = "(?:.*/)?" + regex
+        rules.append((re.compile(regex + r"\Z", _IGNORECASE), negate, dir_only))
+    return rules
+
+
+class GitIgnoreRules:
+    """The .gitignore files of one directory tree, read lazily per folder.
+
+    Each folder's .gitignore is parsed the first time something inside it is
+    checked. Deeper files override shallower ones and, within a file, the last
+    matching rule wins, so negations ("!keep.me") work as in git.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.normpath(root)
+        self._root_prefix = self.root.rstrip(os.sep) + os.sep
+        self._rules = {} # folder -> parsed rules of its .gitignore (empty list if none)
+        self._excluded_dirs = {} # folder -> result of is_excluded, used when checking arbitrary paths
+
+    def _rules_for(self, folder):
+        rules = self._rules.get(folder)
+        if rules is None:
+            try:
+                with open(os.path.join(folder, ".gitignore"), "r", encoding="utf-8", errors="replace") as f:
+                    rules = parse_gitignore(f)
+            except OSError:
+                rules = []
+            self._rules[folder] = rules
+        return rules
+
+    def is_ignored(self, path, is_dir):
+        """Return True if the .gitignore rules exclude `path`, assuming its parent is not excluded"""
+        path = os.path.normpath(path)
+        if not path.startswith(self._root_prefix):
+            return False
+        parent = os.path.dirname(path)
+
+        # Folders from the tree root down to the entry's parent, shallowest first
+        folders = []
+        folder = parent
+        while True:
+            folders.append(folder)
+            if folder == self.root or not folder.startswith(self._root_prefix):
+                break
+            folder = os.path.dirname(folder)
+        folders.reverse()
+
+        ignored = False
+        for folder in folders:
+            rules = self._rules_for(folder)
+            if not rules:
+                continue
+            rel_path = os.path.relpath(path, folder).replace(os.sep, "/")
+            for regex, negate, dir_only in rules:
+                if dir_only and not is_dir:
+                    continue
+                if regex.match(rel_path):
+                    ignored = not negate
+        return ignored
+
+    def is_excluded(self, path, is_dir=False):
+        """Return True if `path` or any folder above it (inside the root) is ignored"""
+        path = os.path.normpath(path)
+        if not path.startswith(self._root_prefix):
+            return False
+        parent = os.path.dirname(path)
+        if parent.startswith(self._root_prefix):
+            cached = self._excluded_dirs.get(parent)
+            if cached is None:
+                cached = self.is_excluded(parent, True)
+                self._excluded_dirs[parent] = cached
+            if cached:
+                return True
+        return self.is_ignored(path, is_dir)
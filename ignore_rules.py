@@ -0,0 +1,72 @@
+import os
+import re
+import fnmatch
+
+_GLOB_CHARS = set("*?[")
+
+# Ignored types/names for new projects
+DEFAULT_IGNORED_FILE_TYPES = [
+    # Version control
+    ".git", ".gitignore", ".gitattributes", ".svn", ".hg",
+    # IDE/Editor specific
+    ".vscode", ".idea", ".project", ".settings", "__pycache__", "*.pyc", "*.pyo",
+    # Compiled/Binary
+    "*.dll", "*.exe", "*.so", "*.o", "*.obj", "*.class", "*.jar",
+    # Archives
+    "*.zip", "*.tar", "*.gz", "*.rar", "*.7z",
+    # Images (often large and not useful for merging text)
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".svg",
+    # Media
+    "*.mp3", "*.wav", "*.mp4", "*.avi", "*.mov",
+    # Docs/Other Binary Formats
+    "*.pdf", "*.doc", "*.docx", "*.xls", "*.xlsx", "*.ppt", "*.pptx", "*.odt", "*.ods",
+    # Logs (can be large, maybe optional)
+    # "*.log"
+    # OS specific
+    "Thumbs.db", ".DS_Store"
+]
+
+
+class IgnoreMatcher:
+    """Compiled form of the ignored file types/names list.
+
+    Patterns are sorted into hash sets once, so checking an entry is O(1):
+      - "name" (e.g. "__pycache__", "Thumbs.db") matches that exact basename
+      - ".ext" (e.g. ".png", ".git") matches the extension or the exact basename
+      - "*.ext" matches the extension
+      - any other glob ("build*", "*.min.js") goes into one precompiled regex
+    Matching is case-insensitive. Hidden entries (leading ".") are always ignored.
+    """
+
+    def __init__(self, patterns):
+        self.patterns = list(patterns)
+        self.names = set()
+        self.extensions = set()
+        globs = []
+
+        for pattern in self.patterns:
+            pattern = pattern.strip().lower()
+            if not pattern:
+                continue
+            if pattern.startswith("*.") and not (_GLOB_CHARS & set(pattern[2:])) and "." not in pattern[2:]:
+                self.extensions.add(pattern[1:])
+            elif _GLOB_CHARS & set(pattern):
+                globs.append(fnmatch.translate(pattern))
+            else:
+                self.names.add(pattern)
+                if pattern.startswith("."):
+                    self.extensions.add(pattern)
+
+        self.glob_regex = re.compile("|".join(globs)) if globs else None
+
+    def is_ignored(self, name):
+        """Return True if a file or folder basename should be skipped"""
+        if name.startswith("."):
+            return True
+        lowered = name.lower()
+        if lowered in self.names:
+            return True
+        ext = os.path.splitext(lowered)[1]
+        if ext and ext in self.extensions:
+            return True
+        return self.glob_regex is not None and self.glob_regex.match(lowered) is not None
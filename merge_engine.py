@@ -0,0 +1,838 @@
+import io
+import os
+import json
+import time
+import datetime
+import threading
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+from content_sniffer import SNIFF_SIZE, sniff_bytes
+from metadata_cache import content_digest
+from token_estimator import estimate_tokens, estimate_export_tokens, format_tokens
+
+WRITE_BUFFER_SIZE = 1024 * 1024
+SECTION_RULE = "~" * 62
+HEADER_RULE = "=" * 80
+FILE_RULE = "-" * 80
+
+# Orders in which files claim a token budget (the export itself keeps the selection order)
+BUDGET_PRIORITIES = {
+    "selection": "Selection order",
+    "smallest": "Smallest files first",
+    "recent": "Recently modified first",
+}
+MIN_TRUNCATED_TOKENS = 100 # Smaller leftovers are not worth a truncated file
+
+READ_BLOCK_SIZE = 64 * 1024 # Read size when only the head/tail of a file is needed
+DEFAULT_BYTES_PER_TOKEN = 4 # Turns a token limit into bytes for files without a cached token count
+LIMIT_KEYS = ("max_file_bytes", "max_file_lines", "max_file_tokens")
+MANIFEST_VERSION = 1
+TIMINGS_VERSION = 1
+
+
+def generate_file_structure(files):
+    """Generate a text representation of the file structure based on a list of file paths"""
+    if not files:
+        return "DIRECTORY STRUCTURE:\n(No files selected)"
+    try:
+        norm_files = [os.path.normpath(f) for f in files]
+        existing_files = [f for f in norm_files if os.path.exists(f)]
+        if not existing_files: common_path = None
+        else:
+             common_path = os.path.commonpath(existing_files)
+             if common_path and not os.path.isdir(common_path):
+                  common_path = os.path.dirname(common_path)
+    except ValueError:
+         common_path = None
+    dirs = {}
+    for file_path in files:
+         norm_file_path = os.path.normpath(file_path)
+         dir_path = os.path.dirname(norm_file_path)
+         if common_path and norm_file_path.startswith(common_path + os.sep): # Ensure common_path is prefix
+             relative_dir = os.path.relpath(dir_path, common_path)
+             if relative_dir == '.': display_dir = common_path
+             else: display_dir = os.path.join(common_path, relative_dir) # Reconstruct with common_path for full display path
+         else: # No common path or different drives
+             display_dir = dir_path
+
+         display_dir = os.path.normpath(display_dir) # Normalize for dictionary key consistency
+
+         if display_dir not in dirs:
+             dirs[display_dir] = []
+         dirs[display_dir].append(os.path.basename(norm_file_path))
+    output = ["DIRECTORY STRUCTURE:"]
+    for dir_path_key in sorted(dirs.keys()):
+        output.append(f"\nDirectory: {dir_path_key}")
+        for file_item in sorted(dirs[dir_path_key]):
+            output.append(f"  |- {file_item}")
+    return "\n".join(output)
+
+
+def build_header(files, prompt="", project_rules="", notes=()):
+    """Text written before the first file: prompt, rules, summary, notes and directory structure"""
+    parts = ["--- START OF FILE export.txt ---\n\n"]
+    if prompt:
+        if not prompt.startswith("GOAL:"): prompt = "GOAL:\n" + prompt
+        parts.append(prompt + "\n" + SECTION_RULE + "\n")
+    if project_rules:
+        if not project_rules.startswith("RULES:"): project_rules = "RULES:\n" + project_rules
+        parts.append(project_rules + "\n" + SECTION_RULE + "\n")
+    parts.append(HEADER_RULE + "\n")
+    parts.append(f"MERGED FILE - Created {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    parts.append(f"Contains {len(files)} files\n")
+    for note in notes:
+        parts.append(note + "\n")
+    parts.append(HEADER_RULE + "\n\n")
+    parts.append(generate_file_structure(files))
+    parts.append("\n\n" + HEADER_RULE + "\n")
+    return "".join(parts)
+
+
+def number_lines(text, first_number=1, relative=False):
+    """Prefix every line of text with its 5-wide line number, dropping trailing whitespace.
+
+    With `relative`, numbers are shown as +1, +2, ... (counted from a gap of unknown length).
+    """
+    lines = text.split("\n")
+    if lines[-1] == "":
+        lines.pop() # Text ending in a newline has no extra empty line
+    sign = "+" if relative else ""
+    return "".join([f"{number:{sign}5d} {line.rstrip()}\n" for number, line in enumerate(lines, first_number)])
+
+
+def _decode(data, encoding):
+    text = data.decode(encoding, errors="replace")
+    # "\r\n" and "\r" become "\n", as when reading in text mode
+    if "\r" in text:
+        text = text.replace("\r\n", "\n").replace("\r", "\n")
+    return text
+
+
+def _count_lines(data):
+    """Number of lines in data, including a last line without a newline"""
+    return data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+
+
+def _read_head(f, max_bytes=None, max_lines=None):
+    """Read the leading whole lines of f that fit in max_bytes and max_lines"""
+    f.seek(0)
+    data = b""
+    while max_bytes is None or len(data) < max_bytes:
+        want = READ_BLOCK_SIZE if max_bytes is None else min(READ_BLOCK_SIZE, max_bytes - len(data))
+        chunk = f.read(want)
+        if not chunk:
+            return data
+        data += chunk
+        if max_lines is not None and data.count(b"\n") >= max_lines:
+            end = -1
+            for _ in range(max_lines):
+                end = data.find(b"\n", end + 1)
+            return data[:end + 1]
+    # Stopped by max_bytes: drop the partial last line (a single huge line is kept cut)
+    cut = data.rfind(b"\n")
+    return data[:cut + 1] if cut != -1 else data
+
+
+def _read_tail(f, size, stop, max_bytes=None, max_lines=None):
+    """Read the trailing whole lines of f that fit the limits, from no earlier than offset stop.
+
+    Seeks backwards from the end, so only the kept bytes are read. Returns (offset, data).
+    """
+    pos = size
+    data = b""
+    while pos > stop:
+        want = min(READ_BLOCK_SIZE, pos - stop)
+        if max_bytes is not None:
+            want = min(want, max_bytes - len(data))
+        if want <= 0:
+            break
+        pos -= want
+        f.seek(pos)
+        data = f.read(want) + data
+        if max_lines is not None and data.count(b"\n") > max_lines:
+            break
+    if max_lines is not None:
+        # Keep the last max_lines lines; the final one may lack its newline
+        end = len(data) - 1 if data.endswith(b"\n") else len(data)
+        for _ in range(max_lines):
+            end = data.rfind(b"\n", 0, end)
+            if end == -1:
+                break
+        if end != -1:
+            return pos + end + 1, data[end + 1:]
+    if pos > stop:
+        # Started mid-line: drop the partial first line (a single huge line is kept cut)
+        cut = data.find(b"\n")
+        if cut != -1 and cut < len(data) - 1:
+            return pos + cut + 1, data[cut + 1:]
+    return pos, data
+
+
+def _file_limits(record, size, limits):
+    """Turn the per-file limits into (max_bytes, max_lines, reason) for one file; None where unlimited"""
+    max_bytes = max_lines = None
+    reasons = []
+    if limits.get("max_file_bytes") and size > limits["max_file_bytes"]:
+        max_bytes = limits["max_file_bytes"]
+        reasons.append(f"{max_bytes:,}-byte")
+    max_tokens = limits.get("max_file_tokens")
+    tokens = record.get("tokens") if record else None
+    if max_tokens and (tokens is None or tokens > max_tokens):
+        # Tokens map to bytes with the file's own ratio when its token count is cached
+        bytes_per_token = size / tokens if tokens else DEFAULT_BYTES_PER_TOKEN
+        token_bytes = int(max_tokens * bytes_per_token)
+        if size > token_bytes:
+            max_bytes = token_bytes if max_bytes is None else min(max_bytes, token_bytes)
+            reasons.append(f"{max_tokens:,}-token")
+    lines = record.get("lines") if record else None
+    if limits.get("max_file_lines") and (lines is None or lines > limits["max_file_lines"]):
+        max_lines = limits["max_file_lines"]
+        reasons.append(f"{max_lines:,}-line")
+    return max_bytes, max_lines, " / ".join(reasons) + " limit"
+
+
+def kept_share(record, limits):
+    """Estimated fraction of a file (0-1) that the per-file limits keep, for token budgeting"""
+    share = 1.0
+    if not record or not limits:
+        return share
+    if limits.get("max_file_bytes") and record.get("size"):
+        share = min(share, limits["max_file_bytes"] / record["size"])
+    if limits.get("max_file_lines") and record.get("lines"):
+        share = min(share, limits["max_file_lines"] / record["lines"])
+    if limits.get("max_file_tokens") and record.get("tokens"):
+        share = min(share, limits["max_file_tokens"] / record["tokens"])
+    return share
+
+
+def _read_content(f, size, encoding, record, budget_lines, limits):
+    """Numbered content of an open text file, keeping head and tail of files over the limits.
+
+    Only the kept bytes are read: if the line count is not cached, the lines
+    left out are not counted, and the tail is numbered relative to the gap.
+    """
+    total_lines = record.get("lines") if record else None
+    if size <= READ_BLOCK_SIZE:
+        # One read serves head, tail and line count alike
+        f.seek(0)
+        data = f.read()
+        f = io.BytesIO(data)
+        if total_lines is None:
+            total_lines = _count_lines(data)
+            record = dict(record or {}, lines=total_lines)
+    max_bytes, max_lines, reason = _file_limits(record, size, limits)
+    if budget_lines is not None and (max_bytes is not None or max_lines is not None):
+        # Over the per-file limits too: keep their head and tail form, within the budget's lines
+        if max_lines is None or budget_lines < max_lines:
+            max_lines = budget_lines
+            reason += " and the token budget"
+    elif budget_lines is not None:
+        # Cut to fit the token budget: keep only the head
+        head = _read_head(f, None, budget_lines)
+        kept = _count_lines(head)
+        content = number_lines(_decode(head, encoding))
+        if total_lines is not None and total_lines > kept:
+            content += f"... [{total_lines - kept:,} more lines omitted to fit the token budget]\n"
+        elif total_lines is None and len(head) < size:
+            content += f"... [{size - len(head):,} more bytes omitted to fit the token budget]\n"
+        return content
+    if max_bytes is None and max_lines is None:
+        f.seek(0)
+        return number_lines(_decode(f.read(), encoding))
+
+    # Head and tail each get half of the limits
+    head = _read_head(f, max_bytes // 2 if max_bytes else None, (max_lines + 1) // 2 if max_lines else None)
+    tail_start, tail = _read_tail(
+        f, size, len(head),
+        max_bytes - max_bytes // 2 if max_bytes else None, max_lines // 2 if max_lines else None
+    )
+    if tail_start <= len(head):
+        # The file fits after all (e.g. its line count was not known)
+        return number_lines(_decode(head + tail, encoding))
+
+    head_lines = _count_lines(head)
+    omitted_bytes = tail_start - len(head)
+    if total_lines is None:
+        return (
+            number_lines(_decode(head, encoding))
+            + f"... [{omitted_bytes:,} bytes omitted: file is over the {reason}; lines below are numbered from here]\n"
+            + number_lines(_decode(tail, encoding), relative=True)
+        )
+    omitted_lines = max(total_lines - head_lines - _count_lines(tail), 0)
+    return (
+        number_lines(_decode(head, encoding))
+        + f"... [{omitted_lines:,} lines ({omitted_bytes:,} bytes) omitted: file is over the {reason}]\n"
+        + number_lines(_decode(tail, encoding), head_lines + omitted_lines + 1)
+    )
+
+
+class _TimedReader:
+    """Binary file wrapper that adds up the time and bytes of its reads.
+
+    With `digest` (see metadata_cache.content_digest), the bytes read from the
+    start of the file onwards are also hashed, so a file that is read whole
+    anyway does not have to be read again for its content hash.
+    """
+
+    def __init__(self, f, seconds=0.0, digest=None):
+        self._file = f
+        self.seconds = seconds
+        self.bytes = 0
+        self.digest = digest
+        self.hashed = 0 # Leading bytes of the file fed to digest
+
+    def read(self, size=-1):
+        started = time.perf_counter()
+        position = self._file.tell() if self.digest is not None else 0
+        data = self._file.read(size)
+        self.seconds += time.perf_counter() - started
+        self.bytes += len(data)
+        if self.digest is not None and position <= self.hashed < position + len(data):
+            self.digest.update(data[self.hashed - position:])
+            self.hashed = position + len(data)
+        return data
+
+    def seek(self, offset, whence=0):
+        return self._file.seek(offset, whence)
+
+    def fileno(self):
+        return self._file.fileno()
+
+
+def format_file_block(file_path, record=None, max_lines=None, limits=None, timings=None, with_hash=False):
+    """Read a file and return its complete section of the merged output.
+
+    `record` is the file's cached metadata (encoding, lines, tokens) if known.
+    Binary files become a one-line note after reading only their first bytes.
+    Files over the per-file `limits` (max_file_bytes/lines/tokens) keep only
+    their head and tail, read by seeking; `max_lines` (from the token budget)
+    keeps only the head. Time spent opening and reading the file, and the
+    rest (decoding, numbering), is added to `timings` (see MergeTimings).
+    With `with_hash`, returns (block, content hash) instead; the hash (as
+    hash_file computes it) is None unless the whole file was read.
+    """
+    started = time.perf_counter()
+    infile = None
+    size = None
+    try:
+        with open(file_path, "rb") as f:
+            infile = _TimedReader(f, time.perf_counter() - started, content_digest() if with_hash else None)
+            size = os.fstat(infile.fileno()).st_size
+            sniffed_encoding, is_binary = sniff_bytes(infile.read(SNIFF_SIZE))
+            if is_binary:
+                content = f"[Binary file, {size:,} bytes - content not included]\n"
+            else:
+                encoding = (record.get("encoding") if record else None) or sniffed_encoding
+                source = infile
+                if encoding.startswith("utf-16"):
+                    # Newlines are not single bytes in UTF-16: work on a UTF-8 copy instead
+                    infile.seek(0)
+                    source = io.BytesIO(infile.read().decode(encoding, errors="replace").encode("utf-8"))
+                    encoding = "utf-8"
+                    size = len(source.getbuffer())
+                content = _read_content(source, size, encoding, record, max_lines, limits or {})
+    except Exception as e:
+        content = f"ERROR reading file content: {e}\n"
+    if timings is not None:
+        read_seconds = infile.seconds if infile is not None else time.perf_counter() - started
+        timings.add("reading", read_seconds, infile.bytes if infile is not None else 0)
+        timings.add("decoding", time.perf_counter() - started - read_seconds)
+    block = file_block(file_path, content)
+    if not with_hash:
+        return block
+    complete = infile is not None and size is not None and infile.hashed == size
+    return block, infile.digest.hexdigest() if complete else None
+
+
+def file_block(file_path, content):
+    """The section of the merged output for one file with the given content"""
+    return f"\n{FILE_RULE}\nFILE: {os.path.normpath(file_path)}\n{FILE_RULE}\n\n{content}\n\n"
+
+
+def duplicate_note(original_path):
+    """Content written in place of a file whose bytes repeat an earlier file of the export"""
+    return f"[Same as FILE: {os.path.normpath(original_path)} - content not repeated]\n"
+
+
+def find_duplicates(files, size_of, hash_of):
+    """Map each file whose content repeats an earlier file in files to that first file.
+
+    Files are bucketed by `size_of(path)` first, so `hash_of(path)` is only
+    called for files that share their size with another file. Unreadable and
+    empty files are never treated as duplicates.
+    """
+    by_size = {}
+    for path in files:
+        try:
+            size = size_of(path)
+        except OSError:
+            continue
+        if size:
+            by_size.setdefault(size, []).append(path)
+    duplicates = {}
+    for group in by_size.values():
+        if len(group) < 2:
+            continue
+        first_by_hash = {}
+        for path in group:
+            try:
+                digest = hash_of(path)
+            except OSError:
+                continue
+            original = first_by_hash.setdefault(digest, path)
+            if original != path:
+                duplicates[path] = original
+    return duplicates
+
+
+def resolve_duplicates(files, duplicates):
+    """Limit duplicates to the files being merged, pointing each at the first of its copies still in files"""
+    first = {}
+    resolved = {}
+    for path in files:
+        original = first.setdefault(duplicates.get(path, path), path)
+        if original != path:
+            resolved[path] = original
+    return resolved
+
+
+def duplicates_note(duplicates):
+    """Header note for an export with duplicate files (empty if there are none)"""
+    if not duplicates:
+        return []
+    return [f"Duplicates: {len(duplicates)} files repeat the content of an earlier file and reference it instead"]
+
+
+class MergeWriter:
+    """Buffered binary output that encodes text as UTF-8 with the platform's line endings"""
+
+    def __init__(self, output_path):
+        self._file = open(output_path, "wb", buffering=WRITE_BUFFER_SIZE)
+        self.position = 0 # Bytes written so far
+        self.seconds = 0.0 # Time spent writing (and closing)
+
+    @staticmethod
+    def encode(text):
+        """Encode text the way write() does, e.g. on a worker thread"""
+        if os.linesep != "\n":
+            text = text.replace("\n", os.linesep)
+        return text.encode("utf-8", errors="replace")
+
+    def write(self, text):
+        self.write_bytes(self.encode(text))
+
+    def write_bytes(self, data):
+        started = time.perf_counter()
+        self._file.write(data)
+        self.seconds += time.perf_counter() - started
+        self.position += len(data)
+
+    def close(self):
+        started = time.perf_counter()
+        self._file.close()
+        self.seconds += time.perf_counter() - started
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def _format_duration(seconds):
+    """e.g. "42 s" or "3:05" """
+    seconds = int(seconds + 0.5)
+    if seconds < 60:
+        return f"{seconds} s"
+    hours, rest = divmod(seconds, 3600)
+    minutes, seconds = divmod(rest, 60)
+    return f"{hours}:{minutes:02}:{seconds:02}" if hours else f"{minutes}:{seconds:02}"
+
+
+class MergeTimings:
+    """Where the time of one export goes, for the progress dialog and the timings file (see timings_path).
+
+    Phases: listing (enumerating the selection), planning (changes, duplicates,
+    token budget), reading (stat, open and read, or copying a reused block),
+    hashing, decoding (decoding, numbering and encoding text), waiting (the
+    writer idle until the next block is ready) and writing. Reading, hashing
+    and decoding run on the worker pool, so their seconds are summed over the
+    workers and can add up to more than the elapsed time.
+    """
+    PHASES = ("listing", "planning", "reading", "hashing", "decoding", "waiting", "writing")
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.merge_started = self.started # Set by merge_files; rates and the ETA are measured from here
+        self.seconds = dict.fromkeys(self.PHASES, 0.0)
+        self.bytes_read = 0
+        self._lock = threading.Lock()
+
+    def add(self, phase, seconds, bytes_read=0):
+        """Add to a phase's time (and the bytes read). Thread-safe"""
+        with self._lock:
+            self.seconds[phase] += seconds
+            self.bytes_read += bytes_read
+
+    def elapsed(self):
+        """Seconds since the export started"""
+        return time.perf_counter() - self.started
+
+    @contextmanager
+    def timed(self, phase):
+        """Add the time spent in a with block to phase"""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - started)
+
+    def describe(self, done, total, bytes_written):
+        """Live throughput and ETA after done of total files, e.g. "3.2 MB/s, 140 files/s, about 0:12 left" """
+        elapsed = time.perf_counter() - self.merge_started
+        if elapsed <= 0 or not done:
+            return ""
+        files_per_second = done / elapsed
+        text = f"{bytes_written / elapsed / 1e6:.1f} MB/s, {files_per_second:,.0f} files/s"
+        if done < total:
+            text += f", about {_format_duration((total - done) / files_per_second)} left"
+        return text
+
+    def summary(self, output_path, files, bytes_written, workers):
+        """The timings of a finished export, as saved next to it"""
+        now = time.perf_counter()
+        merge_seconds = now - self.merge_started
+        return {
+            "version": TIMINGS_VERSION,
+            "created": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            "output": output_path,
+            "files": files,
+            "bytes_read": self.bytes_read,
+            "bytes_written": bytes_written,
+            "workers": workers,
+            "elapsed_seconds": round(now - self.started, 3),
+            "merge_seconds": round(merge_seconds, 3),
+            "files_per_second": round(files / merge_seconds, 1) if merge_seconds > 0 else None,
+            "mb_per_second": round(bytes_written / merge_seconds / 1e6, 2) if merge_seconds > 0 else None,
+            "phase_seconds": {phase: round(seconds, 3) for phase, seconds in self.seconds.items()},
+        }
+
+
+def file_overhead_tokens(file_path):
+    """Estimated tokens a file adds besides its content: its separator block and structure entry"""
+    return estimate_tokens(
+        f"\n{FILE_RULE}\nFILE: {os.path.normpath(file_path)}\n{FILE_RULE}\n\n\n\n  |- {os.path.basename(file_path)}\n"
+    )
+
+
+def plan_token_budget(files, budget, file_info, priority="selection", overflow="truncate", reserved=0, limits=None,
+                      duplicates=None):
+    """Choose which files fit in a token budget. Returns (files, max_lines, used_tokens).
+
+    `file_info[path]` is a metadata record with tokens/lines/mtime (None if the
+    file cannot be read). Files claim the budget in `priority` order; a file
+    that does not fit is skipped, or with overflow="truncate" cut to the lines
+    that still fit (listed in max_lines). Smaller files later in the order may
+    still fit. The chosen files keep their original order. `reserved` tokens
+    (prompt, rules, header) are taken off the budget first. Files are counted
+    at the size the per-file `limits` leave them, and `duplicates` (see
+    find_duplicates) only cost their reference once their original is chosen.
+    """
+    duplicates = duplicates or {}
+    order = list(files)
+    if priority == "smallest":
+        order.sort(key=lambda path: file_info.get(path)["tokens"] if file_info.get(path) else 0)
+    elif priority == "recent":
+        order.sort(key=lambda path: file_info.get(path)["mtime"] if file_info.get(path) else 0, reverse=True)
+
+    remaining = budget - reserved
+    chosen = set()
+    max_lines = {}
+    for path in order:
+        info = file_info.get(path)
+        overhead = file_overhead_tokens(path)
+        content = kept_lines = 0
+        if duplicates.get(path) in chosen:
+            content = estimate_tokens(duplicate_note(duplicates[path]))
+        elif info:
+            share = kept_share(info, limits)
+            kept_lines = int(info["lines"] * share)
+            content = estimate_export_tokens(int(info["tokens"] * share), kept_lines)
+        if overhead + content <= remaining:
+            chosen.add(path)
+            remaining -= overhead + content
+        elif overflow == "truncate" and content and path not in duplicates and kept_lines and remaining - overhead >= MIN_TRUNCATED_TOKENS:
+            # Per line of what the limits keep, not of the whole file
+            tokens_per_line = content / kept_lines
+            lines = int((remaining - overhead) / tokens_per_line)
+            if lines > 0:
+                chosen.add(path)
+                max_lines[path] = lines
+                remaining -= overhead + int(lines * tokens_per_line)
+    return [path for path in files if path in chosen], max_lines, budget - remaining
+
+
+def apply_token_budget(files, options, analyze, prompt="", project_rules="", duplicates=None):
+    """Apply the token budget of merge options. Returns (files, max_lines, header notes).
+
+    `analyze(path)` returns a metadata record (MetadataCache.analyze), so cached
+    token counts are used without re-reading unchanged files.
+    """
+    budget = options.get("token_budget") or 0
+    if budget <= 0:
+        return files, {}, []
+    file_info = {}
+    for path in files:
+        try:
+            file_info[path] = analyze(path)
+        except OSError:
+            file_info[path] = None
+    reserved = estimate_tokens(build_header([], prompt, project_rules))
+    chosen, max_lines, used = plan_token_budget(
+        files, budget, file_info,
+        options.get("budget_priority", "selection"), options.get("budget_overflow", "truncate"), reserved, options, duplicates
+    )
+    notes = [f"Token budget: {format_tokens(used)} of {budget:,} tokens (estimated), "
+             f"{len(files) - len(chosen)} files omitted, {len(max_lines)} truncated"]
+    return chosen, max_lines, notes
+
+
+def manifest_path(output_path):
+    """Where the manifest of an export is kept"""
+    return output_path + ".manifest.json"
+
+
+def timings_path(output_path):
+    """Where the timing summary of an export is saved (see MergeTimings)"""
+    return output_path + ".timings.json"
+
+
+def changes_path(output_path):
+    """Where a changes-only export of output_path is written (e.g. export.changes.txt)"""
+    base, ext = os.path.splitext(output_path)
+    return f"{base}.changes{ext or '.txt'}"
+
+
+def load_manifest(output_path):
+    """The manifest of the last full export to output_path, or None if there is no usable one"""
+    try:
+        with open(manifest_path(output_path), "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if not isinstance(manifest, dict) or manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def _save_json(path, data, indent=None):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent)
+    os.replace(path + ".tmp", path)
+
+
+def _save_manifest(output_path, manifest):
+    _save_json(manifest_path(output_path), manifest)
+
+
+def _limits_key(limits):
+    """The per-file limits a manifest's blocks were written with"""
+    return {key: (limits or {}).get(key) or 0 for key in LIMIT_KEYS}
+
+
+def _unchanged(entry, stats, file_path, hash_of=None):
+    """True if a file still matches its manifest entry"""
+    if entry.get("size") != stats.st_size:
+        return False
+    if entry.get("mtime_ns") == stats.st_mtime_ns:
+        return True
+    # Touched but possibly not edited: compare content hashes when both are known
+    if entry.get("hash") and hash_of is not None:
+        try:
+            return hash_of(file_path) == entry["hash"]
+        except OSError:
+            return False
+    return False
+
+
+def compare_to_manifest(files, manifest, hash_of=None):
+    """Split files against a previous export. Returns (added, modified, removed) lists of paths"""
+    entries = manifest.get("files", {})
+    added = []
+    modified = []
+    for file_path in files:
+        entry = entries.get(file_path)
+        if entry is None:
+            added.append(file_path)
+            continue
+        try:
+            stats = os.stat(file_path)
+        except OSError:
+            modified.append(file_path)
+            continue
+        if not _unchanged(entry, stats, file_path, hash_of):
+            modified.append(file_path)
+    current = set(files)
+    removed = [file_path for file_path in entries if file_path not in current]
+    return added, modified, removed
+
+
+def plan_changes(files, output_path, hash_of=None):
+    """Files and header notes of a changes-only export against the last full export to output_path.
+
+    Returns (changed files, notes), or None if output_path has no manifest yet.
+    """
+    manifest = load_manifest(output_path)
+    if manifest is None:
+        return None
+    added, modified, removed = compare_to_manifest(files, manifest, hash_of)
+    changed = set(added) | set(modified)
+    notes = [f"Changes since the export of {manifest.get('created', 'unknown')} to {os.path.basename(output_path)}: "
+             f"{len(added)} added, {len(modified)} modified, {len(removed)} removed"]
+    notes += [f"Removed: {os.path.normpath(file_path)}" for file_path in removed]
+    return [file_path for file_path in files if file_path in changed], notes
+
+
+def _reusable_output(output_path, manifest, limits):
+    """Open the previous export for splicing if it is still exactly what the manifest describes"""
+    if manifest is None or manifest.get("limits") != _limits_key(limits) or manifest.get("linesep") != os.linesep:
+        return None
+    try:
+        stats = os.stat(output_path)
+        if stats.st_size != manifest.get("output_size") or stats.st_mtime_ns != manifest.get("output_mtime_ns"):
+            return None
+        return open(output_path, "rb")
+    except OSError:
+        return None
+
+
+def merge_files(files, output_path, prompt="", project_rules="", record_for=None,
+                on_progress=None, is_cancelled=None, max_workers=8, max_lines=None, notes=(), limits=None,
+                duplicates=None, reuse_previous=False, hash_of=None, write_manifest=True, timings=None):
+    """Write the merged export of files to output_path. Returns False if cancelled.
+
+    Upcoming files are read and formatted on a thread pool a bounded window
+    ahead of the writer, and their blocks are written strictly in list order.
+    `record_for(path)` may return the file's cached metadata (encoding, lines,
+    tokens) or None, `on_progress(done, path, bytes_written)` is called (on
+    this thread) before each file is written and `is_cancelled()` is checked between files. `max_lines` maps
+    paths to the number of lines to keep (see plan_token_budget), `limits`
+    holds the per-file caps (see format_file_block) and `notes` are extra
+    header lines. Files in `duplicates` (see resolve_duplicates) reference
+    their original instead of being read. Nothing here touches Tk.
+
+    The export is written to a temporary file that replaces output_path when
+    complete, and with `write_manifest` a manifest of its blocks (see
+    load_manifest) is saved next to it. With `reuse_previous`, blocks of files
+    that are unchanged since the previous export are copied from the old
+    output instead of re-reading the files. With `hash_of`, content hashes
+    are recorded in the manifest so files that were only touched (new mtime,
+    same content) still count as unchanged; they come from the bytes read for
+    the export, and hash_of(path) is only called for files not read whole.
+
+    Time and bytes are tracked in `timings` (a MergeTimings, which may already
+    hold the caller's listing/planning time) and saved to timings_path.
+    """
+    timings = timings or MergeTimings()
+    timings.merge_started = time.perf_counter()
+    max_lines = max_lines or {}
+    duplicates = duplicates or {}
+    previous = load_manifest(output_path) if reuse_previous else None
+    old_output = _reusable_output(output_path, previous, limits)
+    old_entries = previous["files"] if old_output is not None else {}
+    old_output_lock = threading.Lock()
+
+    def read_block(file_path):
+        """Returns (manifest entry without offsets, encoded block)"""
+        started = time.perf_counter()
+        variant = [max_lines.get(file_path), duplicates.get(file_path)]
+        try:
+            stats = os.stat(file_path)
+        except OSError:
+            stats = None
+        entry = {"size": stats.st_size, "mtime_ns": stats.st_mtime_ns, "variant": variant} if stats else {}
+        old = old_entries.get(file_path)
+        if old is not None and stats is not None and old.get("variant") == variant and _unchanged(old, stats, file_path, hash_of):
+            with old_output_lock:
+                old_output.seek(old["offset"])
+                data = old_output.read(old["length"])
+            if len(data) == old["length"]:
+                entry["hash"] = old.get("hash")
+                timings.add("reading", time.perf_counter() - started, len(data))
+                return entry, data
+        timings.add("reading", time.perf_counter() - started)
+        if file_path in duplicates:
+            with timings.timed("decoding"):
+                return entry, MergeWriter.encode(file_block(file_path, duplicate_note(duplicates[file_path])))
+        record = record_for(file_path) if record_for is not None else None
+        if not (write_manifest and hash_of is not None and stats is not None):
+            block = format_file_block(file_path, record, max_lines.get(file_path), limits, timings)
+        else:
+            block, digest = format_file_block(file_path, record, max_lines.get(file_path), limits, timings, with_hash=True)
+            if digest is None:
+                # Only part of the file was read (binary or over the limits): hash it separately
+                with timings.timed("hashing"):
+                    try:
+                        digest = hash_of(file_path)
+                    except OSError:
+                        pass
+            if digest is not None:
+                entry["hash"] = digest
+        with timings.timed("decoding"):
+            return entry, MergeWriter.encode(block)
+
+    entries = {}
+    temp_path = output_path + ".tmp"
+    window = max_workers * 4 # Blocks held in memory ahead of the writer
+    pending = deque()
+    next_index = 0
+    completed = False
+    try:
+        with MergeWriter(temp_path) as writer, ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="merge") as executor:
+            writer.write(build_header(files, prompt, project_rules, notes))
+            for i, file_path in enumerate(files):
+                while next_index < len(files) and len(pending) < window:
+                    pending.append(executor.submit(read_block, files[next_index]))
+                    next_index += 1
+                if is_cancelled is not None and is_cancelled():
+                    for future in pending:
+                        future.cancel()
+                    return False
+                if on_progress is not None:
+                    on_progress(i + 1, file_path, writer.position)
+                with timings.timed("waiting"):
+                    entry, data = pending.popleft().result()
+                if entry:
+                    entry["offset"] = writer.position
+                    entry["length"] = len(data)
+                    entries[file_path] = entry
+                writer.write_bytes(data)
+            writer.write("\n--- END OF FILE export.txt ---\n")
+        completed = True
+    finally:
+        if old_output is not None:
+            old_output.close()
+        if not completed and os.path.exists(temp_path):
+            # Cancelled or failed: keep the previous export as it was
+            os.remove(temp_path)
+    timings.add("writing", writer.seconds)
+    with timings.timed("writing"):
+        os.replace(temp_path, output_path)
+        if write_manifest:
+            stats = os.stat(output_path)
+            _save_manifest(output_path, {
+                "version": MANIFEST_VERSION,
+                "created": datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+                "output_size": stats.st_size,
+                "output_mtime_ns": stats.st_mtime_ns,
+                "linesep": os.linesep,
+                "limits": _limits_key(limits),
+                "files": entries,
+            })
+    try:
+        _save_json(timings_path(output_path), timings.summary(output_path, len(files), writer.position, max_workers), indent=2)
+    except OSError as e:
+        print(f"Warning: Could not save export timings: {e}")
+    return True
@@ -0,0 +1,207 @@
+import os
+import codecs
+import hashlib
+import sqlite3
+import threading
+
+from content_sniffer import SNIFF_SIZE, sniff_bytes, sniff_file
+from token_estimator import estimate_tokens
+
+# Columns stored per file besides the (size, mtime_ns) validity key.
+# New columns are added to existing databases automatically on open.
+COLUMNS = [
+    ("chars", "INTEGER"),
+    ("lines", "INTEGER"),
+    ("encoding", "TEXT"),
+    ("is_binary", "INTEGER"),
+    ("tokens", "INTEGER"),
+    ("content_hash", "TEXT"),
+]
+
+READ_CHUNK_SIZE = 1024 * 1024
+
+
+def analyze_file(path):
+    """Read a file once and return its text metrics (chars, lines, tokens, encoding, is_binary)"""
+    with open(path, "rb") as f:
+        head = f.read(READ_CHUNK_SIZE)
+        encoding, is_binary = sniff_bytes(head[:SNIFF_SIZE])
+        if is_binary:
+            return {"chars": 0, "lines": 0, "tokens": 0, "encoding": None, "is_binary": True}
+
+        decoder = codecs.getincrementaldecoder(encoding)(errors="replace")
+        chars = lines = tokens = 0
+        last_char = ""
+        chunk = head
+        while chunk:
+            text = decoder.decode(chunk)
+            # Match text-mode reads, where "\r\n" becomes a single "\n"
+            chars += len(text) - text.count("\r\n")
+            lines += text.count("\n")
+            tokens += estimate_tokens(text)
+            if text:
+                last_char = text[-1]
+            chunk = f.read(READ_CHUNK_SIZE)
+        text = decoder.decode(b"", final=True)
+        chars += len(text)
+        tokens += estimate_tokens(text)
+        if text:
+            last_char = text[-1]
+        if last_char and last_char != "\n":
+            lines += 1
+    return {"chars": chars, "lines": lines, "tokens": tokens, "encoding": encoding, "is_binary": False}
+
+
+def content_digest():
+    """A new hash object of the kind hash_file uses, for callers that already read a file's bytes"""
+    return hashlib.blake2b(digest_size=16)
+
+
+def hash_file(path):
+    """Hex digest of a file's bytes, used to find files with identical content"""
+    digest = content_digest()
+    with open(path, "rb") as f:
+        chunk = f.read(READ_CHUNK_SIZE)
+        while chunk:
+            digest.update(chunk)
+            chunk = f.read(READ_CHUNK_SIZE)
+    return digest.hexdigest()
+
+
+class MetadataCache:
+    """Per-file metadata persisted in ~/.filemerger/metadata.db.
+
+    Rows are keyed by path and only trusted while the file's (size, mtime_ns)
+    still match, so unchanged files never have to be read again, even across
+    restarts. Safe to use from worker threads.
+    """
+    COMMIT_EVERY = 200
+
+    def __init__(self, config_dir):
+        self.db_path = os.path.join(config_dir, "metadata.db")
+        self._lock = threading.Lock()
+        self._pending_writes = 0
+        try:
+            self._conn = self._open(self.db_path)
+        except sqlite3.Error as e:
+            print(f"Warning: Could not open metadata cache {self.db_path}: {e}. Using an in-memory cache.")
+            self._conn = self._open(":memory:")
+
+    def _open(self, db_path):
+        conn = sqlite3.connect(db_path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("CREATE TABLE IF NOT EXISTS files (path TEXT PRIMARY KEY, size INTEGER, mtime_ns INTEGER)")
+        existing = {row[1] for row in conn.execute("PRAGMA table_info(files)")}
+        for name, sql_type in COLUMNS:
+            if name not in existing:
+                conn.execute(f"ALTER TABLE files ADD COLUMN {name} {sql_type}")
+        conn.commit()
+        return conn
+
+    def lookup(self, path, stats=None):
+        """Return the cached fields for path, or None if missing or stale"""
+        if stats is None:
+            try:
+                stats = os.stat(path)
+            except OSError:
+                return None
+        names = ", ".join(name for name, _ in COLUMNS)
+        with self._lock:
+            row = self._conn.execute(
+                f"SELECT size, mtime_ns, {names} FROM files WHERE path = ?", (path,)
+            ).fetchone()
+        if row is None or row[0] != stats.st_size or row[1] != stats.st_mtime_ns:
+            return None
+        record = {name: value for (name, _), value in zip(COLUMNS, row[2:])}
+        record["size"] = stats.st_size
+        record["mtime"] = stats.st_mtime
+        if record["is_binary"] is not None:
+            record["is_binary"] = bool(record["is_binary"])
+        return record
+
+    def store(self, path, stats, **fields):
+        """Store fields for path at its current (size, mtime_ns).
+
+        Other cached fields are kept if the file is unchanged and cleared otherwise.
+        """
+        keep = ", ".join(
+            f"{name} = CASE WHEN files.size = excluded.size AND files.mtime_ns = excluded.mtime_ns "
+            f"THEN files.{name} ELSE NULL END"
+            for name, _ in COLUMNS if name not in fields
+        )
+        updates = ["size = excluded.size", "mtime_ns = excluded.mtime_ns"] + [f"{name} = excluded.{name}" for name in fields]
+        if keep:
+            updates.insert(0, keep)
+        columns = ["path", "size", "mtime_ns"] + list(fields)
+        values = [path, stats.st_size, stats.st_mtime_ns] + [
+            int(v) if isinstance(v, bool) else v for v in fields.values()
+        ]
+        sql = (
+            f"INSERT INTO files ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))}) "
+            f"ON CONFLICT(path) DO UPDATE SET {', '.join(updates)}"
+        )
+        with self._lock:
+            self._conn.execute(sql, values)
+            self._pending_writes += 1
+            if self._pending_writes >= self.COMMIT_EVERY:
+                self._conn.commit()
+                self._pending_writes = 0
+
+    def analyze(self, path):
+        """Return size/mtime/chars/lines/tokens/encoding/is_binary for path, reading it only on a cache miss"""
+        stats = os.stat(path)
+        record = self.lookup(path, stats)
+        if record is not None and record["chars"] is not None and record["tokens"] is not None:
+            return record
+        fields = analyze_file(path)
+        self.store(path, stats, **fields)
+        fields["size"] = stats.st_size
+        fields["mtime"] = stats.st_mtime
+        return fields
+
+    def sniff(self, path, stats=None):
+        """Return (encoding, is_binary) for path, reading only its first bytes on a cache miss"""
+        if stats is None:
+            stats = os.stat(path)
+        record = self.lookup(path, stats)
+        if record is not None and record["is_binary"] is not None:
+            return record["encoding"], record["is_binary"]
+        encoding, is_binary = sniff_file(path)
+        self.store(path, stats, encoding=encoding, is_binary=is_binary)
+        return encoding, is_binary
+
+    def is_binary(self, path, stats=None):
+        """Return True if path is a binary file (see content_sniffer), False if unreadable"""
+        try:
+            return self.sniff(path, stats)[1]
+        except OSError:
+            return False
+
+    def cached_is_binary(self, path, stats=None):
+        """is_binary from the cache only, without reading the file: None if not known yet"""
+        record = self.lookup(path, stats)
+        return None if record is None else record["is_binary"]
+
+    def content_hash(self, path, stats=None):
+        """Return the content hash of path (see hash_file), reading it only on a cache miss"""
+        if stats is None:
+            stats = os.stat(path)
+        record = self.lookup(path, stats)
+        if record is not None and record["content_hash"] is not None:
+            return record["content_hash"]
+        digest = hash_file(path)
+        self.store(path, stats, content_hash=digest)
+        return digest
+
+    def flush(self):
+        """Commit pending writes to disk"""
+        with self._lock:
+            if self._pending_writes:
+                self._conn.commit()
+                self._pending_writes = 0
+
+    def close(self):
+        self.flush()
+        with self._lock:
+            self._conn.close()
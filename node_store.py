@@ -0,0 +1,115 @@
+import os
+import sys
+from array import array
+
+from virtual_listing import KIND_DIR, KIND_ERROR
+
+
+class NodeStore:
+    """The entries that have a row in the file tree, identified by small integers.
+
+    A node is stored as its name, its parent's id and its kind, in parallel
+    arrays indexed by id; full paths are rebuilt from the parent chain when
+    needed instead of being kept per row (and per Tk item), and names are
+    interned so common ones (__init__.py, README.md) are stored once. Tree
+    rows use str(id) as their iid (see FileOperations.row_for / path_of).
+    Ids of removed nodes are not reused, so a stale id never names another entry.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.names = [] # Node id -> name (the root's is its full path); None once removed
+        self.parents = array("l") # Node id -> parent id, -1 for the root
+        self.kinds = bytearray() # Node id -> KIND_FILE, KIND_DIR or KIND_ERROR
+        self.children = {} # Folder id -> {name: child id}
+        self.root = None
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __contains__(self, node_id):
+        return 0 <= node_id < len(self.names) and self.names[node_id] is not None
+
+    def add(self, parent, name, kind):
+        """Add a node under parent (None for the root) and return its id; an existing child of that name is reused"""
+        if parent is None:
+            if self.root is not None:
+                return self.root
+        else:
+            siblings = self.children.setdefault(parent, {})
+            node_id = siblings.get(name)
+            if node_id is not None:
+                return node_id
+        node_id = len(self.names)
+        name = sys.intern(name)
+        self.names.append(name)
+        self.parents.append(-1 if parent is None else parent)
+        self.kinds.append(kind)
+        if parent is None:
+            self.root = node_id
+        else:
+            siblings[name] = node_id
+        self.count += 1
+        return node_id
+
+    def remove(self, node_id):
+        """Drop a node and everything below it"""
+        parent = self.parents[node_id]
+        if parent >= 0:
+            siblings = self.children.get(parent)
+            if siblings is not None:
+                siblings.pop(self.names[node_id], None)
+        elif node_id == self.root:
+            self.root = None
+        stack = [node_id]
+        while stack:
+            current = stack.pop()
+            stack.extend(self.children.pop(current, {}).values())
+            self.names[current] = None
+            self.count -= 1
+
+    def child(self, parent, name):
+        """Id of parent's child called name, or None"""
+        siblings = self.children.get(parent)
+        return siblings.get(name) if siblings else None
+
+    def is_dir(self, node_id):
+        return self.kinds[node_id] == KIND_DIR
+
+    def is_error(self, node_id):
+        return self.kinds[node_id] == KIND_ERROR
+
+    def path(self, node_id):
+        """Full path of a node, rebuilt from its ancestors' names"""
+        parts = []
+        while node_id >= 0:
+            parts.append(self.names[node_id])
+            node_id = self.parents[node_id]
+        return os.path.join(*reversed(parts))
+
+    def find(self, path):
+        """Id of the node with this normalized path, or None"""
+        if self.root is None:
+            return None
+        root_path = self.names[self.root]
+        if path == root_path:
+            return self.root
+        prefix = root_path if root_path.endswith(os.sep) else root_path + os.sep
+        if not path.startswith(prefix):
+            return None
+        node_id = self.root
+        for name in path[len(prefix):].split(os.sep):
+            node_id = self.child(node_id, name)
+            if node_id is None:
+                return None
+        return node_id
+
+    def folders(self):
+        """Ids of the folders in the store, parents before their children"""
+        order = [self.root] if self.root is not None and self.is_dir(self.root) else []
+        for node_id in order:
+            order.extend(child for child in self.children.get(node_id, {}).values() if self.kinds[child] == KIND_DIR)
+        return order
@@ -1,20 +1,40 @@
 import os
-import json
 import datetime
 import copy
 import tkinter as tk
-from tkinter import messagebox, simpledialog, filedialog # Added filedialog just in case, though not used in this diff
-import threading # Not directly used in this diff, but present
-import time # Not directly used in this diff, but present
+from tkinter import messagebox, simpledialog
+import queue
+import threading
 
+import project_store
 from ui_dialogs import ProjectManagerDialog
 from utils import update_ui_status
 
 class ProjectManager:
+    """Projects and their persistence.
+
+    Each project is saved in its own file, with a small index of them in
+    preferences.json (see project_store). save_preferences() only marks that
+    something changed: the projects changed since the last write (and the
+    index, if it changed) are written SAVE_DELAY_MS later by a background
+    thread, each file replaced atomically.
+    """
+    SAVE_DELAY_MS = 1000
+    ERRORS_POLL_MS = 200 # How often the Tk thread checks for write errors while writes are pending
+
     def __init__(self, app):
         self.app = app
-        self.config_dir = os.path.join(os.path.expanduser("~"), ".filemerger")
-        self.config_file = os.path.join(self.config_dir, "preferences.json")
+        self.config_dir = project_store.CONFIG_DIR
+        self.config_file = project_store.PREFERENCES_FILE
+        self.index = {} # Project name -> project_store.index_entry as last written
+        self.dirty = set() # Projects changed since they were last written
+        self.removed_files = set() # Files of deleted/renamed projects, removed once the index no longer lists them
+        self.index_dirty = False
+        self._save_after = None
+        self._writes = queue.Queue() # Lists of write jobs for _write_loop
+        self._write_errors = queue.SimpleQueue() # Messages of failed writes, shown by the Tk thread
+        self._errors_polling = False
+        threading.Thread(target=self._write_loop, daemon=True).start()
         
         # Create config directory if it doesn't exist
         if not os.path.exists(self.config_dir):
@@ -24,17 +44,24 @@ class ProjectManager:
         """Load saved projects and preferences"""
         if os.path.exists(self.config_file):
             try:
-                with open(self.config_file, 'r') as f:
-                    data = json.load(f)
+                # Only the index is read here; project files are read when a project is first used
+                index, current_project, legacy_projects = project_store.load_index(self.config_file)
+                projects = project_store.LazyProjects(index, self.config_file, legacy_projects)
+                if legacy_projects is not None:
+                    # Old single-file preferences: the first save splits them into project files
+                    self.dirty.update(projects)
+                    self.index_dirty = True
+                else:
+                    self.index = index
                 
                 # Load projects
-                if "projects" in data:
-                    self.app.projects = data["projects"]
+                if projects:
+                    self.app.projects = projects
                 
                 # Load current project
-                if "current_project" in data and data["current_project"] in self.app.projects:
-                    self.app.current_project = data["current_project"]
-                    project_data = self.app.projects[self.app.current_project]
+                project_data = self.app.projects.get(current_project)
+                if project_data is not None:
+                    self.app.current_project = current_project
                     self._apply_project_settings(project_data)
                 else:
                     self._init_default_project()
@@ -50,28 +77,96 @@ class ProjectManager:
             self._init_default_project()
     
     def save_preferences(self):
-        """Save current project state TO DISK"""
+        """Save changed projects TO DISK, shortly (several calls in a row cause one write)"""
         # Note: _update_current_project_data should be called BEFORE this
         # if the goal is to save the latest UI state into the projects dictionary.
-        try:
-            data = {
-                "projects": self.app.projects,
-                "current_project": self.app.current_project,
-                "last_saved": datetime.datetime.now().isoformat()
-            }
-            
-            with open(self.config_file, 'w') as f:
-                json.dump(data, f, indent=2)
-            
-            # update_ui_status(self.app, "Preferences saved to disk") # Make it more specific if called explicitly
-            
-        except Exception as e:
-            messagebox.showerror("Error", f"Failed to save preferences: {str(e)}")
+        if self._save_after is not None:
+            self.app.root.after_cancel(self._save_after)
+        self._save_after = self.app.root.after(self.SAVE_DELAY_MS, self.flush_preferences)
+
+    def flush_preferences(self, wait=False):
+        """Hand the pending changes to the writer thread now; with wait, return once they are on disk"""
+        if self._save_after is not None:
+            self.app.root.after_cancel(self._save_after)
+            self._save_after = None
+        jobs = []
+        for name in self.dirty:
+            project_data = self.app.projects.get(name)
+            if project_data is None:
+                continue
+            entry = project_store.index_entry(name, project_data)
+            if self.index.get(name) != entry:
+                self.index[name] = entry
+                self.index_dirty = True
+            # A shallow copy is a stable snapshot: updates replace values instead of mutating them
+            jobs.append(("project", name, dict(project_data)))
+        if self.index_dirty:
+            jobs.append(("index", dict(self.index), self.app.current_project))
+        listed_files = {entry["file"] for entry in self.index.values()}
+        jobs.extend(("delete", file_name) for file_name in self.removed_files - listed_files)
+        self.dirty.clear()
+        self.removed_files.clear()
+        self.index_dirty = False
+        if jobs:
+            self._writes.put(jobs)
+        if wait:
+            self._writes.join()
+            self._show_write_errors()
+        elif jobs and not self._errors_polling:
+            self._errors_polling = True
+            self.app.root.after(self.ERRORS_POLL_MS, self._poll_write_errors)
+
+    def _poll_write_errors(self):
+        self._show_write_errors()
+        if self._writes.unfinished_tasks:
+            self.app.root.after(self.ERRORS_POLL_MS, self._poll_write_errors)
+        else:
+            self._errors_polling = False
+            self._show_write_errors() # Errors queued just before the last write finished
+
+    def _show_write_errors(self):
+        """Show the errors of failed writes (Tk thread only)"""
+        while True:
+            try:
+                error_msg = self._write_errors.get_nowait()
+            except queue.Empty:
+                return
+            messagebox.showerror("Error", error_msg)
+
+    def _write_loop(self):
+        """Writer thread: performs the jobs from flush_preferences in order. Never touches Tk"""
+        while True:
+            jobs = self._writes.get()
+            error = None
+            try:
+                for job in jobs:
+                    if job[0] == "project":
+                        project_store.save_project(job[1], job[2], self.config_file)
+                    elif job[0] == "index":
+                        project_store.save_index(job[1], job[2], self.config_file)
+                    else:
+                        project_store.delete_project_file(job[1], self.config_file)
+            except Exception as e:
+                error = e
+                # Queued before task_done, so flush_preferences(wait=True) finds it once join() returns
+                self._write_errors.put(f"Failed to save preferences: {str(e)}")
+            finally:
+                self._writes.task_done()
+            if error is not None:
+                print(f"Error saving preferences: {error}")
+
+    def _forget_project(self, project_name):
+        """Drop a deleted or renamed project from the index; its file is removed on the next write"""
+        entry = self.index.pop(project_name, None)
+        if entry is not None:
+            self.removed_files.add(entry["file"])
+            self.index_dirty = True
+        self.dirty.discard(project_name)
 
     def save_current_project_explicitly(self):
         """Explicitly save the current project's state."""
         self._update_current_project_data() # Ensure current UI state (selections, text fields) is in self.app.projects
-        self.save_preferences() # Write to disk
+        self.flush_preferences() # Write to disk
         update_ui_status(self.app, f"Project '{self.app.current_project}' saved.")
 
     def create_project(self, name=None):
@@ -95,11 +190,14 @@ class ProjectManager:
                 "root_dir": self.app.root_dir, # Current root_dir
                 "output_dir": self.app.output_dir, # Current output_dir
                 "ignored_file_types": copy.deepcopy(self.app.ignored_file_types), # Current ignored types
-                "selected_paths_relative": [], # New project starts with no selections
+                "respect_gitignore": self.app.respect_gitignore,
+                "merge_options": copy.deepcopy(self.app.merge_options),
+                "selection": project_store.encode_selection([]), # New project starts with no selections
                 "default_rules": self.app.default_rules_text.get("1.0", tk.END).strip(), # Current default rules
                 "project_rules": "", # New project specific rules are empty initially
                 "prompt": "" # New project prompt is empty initially
             }
+            self.dirty.add(name)
             
             self._switch_to_project(name) # This will also call save_preferences
             
@@ -121,9 +219,14 @@ class ProjectManager:
             self._update_current_project_data() 
             
             # Clone the current project (which is now up-to-date in self.app.projects)
-            self.app.projects[name] = copy.deepcopy(self.app.projects[current_project_name])
+            project_data = self.app.projects.get(current_project_name)
+            if project_data is None:
+                messagebox.showerror("Error", f"Could not load project '{current_project_name}'.")
+                return
+            self.app.projects[name] = copy.deepcopy(project_data)
             self.app.projects[name]["created"] = datetime.datetime.now().isoformat()
             self.app.projects[name]["modified"] = datetime.datetime.now().isoformat() # Mark modification for clone
+            self.dirty.add(name)
             
             self._switch_to_project(name) # This will also call save_preferences
             
@@ -171,40 +274,33 @@ class ProjectManager:
     def _switch_to_project(self, project_name):
         """Switch to a different project"""
         if project_name in self.app.projects:
+            project_data = self.app.projects.get(project_name) # Reads the project's file if not done yet
+            if project_data is None:
+                messagebox.showerror("Error", f"Could not load project '{project_name}'.")
+                return
             self._update_current_project_data()
             
             self.app.current_project = project_name
-            project_data = self.app.projects[project_name]
+            self.index_dirty = True
             self._apply_project_settings(project_data) 
             
             self.app.project_name_var.set(project_name)
             
             paths_that_were_pending_selection = self.app.pending_selected_paths.copy()
-            self.app.file_operations.build_tree(self.app.root_dir, self.app.pending_selected_paths)
+            self.app.file_operations.build_tree(self.app.root_dir, self.app.pending_selected_paths, self.app.pending_excluded_paths)
             self.app.pending_selected_paths = set() 
+            self.app.pending_excluded_paths = set()
 
             # After tree is built, open directories that were part of the saved selection
             for path_to_open in paths_that_were_pending_selection:
-                if self.app.tree.exists(path_to_open): # path_to_open is the item_id (path)
-                    if "folder" in self.app.tree.item(path_to_open, "tags"):
-                        self.app.tree.item(path_to_open, open=True)
+                item_id = self.app.file_operations.row_for(path_to_open)
+                if item_id is not None:
+                    if "folder" in self.app.tree.item(item_id, "tags"):
+                        self.app.tree.item(item_id, open=True)
                         # If opening a folder reveals a "Loading..." placeholder,
                         # we need to ensure its contents are actually loaded.
-                        # The <<TreeviewOpen>> event should ideally handle this.
-                        # Forcing it if needed:
-                        children = self.app.tree.get_children(path_to_open)
-                        if children and self.app.tree.exists(children[0]) and \
-                           self.app.tree.item(children[0], "text") == "Loading...":
-                            original_focus = self.app.tree.focus()
-                            self.app.tree.focus(path_to_open) 
-                            self.app.file_operations.on_tree_open(None) # event=None uses tree.focus()
-                            # Restore focus carefully
-                            if self.app.tree.exists(original_focus) and original_focus != path_to_open :
-                                self.app.tree.focus(original_focus)
-                            elif not self.app.tree.focus(): # if focus is empty (e.g. path_to_open was the only item)
-                                current_children = self.app.tree.get_children("")
-                                if current_children and self.app.tree.exists(current_children[0]):
-                                     self.app.tree.focus(current_children[0])
+                        # Load synchronously so nested saved folders find their parents populated.
+                        self.app.file_operations.load_children(item_id, background=False)
 
 
             self.save_preferences() 
@@ -219,10 +315,18 @@ class ProjectManager:
                 is_current_project = (project_name == self.app.current_project)
                 
                 del self.app.projects[project_name]
+                self._forget_project(project_name)
                 
                 if is_current_project:
-                    fallback_project_name = sorted(self.app.projects.keys())[0]
-                    self._switch_to_project(fallback_project_name) 
+                    # Projects that cannot be read drop out of self.app.projects when tried
+                    fallback_project_name = next((name for name in sorted(self.app.projects.keys())
+                                                  if self.app.projects.get(name) is not None), None)
+                    if fallback_project_name is None:
+                        messagebox.showerror("Error", "Could not load any other project.")
+                        self._init_default_project()
+                        self._switch_to_project("Default")
+                    else:
+                        self._switch_to_project(fallback_project_name) 
                 else:
                     self.save_preferences()
 
@@ -236,10 +340,16 @@ class ProjectManager:
             if self.app.current_project == old_name:
                 self._update_current_project_data()
 
-            self.app.projects[new_name] = copy.deepcopy(self.app.projects[old_name])
+            project_data = self.app.projects.get(old_name) # Reads the project's file if not done yet
+            if project_data is None:
+                messagebox.showerror("Error", f"Could not load project '{old_name}'.")
+                return
+            self.app.projects[new_name] = copy.deepcopy(project_data)
             self.app.projects[new_name]["modified"] = datetime.datetime.now().isoformat()
+            self.dirty.add(new_name)
             
             del self.app.projects[old_name]
+            self._forget_project(old_name)
             
             if self.app.current_project == old_name:
                 self.app.current_project = new_name
@@ -257,34 +367,34 @@ class ProjectManager:
             # as this is the frame of reference for current selections.
             # The project's stored root_dir will be updated to this app.root_dir.
             project_root_for_relpath = self.app.root_dir 
-            selected_absolute_paths = self.app.file_operations.get_selected_paths()
-            selected_relative_paths = []
-            for abs_path in selected_absolute_paths:
-                try:
-                    norm_root = os.path.normpath(project_root_for_relpath)
-                    norm_abs_path = os.path.normpath(abs_path)
-                    if os.path.commonpath([norm_root, norm_abs_path]) == norm_root:
-                         relative_path = os.path.relpath(norm_abs_path, norm_root)
-                         if relative_path == ".": 
-                             relative_path = "." 
-                         selected_relative_paths.append(relative_path)
-                except ValueError: 
-                    pass 
+            selection = project_store.encode_selection(
+                project_store.to_relative_paths(self.app.file_operations.get_selected_paths(), project_root_for_relpath),
+                project_store.to_relative_paths(self.app.file_operations.get_excluded_paths(), project_root_for_relpath)
+            )
 
             default_rules = self.app.default_rules_text.get("1.0", tk.END).strip()
             project_rules = self.app.project_rules_text.get("1.0", tk.END).strip()
             prompt = self.app.prompt_text.get("1.0", tk.END).strip()
 
-            self.app.projects[self.app.current_project].update({
-                "modified": datetime.datetime.now().isoformat(),
+            project_data = self.app.projects[self.app.current_project]
+            current_state = {
                 "root_dir": self.app.root_dir, 
                 "output_dir": self.app.output_dir, 
                 "ignored_file_types": copy.deepcopy(self.app.ignored_file_types), 
-                "selected_paths_relative": selected_relative_paths, 
+                "respect_gitignore": self.app.respect_gitignore,
+                "merge_options": copy.deepcopy(self.app.merge_options),
+                "selection": selection, 
                 "default_rules": default_rules,
                 "project_rules": project_rules,
                 "prompt": prompt
-            })
+            }
+            # Only a project that actually changed needs writing
+            if any(project_data.get(key) != value for key, value in current_state.items()):
+                project_data.update(current_state, modified=datetime.datetime.now().isoformat())
+                # Superseded by "selection" (see project_store.saved_selection)
+                project_data.pop("selected_paths_relative", None)
+                project_data.pop("excluded_paths_relative", None)
+                self.dirty.add(self.app.current_project)
     
     def _apply_project_settings(self, project_data):
         """Apply settings from loaded project_data TO THE UI and app state."""
@@ -304,30 +414,30 @@ class ProjectManager:
              except Exception as e: print(f"Critical: Cannot create any output directory: {e}")
         self.app.output_dir = output_dir_from_data
 
-        selected_absolute_paths = set()
         # Use self.app.root_dir as the base for resolving relative paths,
         # as it has just been set from project_data or defaulted.
         base_root_for_relpath = self.app.root_dir
-        if "selected_paths_relative" in project_data:
-            for rel_path in project_data["selected_paths_relative"]:
-                if rel_path == ".": 
-                    abs_path = os.path.normpath(base_root_for_relpath)
-                else:
-                    abs_path = os.path.normpath(os.path.join(base_root_for_relpath, rel_path))
-                selected_absolute_paths.add(abs_path)
+        try:
+            selected_absolute_paths, excluded_absolute_paths = project_store.saved_selection(project_data, base_root_for_relpath)
+        except Exception as e:
+            print(f"Warning: Could not read the saved selection: {e}")
+            selected_absolute_paths, excluded_absolute_paths = set(), set()
         
         self.app.pending_selected_paths = selected_absolute_paths 
+        self.app.pending_excluded_paths = excluded_absolute_paths
 
         if "ignored_file_types" in project_data:
-            self.app.ignored_file_types = copy.deepcopy(project_data["ignored_file_types"])
+            self.app.set_ignored_file_types(copy.deepcopy(project_data["ignored_file_types"]))
+
+        self.app.respect_gitignore = project_data.get("respect_gitignore", False)
+        self.app.respect_gitignore_var.set(self.app.respect_gitignore)
+        self.app.merge_options = project_store.merge_options(project_data)
 
         default_rules = project_data.get("default_rules", "") 
         self.app.default_rules_text.delete("1.0", tk.END)
         self.app.default_rules_text.insert("1.0", default_rules)
 
-        project_rules = project_data.get("project_rules") 
-        if project_rules is None: 
-            project_rules = default_rules 
+        project_rules = project_store.project_rules_text(project_data)
         self.app.project_rules_text.delete("1.0", tk.END)
         self.app.project_rules_text.insert("1.0", project_rules)
 
@@ -338,17 +448,23 @@ class ProjectManager:
     def _init_default_project(self):
         """Initialize default project if none exists"""
         self.app.current_project = "Default"
-        self.app.projects = {
-            "Default": {
+        # Other saved projects are kept (e.g. when only the current one could not be read)
+        project_data = self.app.projects.get("Default")
+        if project_data is None:
+            project_data = {
                 "created": datetime.datetime.now().isoformat(),
                 "modified": datetime.datetime.now().isoformat(),
                 "root_dir": self.app.root_dir,
                 "output_dir": self.app.output_dir,
                 "ignored_file_types": copy.deepcopy(self.app.ignored_file_types),
-                "selected_paths_relative": [], 
+                "respect_gitignore": False,
+                "merge_options": dict(project_store.DEFAULT_MERGE_OPTIONS),
+                "selection": project_store.encode_selection([]),
                 "default_rules": "",
                 "project_rules": "",
                 "prompt": ""
             }
-        }
-        self._apply_project_settings(self.app.projects["Default"])
\ No newline at end of file
+            self.app.projects["Default"] = project_data
+            self.dirty.add("Default")
+        self.index_dirty = True
+        self._apply_project_settings(project_data)
\ No newline at end of file
@@ -0,0 +1,300 @@
+import os
+import re
+import gzip
+import json
+import base64
+import hashlib
+import datetime
+from collections.abc import MutableMapping
+
+from ignore_rules import DEFAULT_IGNORED_FILE_TYPES, IgnoreMatcher
+
+CONFIG_DIR = os.path.join(os.path.expanduser("~"), ".filemerger")
+PREFERENCES_FILE = os.path.join(CONFIG_DIR, "preferences.json")
+PREFERENCES_VERSION = 2 # 1 (no "version" key): every project's data inline in preferences.json
+SELECTION_GZIP_THRESHOLD = 4096 # Encoded selections longer than this (in characters) are gzip'd
+_SELECTION_LINE = re.compile(r"(\d+)([+-])")
+
+# Per-project merge settings, stored under "merge_options" (token_budget 0 = unlimited)
+DEFAULT_MERGE_OPTIONS = {
+    "token_budget": 0,
+    "budget_priority": "selection", # A key of merge_engine.BUDGET_PRIORITIES
+    "budget_overflow": "truncate", # "truncate" or "skip" files that do not fit
+    "binary_files": "stub", # "stub" (one-line note in the export) or "skip" binary files
+    "max_file_bytes": 0, # Per-file caps (0 = none); larger files keep only their head and tail
+    "max_file_lines": 0,
+    "max_file_tokens": 0,
+    "deduplicate": True, # Write files with identical content once and reference them afterwards
+    "export_mode": "full", # "full" or "changes" (only files changed since the last full export)
+    "reuse_unchanged": True, # Copy blocks of unchanged files from the previous export instead of re-reading them
+}
+
+
+def projects_dir(config_file=PREFERENCES_FILE):
+    """Folder with one JSON file per project, next to preferences.json"""
+    return os.path.join(os.path.dirname(config_file), "projects")
+
+
+def project_file_name(name):
+    """File a project is saved in: its name made filesystem-safe, plus a hash so names never collide"""
+    safe_name = re.sub(r"[^\w.-]", "_", name)[:40]
+    return f"{safe_name}-{hashlib.sha1(name.encode('utf-8')).hexdigest()[:8]}.json"
+
+
+def index_entry(name, project_data):
+    """What preferences.json keeps about a project: its file and root folder"""
+    return {"file": project_file_name(name), "root_dir": project_data.get("root_dir", "")}
+
+
+def write_atomic(path, text):
+    """Replace path with text in one step, so a crash leaves the old or the new file, never a partial one"""
+    temp_path = path + ".tmp"
+    with open(temp_path, "w", encoding="utf-8") as f:
+        f.write(text)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(temp_path, path)
+
+
+def load_index(config_file=PREFERENCES_FILE):
+    """Read preferences.json. Returns (index, current_project, legacy_projects).
+
+    index maps project names to index_entry()s. Files written before projects
+    had their own files hold every project's data instead: then that is
+    returned as legacy_projects (and index is built from it), else it is None.
+    ({}, None, None) if there is no file.
+    """
+    if not os.path.exists(config_file):
+        return {}, None, None
+    with open(config_file, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    projects = data.get("projects", {})
+    if data.get("version", 1) < PREFERENCES_VERSION:
+        return {name: index_entry(name, project) for name, project in projects.items()}, data.get("current_project"), projects
+    return projects, data.get("current_project"), None
+
+
+def load_project(entry, config_file=PREFERENCES_FILE):
+    """Read the data of the project an index entry points to"""
+    with open(os.path.join(projects_dir(config_file), entry["file"]), "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+class LazyProjects(MutableMapping):
+    """Project name -> project data, reading each project's file the first time it is used.
+
+    Listing, counting and testing names only needs the index, so opening the
+    app (or listing projects) reads preferences.json and the projects
+    actually used rather than every saved project. A project whose file
+    cannot be read is dropped with a warning, as if it did not exist.
+    """
+
+    def __init__(self, index, config_file=PREFERENCES_FILE, loaded=None):
+        self._entries = dict(index) # Name -> index_entry; None for projects not saved yet
+        self._data = dict(loaded or {}) # Name -> data of the projects read (or set) so far
+        self._config_file = config_file
+
+    def __getitem__(self, name):
+        if name not in self._data:
+            entry = self._entries.get(name)
+            if entry is None:
+                raise KeyError(name)
+            try:
+                self._data[name] = load_project(entry, self._config_file)
+            except (OSError, ValueError) as e:
+                print(f"Warning: Could not load project '{name}': {e}")
+                del self._entries[name]
+                raise KeyError(name)
+        return self._data[name]
+
+    def __setitem__(self, name, project_data):
+        self._entries.setdefault(name, None)
+        self._data[name] = project_data
+
+    def __delitem__(self, name):
+        del self._entries[name]
+        self._data.pop(name, None)
+
+    def __contains__(self, name):
+        return name in self._entries
+
+    def __iter__(self):
+        return iter(self._entries)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+def load_preferences(config_file=PREFERENCES_FILE):
+    """Read the saved projects. Returns (projects, current_project); ({}, None) if there is no file.
+
+    projects is a LazyProjects: only preferences.json is read here.
+    """
+    index, current_project, legacy_projects = load_index(config_file)
+    return LazyProjects(index, config_file, legacy_projects), current_project
+
+
+def save_project(name, project_data, config_file=PREFERENCES_FILE):
+    """Write one project's file (see index_entry)"""
+    os.makedirs(projects_dir(config_file), exist_ok=True)
+    write_atomic(os.path.join(projects_dir(config_file), project_file_name(name)), json.dumps(project_data, indent=2))
+
+
+def save_index(index, current_project, config_file=PREFERENCES_FILE):
+    """Write preferences.json: the project index and the current project name"""
+    write_atomic(config_file, json.dumps({
+        "version": PREFERENCES_VERSION,
+        "projects": index,
+        "current_project": current_project,
+        "last_saved": datetime.datetime.now().isoformat()
+    }, indent=2))
+
+
+def delete_project_file(file_name, config_file=PREFERENCES_FILE):
+    """Remove a project's file (see index_entry), if it exists"""
+    try:
+        os.remove(os.path.join(projects_dir(config_file), file_name))
+    except FileNotFoundError:
+        pass
+
+
+def save_preferences(projects, current_project, config_file=PREFERENCES_FILE):
+    """Write all projects and the index"""
+    for name, project_data in projects.items():
+        save_project(name, project_data, config_file)
+    save_index({name: index_entry(name, project_data) for name, project_data in projects.items()}, current_project, config_file)
+
+
+def to_relative_paths(absolute_paths, project_root):
+    """Convert absolute paths under project_root to relative ones ("." for the root itself)"""
+    relative_paths = []
+    norm_root = os.path.normpath(project_root)
+    root_key = os.path.normcase(norm_root)
+    prefix = os.path.join(norm_root, "")
+    prefix_key = os.path.normcase(prefix)
+    # A prefix test per path instead of commonpath/relpath, which cost more than the rest of a save
+    for abs_path in absolute_paths:
+        norm_abs_path = os.path.normpath(abs_path)
+        path_key = os.path.normcase(norm_abs_path)
+        if path_key == root_key:
+            relative_paths.append(".")
+        elif path_key.startswith(prefix_key):
+            relative_paths.append(norm_abs_path[len(prefix):])
+    return relative_paths
+
+
+def to_absolute_paths(relative_paths, project_root):
+    """Resolve relative paths saved by to_relative_paths against project_root"""
+    absolute_paths = set()
+    for rel_path in relative_paths:
+        if rel_path == ".":
+            absolute_paths.add(os.path.normpath(project_root))
+        else:
+            absolute_paths.add(os.path.normpath(os.path.join(project_root, rel_path)))
+    return absolute_paths
+
+
+def encode_selection(included, excluded=()):
+    """Pack relative include/exclude rule paths (see to_relative_paths) into the form saved with a project.
+
+    The paths are sorted and front-coded: each line holds the length of the
+    prefix shared with the previous path, "+" (include) or "-" (exclude) and
+    the rest of the path, so the folders that many selected files have in
+    common are written once. Long results are also gzip'd (base64 in JSON).
+    """
+    rules = {path.replace(os.sep, "/"): "-" for path in excluded}
+    rules.update((path.replace(os.sep, "/"), "+") for path in included)
+    lines = []
+    previous = ""
+    for path in sorted(rules):
+        # Sharing the folder is enough for most paths and much cheaper than commonprefix; gzip finds the rest
+        folder = path[:path.rfind("/") + 1]
+        shared = len(folder) if folder and previous.startswith(folder) else len(os.path.commonprefix([previous, path]))
+        lines.append(f"{shared}{rules[path]}{path[shared:]}")
+        previous = path
+    text = "\n".join(lines)
+    if len(text) <= SELECTION_GZIP_THRESHOLD:
+        return {"format": "front-coded", "rules": text}
+    # mtime=0 keeps the output identical for an identical selection
+    packed = base64.b64encode(gzip.compress(text.encode("utf-8"), compresslevel=6, mtime=0)).decode("ascii")
+    return {"format": "front-coded+gzip", "rules": packed}
+
+
+def decode_selection(encoded):
+    """Unpack encode_selection's result into (included, excluded) relative paths"""
+    text = encoded.get("rules", "")
+    selection_format = encoded.get("format")
+    if selection_format == "front-coded+gzip":
+        text = gzip.decompress(base64.b64decode(text)).decode("utf-8")
+    elif selection_format != "front-coded":
+        raise ValueError(f"Unknown selection format: {selection_format}")
+    included, excluded = [], []
+    previous = ""
+    for line in text.split("\n") if text else ():
+        match = _SELECTION_LINE.match(line)
+        if match is None:
+            raise ValueError(f"Malformed selection rule: {line!r}")
+        path = previous[:int(match.group(1))] + line[match.end():]
+        (included if match.group(2) == "+" else excluded).append(path)
+        previous = path
+    return included, excluded
+
+
+def legacy_selection(selected_paths, is_ignored=None):
+    """Include rules for a selection saved as a flat list of every checked item (absolute paths).
+
+    Such lists name each checked file and folder the tree showed, and never
+    what was unchecked. So a listed folder only becomes a recursive include
+    if every entry below it (that the tree shows, see is_ignored) is listed
+    too; otherwise only its listed files are included, and its listed
+    subfolders are judged the same way.
+    """
+    listed = set(selected_paths)
+    complete = {}
+
+    def is_complete(folder):
+        if folder not in complete:
+            complete[folder] = False # Guards against symlink loops
+            try:
+                names = os.listdir(folder)
+            except OSError:
+                names = []
+            complete[folder] = all(
+                (is_ignored is not None and is_ignored(name))
+                or (path in listed and (not os.path.isdir(path) or is_complete(path)))
+                for name, path in ((name, os.path.join(folder, name)) for name in names)
+            )
+        return complete[folder]
+
+    return {path for path in listed if not os.path.isdir(path) or is_complete(path)}
+
+
+def saved_selection(project_data, project_root):
+    """The (included, excluded) rule paths saved with a project, made absolute against project_root"""
+    if "selection" in project_data:
+        included, excluded = decode_selection(project_data["selection"])
+    elif "excluded_paths_relative" in project_data:
+        # Rules saved before selections were encoded
+        included = project_data.get("selected_paths_relative", [])
+        excluded = project_data["excluded_paths_relative"]
+    else:
+        # Saved before selections were rules: a list of every checked item
+        matcher = IgnoreMatcher(project_data.get("ignored_file_types", DEFAULT_IGNORED_FILE_TYPES))
+        selected = to_absolute_paths(project_data.get("selected_paths_relative", []), project_root)
+        return legacy_selection(selected, matcher.is_ignored), set()
+    return to_absolute_paths(included, project_root), to_absolute_paths(excluded, project_root)
+
+
+def project_rules_text(project_data):
+    """Rules exported with a project; projects without their own rules use the default rules"""
+    project_rules = project_data.get("project_rules")
+    if project_rules is None:
+        project_rules = project_data.get("default_rules", "")
+    return project_rules
+
+
+def merge_options(project_data):
+    """Merge options of a project, with defaults for settings it does not have"""
+    options = dict(DEFAULT_MERGE_OPTIONS)
+    options.update(project_data.get("merge_options", {}))
+    return options
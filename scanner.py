@@ -0,0 +1,207 @@
+import os
+import stat
+import time
+import queue
+import threading
+from collections import namedtuple
+
+# One row of a directory listing. `error` holds a short reason ("Access Denied")
+# when the entry could be listed but not stat'ed; size/mtime are then None.
+# `is_binary` is only set for files when scan_directory is given an is_binary check;
+# None means the check could not tell yet (see MetadataCache.cached_is_binary).
+ScanEntry = namedtuple("ScanEntry", ["name", "path", "is_dir", "size", "mtime", "error", "is_binary"], defaults=(False,))
+
+
+def scan_directory(path, is_ignored=None, gitignore=None, is_binary=None):
+    """List a directory in a single os.scandir pass, folders first then by name.
+
+    Reuses the DirEntry type/stat data instead of calling os.path.isdir/os.stat
+    per entry. `is_ignored(name)` and `gitignore` (a gitignore.GitIgnoreRules)
+    filter entries before they are stat'ed, so excluded folders cost nothing.
+    `is_binary(path, stats)` classifies files (e.g. MetadataCache.is_binary, or
+    cached_is_binary on the Tk thread, which never reads the file).
+    Listing errors (PermissionError, FileNotFoundError, ...) propagate to the caller.
+    """
+    entries = []
+    with os.scandir(path) as it:
+        for entry in it:
+            name = entry.name
+            if is_ignored is not None and is_ignored(name):
+                continue
+            full_path = os.path.normpath(entry.path)
+            try:
+                is_dir = entry.is_dir()
+                if gitignore is not None and gitignore.is_ignored(full_path, is_dir):
+                    continue
+                stats = entry.stat()
+                binary = is_binary(full_path, stats) if is_binary is not None and not is_dir else False
+                entries.append(ScanEntry(name, full_path, is_dir, stats.st_size, stats.st_mtime, None, binary))
+            except PermissionError:
+                entries.append(ScanEntry(name, full_path, False, None, None, "Access Denied"))
+            except FileNotFoundError:
+                entries.append(ScanEntry(name, full_path, False, None, None, "Not Found"))
+            except OSError as e:
+                print(f"Warning: Could not process item {full_path}: {e}")
+                entries.append(ScanEntry(name, full_path, False, None, None, f"Error: {type(e).__name__}"))
+
+    entries.sort(key=lambda e: (not e.is_dir, e.name.lower()))
+    return entries
+
+
+def scan_entry(path, is_ignored=None, gitignore=None, is_binary=None):
+    """The ScanEntry scan_directory would list for a single path; None if it is gone or filtered out"""
+    name = os.path.basename(path)
+    if is_ignored is not None and is_ignored(name):
+        return None
+    try:
+        stats = os.stat(path)
+    except FileNotFoundError:
+        # A dangling symlink is still listed by scan_directory
+        return ScanEntry(name, path, False, None, None, "Not Found") if os.path.lexists(path) else None
+    except PermissionError:
+        return ScanEntry(name, path, False, None, None, "Access Denied")
+    except OSError as e:
+        return ScanEntry(name, path, False, None, None, f"Error: {type(e).__name__}")
+    is_dir = stat.S_ISDIR(stats.st_mode)
+    if gitignore is not None and gitignore.is_ignored(path, is_dir):
+        return None
+    binary = is_binary(path, stats) if is_binary is not None and not is_dir else False
+    return ScanEntry(name, path, is_dir, stats.st_size, stats.st_mtime, None, binary)
+
+
+class DirectoryScanner:
+    """Runs directory listings on worker threads and streams the rows back to Tk.
+
+    Workers never touch Tk. They push batches onto a queue which the main thread
+    drains from a root.after() poll loop, so callbacks always run on the Tk thread.
+    Each poll runs callbacks for at most SLICE_SECONDS before yielding to the
+    event loop, so big folders fill in progressively while the UI stays responsive.
+    """
+    BATCH_SIZE = 200
+    POLL_MS = 15
+    SLICE_SECONDS = 0.02
+
+    def __init__(self, root):
+        self.root = root
+        self.generation = 0 # Bumped by cancel_all(); results from older generations are dropped
+        self._results = queue.Queue()
+        self._active = 0
+        self._polling = False
+
+    def cancel_all(self):
+        """Discard results of every scan that is still running."""
+        self.generation += 1
+
+    def scan_async(self, path, on_batch, on_done=None, on_error=None, on_listed=None, **scan_options):
+        """Scan `path` in the background. Must be called from the Tk thread.
+
+        `on_listed(total)` is called with the number of entries before the first batch.
+        scan_options are passed through to scan_directory (is_ignored, gitignore, is_binary).
+        """
+        self._active += 1
+        worker = threading.Thread(
+            target=self._worker,
+            args=(path, self.generation, on_batch, on_done, on_error, on_listed, scan_options),
+            daemon=True
+        )
+        worker.start()
+        self._start_polling()
+
+    def run_async(self, job, on_done, *args):
+        """Run job(*args) on a worker thread, then on_done(result) on the Tk thread. Must be called from the Tk thread"""
+        self._active += 1
+        threading.Thread(target=self._job_worker, args=(job, args, on_done, self.generation), daemon=True).start()
+        self._start_polling()
+
+    def _start_polling(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.POLL_MS, self._poll)
+
+    def _job_worker(self, job, args, on_done, generation):
+        try:
+            self._results.put((generation, on_done, (job(*args),), True))
+        except Exception as e:
+            print(f"Warning: Background job failed: {e}")
+            self._results.put((generation, None, (), True))
+
+    def _worker(self, path, generation, on_batch, on_done, on_error, on_listed, scan_options):
+        try:
+            entries = scan_directory(path, **scan_options)
+        except Exception as e:
+            self._results.put((generation, on_error, (e,), True))
+            return
+        self._results.put((generation, on_listed, (len(entries),), False))
+        for start in range(0, len(entries), self.BATCH_SIZE):
+            self._results.put((generation, on_batch, (entries[start:start + self.BATCH_SIZE],), False))
+        self._results.put((generation, on_done, (), True))
+
+    def _poll(self):
+        deadline = time.monotonic() + self.SLICE_SECONDS
+        while time.monotonic() < deadline:
+            try:
+                generation, callback, args, finished = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if finished:
+                self._active -= 1
+            if callback is not None and generation == self.generation:
+                try:
+                    callback(*args)
+                except Exception as e:
+                    print(f"Error applying scan results: {e}")
+
+        if not self._results.empty():
+            self.root.after(1, self._poll) # Out of time with results waiting: continue after pending events
+        elif self._active > 0:
+            self.root.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+
+
+def walk_files(folder, skip=(), is_ignored=None, gitignore=None):
+    """Yield the files below folder without stat'ing them, sorted by name within each folder.
+
+    Paths in `skip` (files or whole folders) are left out, as are entries filtered by
+    is_ignored/gitignore (see scan_directory). Symlinked folders are followed, as the
+    tree expands them; each folder is walked once, by (st_dev, st_ino), so links back
+    up the tree cannot loop. Unreadable folders are skipped silently.
+    """
+    stack = [os.path.normpath(folder)]
+    visited = set()
+    while stack:
+        current = stack.pop()
+        try:
+            st = os.stat(current)
+            if (st.st_dev, st.st_ino) in visited:
+                continue
+            visited.add((st.st_dev, st.st_ino))
+            with os.scandir(current) as it:
+                entries = list(it)
+        except OSError:
+            continue
+
+        files = []
+        folders = []
+        for entry in entries:
+            name = entry.name
+            if is_ignored is not None and is_ignored(name):
+                continue
+            path = os.path.join(current, name)
+            if path in skip:
+                continue
+            try:
+                is_dir = entry.is_dir()
+                if gitignore is not None and gitignore.is_ignored(path, is_dir):
+                    continue
+                if is_dir:
+                    folders.append(path)
+                else:
+                    files.append(path)
+            except OSError:
+                continue
+
+        files.sort(key=lambda p: os.path.basename(p).lower())
+        yield from files
+        folders.sort(key=lambda p: os.path.basename(p).lower(), reverse=True)
+        stack.extend(folders)
@@ -0,0 +1,154 @@
+import os
+
+
+def _ancestors(path):
+    """Yield the folders above path, nearest first"""
+    parent = os.path.dirname(path)
+    while parent and parent != path:
+        yield parent
+        path, parent = parent, os.path.dirname(parent)
+
+
+def _depth(path):
+    return path.rstrip(os.sep).count(os.sep)
+
+
+class SelectionModel:
+    """Python-side record of what is checked, kept in sync by update_item_selection.
+
+    The selection is stored as rules rather than as one entry per row: a rule on
+    a path selects (include) or deselects (exclude) that path and everything
+    below it, and the nearest rule above a path decides its state. Checking a
+    folder is therefore a single rule, whether or not its contents were ever
+    loaded, and files are only enumerated when a merge or the statistics ask
+    for them (iter_selected_files). Redundant rules are never stored.
+
+    Per-folder counters of include/exclude rules below each folder make the
+    tristate (all/partial/none) check O(1).
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.rules = {} # path -> (include, is_dir); is_dir is None while unknown
+        self.include_below = {} # folder -> number of include rules below it
+        self.exclude_below = {} # folder -> number of exclude rules below it
+
+    def copy(self):
+        """Return an independent copy, e.g. to enumerate files on another thread"""
+        other = SelectionModel()
+        other.rules = dict(self.rules)
+        other.include_below = dict(self.include_below)
+        other.exclude_below = dict(self.exclude_below)
+        return other
+
+    def __len__(self):
+        return len(self.rules)
+
+    def _count(self, path, include, delta):
+        counters = self.include_below if include else self.exclude_below
+        for folder in _ancestors(path):
+            count = counters.get(folder, 0) + delta
+            if count > 0:
+                counters[folder] = count
+            else:
+                counters.pop(folder, None)
+
+    def _set_rule(self, path, include, is_dir):
+        old = self.rules.get(path)
+        if old is not None:
+            if old[0] == include:
+                if is_dir is not None:
+                    self.rules[path] = (include, is_dir)
+                return
+            self._count(path, old[0], -1)
+        self.rules[path] = (include, is_dir if is_dir is not None else (old[1] if old else None))
+        self._count(path, include, 1)
+
+    def _drop_rule(self, path):
+        old = self.rules.pop(path, None)
+        if old is not None:
+            self._count(path, old[0], -1)
+
+    def _inherited(self, path):
+        """State path would have from the rules above it"""
+        for folder in _ancestors(path):
+            rule = self.rules.get(folder)
+            if rule is not None:
+                return rule[0]
+        return False
+
+    def is_selected(self, path):
+        rule = self.rules.get(path)
+        if rule is not None:
+            return rule[0]
+        return self._inherited(path)
+
+    def rules_below(self, folder):
+        """Return the paths with a rule strictly below folder"""
+        if folder not in self.include_below and folder not in self.exclude_below:
+            return []
+        prefix = folder.rstrip(os.sep) + os.sep
+        return [path for path in self.rules if path.startswith(prefix)]
+
+    def _apply(self, path, include, is_dir):
+        for below in self.rules_below(path):
+            self._drop_rule(below)
+        if self._inherited(path) == include:
+            self._drop_rule(path)
+        else:
+            self._set_rule(path, include, is_dir)
+
+    def select(self, path, is_dir=None):
+        """Select path and everything below it"""
+        self._apply(path, True, is_dir)
+
+    def deselect(self, path, is_dir=None):
+        """Deselect path and everything below it"""
+        self._apply(path, False, is_dir)
+
+    def load(self, included, excluded=()):
+        """Replace the selection with include/exclude rules (e.g. from a saved project)"""
+        self.clear()
+        excluded = set(excluded) - set(included)
+        ordered = [(path, True) for path in included] + [(path, False) for path in excluded]
+        # Shallow rules first, so deeper ones refine them instead of being wiped
+        ordered.sort(key=lambda item: _depth(item[0]))
+        for path, include in ordered:
+            self._apply(path, include, None)
+
+    def has_selected_descendants(self, folder):
+        return folder in self.include_below
+
+    def folder_state(self, folder):
+        """Return "all", "partial" or "none" for the checkbox of a folder"""
+        if self.is_selected(folder):
+            return "partial" if folder in self.exclude_below else "all"
+        return "partial" if folder in self.include_below else "none"
+
+    def included_paths(self):
+        return [path for path, (include, _) in self.rules.items() if include]
+
+    def excluded_paths(self):
+        return [path for path, (include, _) in self.rules.items() if not include]
+
+    def iter_selected_files(self, walk_files):
+        """Yield every selected file once, enumerating folder rules with walk_files(folder, skip)
+
+        walk_files must not descend into, or yield, paths in `skip`; files and
+        folders with their own rule are handled by that rule instead.
+        """
+        for path in sorted(self.included_paths()):
+            is_dir = self.rules[path][1]
+            try:
+                if is_dir is None:
+                    is_dir = os.path.isdir(path)
+                if not is_dir:
+                    if os.path.isfile(path):
+                        yield path
+                    continue
+            except OSError:
+                continue
+            for file_path in walk_files(path, self.rules):
+                yield file_path
@@ -0,0 +1,131 @@
+import os
+import queue
+from concurrent.futures import ThreadPoolExecutor
+
+
+class StatsAggregator:
+    """Running totals for the current selection, updated by per-item deltas.
+
+    Selecting or deselecting an item costs O(1) on the Tk thread (O(counted
+    files) to drop a folder). The files of a selected folder are enumerated by
+    a background walk and their sizes, character and token counts are computed
+    (through the metadata cache) on a small thread pool, then folded into the
+    totals from a root.after() poll loop; `computing` is True meanwhile.
+    """
+    POLL_MS = 50
+    BATCH_SIZE = 200
+
+    def __init__(self, root, metadata_cache, selection, walk_files, on_change=None, max_workers=4):
+        self.root = root
+        self.metadata_cache = metadata_cache
+        self.selection = selection # SelectionModel deciding whether a late result still counts
+        self.walk_files = walk_files # walk_files(folder, skip) -> files below folder
+        self.on_change = on_change # Called on the Tk thread whenever background results change the totals
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="stats")
+        self._results = queue.Queue()
+        self._jobs = 0
+        self._polling = False
+        self.reset()
+
+    def reset(self):
+        """Forget the whole selection (e.g. when the tree is rebuilt)"""
+        self.counted = {} # file path -> (size, chars, tokens) included in the totals
+        self.total_size = 0
+        self.total_chars = 0
+        self.total_tokens = 0
+        self.binary_files = set() # Selected binary files, left out of the totals like they are left out of merges
+
+    @property
+    def computing(self):
+        return self._jobs > 0
+
+    def add(self, path):
+        """Record that a file or folder was selected; its files are counted in the background"""
+        if path in self.counted or path in self.binary_files:
+            return
+        # Excluded subtrees are skipped by the walk; other late changes are filtered in _poll
+        skip = frozenset(self.selection.excluded_paths())
+        self._submit(self._collect, path, skip)
+
+    def add_files(self, paths):
+        """add() for many files at once (e.g. filter matches), counted by a single background job"""
+        paths = [path for path in paths if path not in self.counted and path not in self.binary_files]
+        if paths:
+            self._submit(self._count_files, paths)
+
+    def _submit(self, job, *args):
+        self._jobs += 1
+        self._executor.submit(job, *args)
+        if not self._polling:
+            self._polling = True
+            self.root.after(self.POLL_MS, self._poll)
+
+    def remove(self, path):
+        """Record that a file or folder was deselected"""
+        self.binary_files.discard(path)
+        counted = self.counted.pop(path, None)
+        if counted is not None:
+            self.total_size -= counted[0]
+            self.total_chars -= counted[1]
+            self.total_tokens -= counted[2]
+            return
+        prefix = path.rstrip(os.sep) + os.sep
+        self.binary_files.difference_update([p for p in self.binary_files if p.startswith(prefix)])
+        for file_path in [p for p in self.counted if p.startswith(prefix)]:
+            size, chars, tokens = self.counted.pop(file_path)
+            self.total_size -= size
+            self.total_chars -= chars
+            self.total_tokens -= tokens
+
+    def _collect(self, path, skip):
+        self._count_files(self.walk_files(path, skip) if os.path.isdir(path) else [path])
+
+    def _count_files(self, files):
+        """Analyze files and queue the results for _poll in batches"""
+        batch = []
+        try:
+            for file_path in files:
+                try:
+                    record = self.metadata_cache.analyze(file_path)
+                except Exception: # Missing or unreadable file counts as nothing
+                    continue
+                counted = None if record["is_binary"] else (record["size"], record["chars"], record["tokens"])
+                batch.append((file_path, counted))
+                if len(batch) >= self.BATCH_SIZE:
+                    self._results.put((batch, False))
+                    batch = []
+        finally:
+            self._results.put((batch, True))
+
+    def _poll(self):
+        changed = False
+        while True:
+            try:
+                batch, finished = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if finished:
+                self._jobs -= 1
+            for path, counted in batch:
+                # Drop results for files deselected while they were being computed
+                if path in self.counted or path in self.binary_files or not self.selection.is_selected(path):
+                    continue
+                if counted is None:
+                    self.binary_files.add(path)
+                else:
+                    self.counted[path] = counted
+                    self.total_size += counted[0]
+                    self.total_chars += counted[1]
+                    self.total_tokens += counted[2]
+            changed = True
+
+        if self._jobs > 0:
+            self.root.after(self.POLL_MS, self._poll)
+        else:
+            self._polling = False
+            self.metadata_cache.flush()
+        if changed and self.on_change is not None:
+            self.on_change()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,39 @@
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import merge_engine
+from metadata_cache import analyze_file
+from token_estimator import estimate_tokens
+
+
+class TokenBudgetWithFileLimitsTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.folder.name, "big.py")
+        with open(self.path, "w") as f:
+            f.writelines(f"value_{i} = compute_something(alpha, beta, gamma) + {i}\n" for i in range(20000))
+        self.record = dict(analyze_file(self.path), mtime=0)
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_budget_and_line_limit_stay_within_budget(self):
+        options = {"token_budget": 5000, "max_file_lines": 1000}
+        files, max_lines, _ = merge_engine.apply_token_budget([self.path], options, lambda path: self.record)
+        self.assertEqual(files, [self.path])
+        self.assertLess(max_lines[self.path], 1000)
+
+        block = merge_engine.format_file_block(self.path, self.record, max_lines[self.path], options)
+        self.assertLessEqual(estimate_tokens(block), 5000)
+        # Head and tail of the file, as the line limit alone would keep
+        self.assertIn("value_0 =", block)
+        self.assertIn("value_19999 =", block)
+        self.assertIn("and the token budget]", block)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,55 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import project_store
+from selection_model import SelectionModel
+
+
+class LegacySelectionTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.root = self.folder.name
+        for rel_path in ("src/a.py", "src/b.py", "src/lib/c.py", "docs/d.md"):
+            path = os.path.join(self.root, rel_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, "w") as f:
+                f.write("x\n")
+        self.config = tempfile.TemporaryDirectory()
+        self.config_file = os.path.join(self.config.name, "preferences.json")
+
+    def tearDown(self):
+        self.folder.cleanup()
+        self.config.cleanup()
+
+    def load_legacy(self, checked):
+        """Save a preferences file in the original format and load its project's selection"""
+        with open(self.config_file, "w") as f:
+            json.dump({"current_project": "Old", "projects": {"Old": {
+                "root_dir": self.root, "selected_paths_relative": checked,
+            }}}, f)
+        projects, current = project_store.load_preferences(self.config_file)
+        selection = SelectionModel()
+        selection.load(*project_store.saved_selection(projects[current], self.root))
+        return selection
+
+    def test_partly_checked_folder_keeps_unchecked_files_out(self):
+        # b.py was unchecked, so src and the root were saved as checked but not all of their contents
+        selection = self.load_legacy([".", "src", "src/a.py", "src/lib", "src/lib/c.py", "docs", "docs/d.md"])
+        path = lambda rel_path: os.path.join(self.root, rel_path)
+        self.assertTrue(selection.is_selected(path("src/a.py")))
+        self.assertFalse(selection.is_selected(path("src/b.py")))
+        self.assertTrue(selection.is_selected(path("src/lib/c.py")))
+        self.assertTrue(selection.is_selected(path("docs/d.md")))
+        # Fully checked folders become recursive rules, so new files in them are selected too
+        self.assertIn(path("docs"), selection.included_paths())
+        self.assertNotIn(path("src"), selection.included_paths())
+        self.assertNotIn(os.path.normpath(self.root), selection.included_paths())
+
+
+if __name__ == "__main__":
+    unittest.main()
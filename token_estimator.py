@@ -0,0 +1,31 @@
+import re
+
+# Pieces that BPE tokenizers used by current LLMs (e.g. cl100k) mostly encode as one
+# token each: short letter runs (longer words split every ~6 letters), up to 3
+# digits, a newline, a run of indentation, a run of up to 16 repeated symbols
+# ("-----"), or a single symbol/non-ASCII character. Single spaces are absorbed into
+# the following word and not counted. This is an estimate for budgeting, not an
+# exact count for any particular model.
+_TOKEN_PIECE = re.compile(r"[A-Za-z]{1,6}|\d{1,3}|\n|[ \t]{2,}|([^\sA-Za-z\d])\1{1,15}|[^\sA-Za-z\d]")
+
+# Tokens added per line by the "    1 " line-number prefix of the merged output
+LINE_NUMBER_TOKENS = 2
+
+
+def estimate_tokens(text):
+    """Estimate the number of LLM tokens in text without a tokenizer"""
+    return len(_TOKEN_PIECE.findall(text))
+
+
+def estimate_export_tokens(tokens, lines):
+    """Estimated tokens of a file's content once line-numbered in the merged output"""
+    return tokens + lines * LINE_NUMBER_TOKENS
+
+
+def format_tokens(tokens):
+    """Format a token count compactly, e.g. "~12.3K" """
+    if tokens < 1000:
+        return f"~{tokens}"
+    if tokens < 1000 * 1000:
+        return f"~{tokens/1000:.1f}K"
+    return f"~{tokens/(1000*1000):.2f}M"
@@ -1,10 +1,8 @@
-import os
 import tkinter as tk
-from tkinter import ttk, simpledialog, messagebox, filedialog
-import time
-import threading
-import shutil
-import tempfile
+from tkinter import ttk, messagebox
+import queue
+
+from utils import format_size
 
 class ProjectManagerDialog(tk.Toplevel):
     def __init__(self, parent, projects, current_project):
@@ -135,7 +133,7 @@ class FileTypeDialog(tk.Toplevel):
     
     def create_widgets(self):
         # Instructions
-        ttk.Label(self, text="File types that will be ignored during directory scanning:").pack(padx=10, pady=10, anchor=tk.W)
+        ttk.Label(self, text="File types that will be ignored during directory scanning\n(globs such as *.log or build* are supported):").pack(padx=10, pady=10, anchor=tk.W)
         
         # List frame with scrollbar
         list_frame = ttk.Frame(self)
@@ -178,8 +176,8 @@ class FileTypeDialog(tk.Toplevel):
         if not new_type:
             return
         
-        # Ensure it starts with a dot if it's an extension
-        if not new_type.startswith(".") and not new_type.startswith("*"):
+        # Ensure it starts with a dot if it's an extension (glob patterns like "build*" are kept as typed)
+        if not new_type.startswith(".") and not any(c in new_type for c in "*?["):
             new_type = "." + new_type
         
         # Add to list if not already present
@@ -207,11 +205,141 @@ class FileTypeDialog(tk.Toplevel):
         self.destroy()
 
 
+class MergeOptionsDialog(tk.Toplevel):
+    def __init__(self, parent, options, priorities):
+        super().__init__(parent)
+        self.title("Merge Options")
+        self.geometry("420x640")
+        
+        # Make dialog modal
+        self.transient(parent)
+        self.grab_set()
+        
+        # Store options; priorities maps priority keys to their labels
+        self.options = dict(options)
+        self.priorities = priorities
+        self.result = None
+        
+        # Create UI
+        self.create_widgets()
+        
+        # Focus dialog
+        self.focus_set()
+    
+    def create_widgets(self):
+        # Token budget
+        budget_frame = ttk.LabelFrame(self, text="Token Budget", padding=10)
+        budget_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Label(budget_frame, text="Max tokens (0 = no limit):").grid(row=0, column=0, sticky=tk.W, pady=3)
+        self.budget_var = tk.StringVar(value=str(self.options.get("token_budget", 0)))
+        ttk.Entry(budget_frame, textvariable=self.budget_var, width=12).grid(row=0, column=1, sticky=tk.W, padx=5, pady=3)
+        
+        ttk.Label(budget_frame, text="Fill budget with:").grid(row=1, column=0, sticky=tk.W, pady=3)
+        self.priority_var = tk.StringVar(value=self.priorities.get(self.options.get("budget_priority"), ""))
+        ttk.Combobox(budget_frame, textvariable=self.priority_var, values=list(self.priorities.values()),
+                     state="readonly", width=24).grid(row=1, column=1, sticky=tk.W, padx=5, pady=3)
+        
+        self.truncate_var = tk.BooleanVar(value=self.options.get("budget_overflow") == "truncate")
+        ttk.Checkbutton(budget_frame, text="Truncate the file that does not fit instead of skipping it",
+                        variable=self.truncate_var).grid(row=2, column=0, columnspan=2, sticky=tk.W, pady=3)
+        
+        # Binary files
+        binary_frame = ttk.LabelFrame(self, text="Binary Files", padding=10)
+        binary_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        self.skip_binary_var = tk.BooleanVar(value=self.options.get("binary_files") == "skip")
+        ttk.Checkbutton(binary_frame, text="Leave binary files out entirely\n(otherwise a one-line note replaces their content)",
+                        variable=self.skip_binary_var).pack(anchor=tk.W)
+        
+        # Duplicate files
+        self.deduplicate_var = tk.BooleanVar(value=self.options.get("deduplicate", True))
+        ttk.Checkbutton(self, text="Write files with identical content only once\n(later copies reference the first one)",
+                        variable=self.deduplicate_var).pack(anchor=tk.W, padx=20, pady=(0, 10))
+        
+        # Incremental exports
+        incremental_frame = ttk.LabelFrame(self, text="Repeated Exports", padding=10)
+        incremental_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        self.reuse_var = tk.BooleanVar(value=self.options.get("reuse_unchanged", True))
+        ttk.Checkbutton(incremental_frame, text="Copy unchanged files from the previous export",
+                        variable=self.reuse_var).pack(anchor=tk.W)
+        self.changes_only_var = tk.BooleanVar(value=self.options.get("export_mode") == "changes")
+        ttk.Checkbutton(incremental_frame, text="Only export changes since the last full export\n(written next to it as <name>.changes.txt)",
+                        variable=self.changes_only_var).pack(anchor=tk.W)
+        
+        # Per-file limits
+        limits_frame = ttk.LabelFrame(self, text="Per-File Limits (0 = none)", padding=10)
+        limits_frame.pack(fill=tk.X, padx=10, pady=(0, 10))
+        
+        ttk.Label(limits_frame, text="Larger files keep only their first and last part.").grid(row=0, column=0, columnspan=2, sticky=tk.W, pady=3)
+        self.limit_vars = {}
+        for row, (key, label) in enumerate((("max_file_bytes", "Max bytes per file:"),
+                                            ("max_file_lines", "Max lines per file:"),
+                                            ("max_file_tokens", "Max tokens per file:")), start=1):
+            ttk.Label(limits_frame, text=label).grid(row=row, column=0, sticky=tk.W, pady=3)
+            self.limit_vars[key] = tk.StringVar(value=str(self.options.get(key, 0)))
+            ttk.Entry(limits_frame, textvariable=self.limit_vars[key], width=12).grid(row=row, column=1, sticky=tk.W, padx=5, pady=3)
+        
+        # Buttons
+        button_frame = ttk.Frame(self)
+        button_frame.pack(fill=tk.X, padx=10, pady=10)
+        
+        ttk.Button(button_frame, text="OK", command=self.save_changes).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(button_frame, text="Cancel", command=self.cancel).pack(side=tk.RIGHT, padx=5)
+    
+    def save_changes(self):
+        """Validate, save changes and close dialog"""
+        try:
+            budget = int(self.budget_var.get().replace(",", "").strip() or 0)
+            if budget < 0:
+                raise ValueError
+        except ValueError:
+            messagebox.showerror("Invalid Value", "The token budget must be a whole number of 0 or more.", parent=self)
+            return
+        limits = {}
+        for key, var in self.limit_vars.items():
+            try:
+                limits[key] = int(var.get().replace(",", "").strip() or 0)
+                if limits[key] < 0:
+                    raise ValueError
+            except ValueError:
+                messagebox.showerror("Invalid Value", "Per-file limits must be whole numbers of 0 or more.", parent=self)
+                return
+        
+        self.options["token_budget"] = budget
+        for key, label in self.priorities.items():
+            if label == self.priority_var.get():
+                self.options["budget_priority"] = key
+        self.options["budget_overflow"] = "truncate" if self.truncate_var.get() else "skip"
+        self.options["binary_files"] = "skip" if self.skip_binary_var.get() else "stub"
+        self.options["deduplicate"] = self.deduplicate_var.get()
+        self.options["reuse_unchanged"] = self.reuse_var.get()
+        self.options["export_mode"] = "changes" if self.changes_only_var.get() else "full"
+        self.options.update(limits)
+        self.result = self.options
+        self.destroy()
+    
+    def cancel(self):
+        """Cancel changes and close dialog"""
+        self.result = None
+        self.destroy()
+
+
 class ProgressDialog(tk.Toplevel):
+    """Modal progress window for work running on another thread.
+
+    update_progress, set_maximum and close may be called from any thread: they
+    only queue events, which the dialog applies from a root.after() loop every
+    DRAIN_MS, keeping just the latest values. Workers never touch Tk widgets
+    or pump the event loop themselves.
+    """
+    DRAIN_MS = 100
+
     def __init__(self, parent, title, max_value):
         super().__init__(parent)
         self.title(title)
-        self.geometry("400x150")
+        self.geometry("400x175")
         self.resizable(False, False)
         
         # Make dialog modal
@@ -221,6 +349,8 @@ class ProgressDialog(tk.Toplevel):
         # Progress variables
         self.max_value = max_value
         self.current = 0
+        self.bytes_done = 0
+        self._events = queue.SimpleQueue() # (kind, data) posted by worker threads
         
         # Create UI
         self.create_widgets()
@@ -231,6 +361,7 @@ class ProgressDialog(tk.Toplevel):
         
         # Cancel flag
         self.cancelled = False
+        self._drain_after = self.after(self.DRAIN_MS, self._drain)
     
     def create_widgets(self):
         # Status label
@@ -245,29 +376,71 @@ class ProgressDialog(tk.Toplevel):
         self.progress_text = tk.StringVar(value="0 / 0")
         ttk.Label(self, textvariable=self.progress_text).pack(padx=20)
         
+        # Throughput and time left, when the caller measures them
+        self.detail_var = tk.StringVar(value="")
+        ttk.Label(self, textvariable=self.detail_var).pack(padx=20)
+        
         # Cancel button
         ttk.Button(self, text="Cancel", command=self.cancel_operation).pack(pady=10)
     
-    def update_progress(self, value, status_text=None, finished=False):
-        """Update progress bar and status"""
+    def set_maximum(self, max_value):
+        """Set the total once it is known (e.g. after the selected files were enumerated). Thread-safe"""
+        self.max_value = max_value
+        self._events.put(("maximum", max_value))
+
+    def update_progress(self, value, status_text=None, finished=False, bytes_done=None, detail=None):
+        """Report progress; shown at the next redraw. Thread-safe"""
         if self.cancelled:
             return
-        
         self.current = value
-        
-        # Update UI in main thread
-        self.progress['value'] = value
-        self.progress_text.set(f"{value} / {self.max_value}")
-        
-        if status_text:
-            self.status_var.set(status_text)
-        
-        # Process events to update display
-        self.update()
-        
+        self._events.put(("progress", (value, status_text, bytes_done, detail)))
         # If operation is complete, close dialog after delay
         if finished:
-            self.after(1000, self.destroy)
+            self.close(1000)
+
+    def close(self, delay_ms=0):
+        """Close the dialog after delay_ms. Thread-safe"""
+        self._events.put(("close", delay_ms))
+
+    def _drain(self):
+        """Apply the queued events on the Tk thread"""
+        value = status_text = detail = maximum = close = None
+        while True:
+            try:
+                kind, data = self._events.get_nowait()
+            except queue.Empty:
+                break
+            if kind == "progress":
+                value = data[0]
+                status_text = data[1] or status_text
+                detail = data[3] if data[3] is not None else detail
+                if data[2] is not None:
+                    self.bytes_done = data[2]
+            elif kind == "maximum":
+                maximum = data
+            elif kind == "close":
+                close = data if close is None else min(close, data)
+
+        if maximum is not None:
+            self.progress['maximum'] = maximum
+        if value is not None:
+            self.progress['value'] = value
+        if value is not None or maximum is not None:
+            bytes_text = f" ({format_size(self.bytes_done)})" if self.bytes_done else ""
+            self.progress_text.set(f"{int(self.progress['value'])} / {self.max_value}{bytes_text}")
+        if status_text:
+            self.status_var.set(status_text)
+        if detail is not None:
+            self.detail_var.set(detail)
+        if close is not None:
+            self._drain_after = self.after(close, self.destroy)
+        else:
+            self._drain_after = self.after(self.DRAIN_MS, self._drain)
+
+    def destroy(self):
+        # The pending drain would otherwise fire on a destroyed window
+        self.after_cancel(self._drain_after)
+        super().destroy()
     
     def cancel_operation(self):
         """Cancel the operation"""
@@ -0,0 +1,135 @@
+import os
+from array import array
+
+from scanner import ScanEntry
+
+KIND_FILE = 0
+KIND_DIR = 1
+KIND_ERROR = 2
+
+
+def kind_of(entry):
+    """KIND_FILE, KIND_DIR or KIND_ERROR for a scanned entry"""
+    if entry.error:
+        return KIND_ERROR
+    return KIND_DIR if entry.is_dir else KIND_FILE
+
+
+class VirtualListing:
+    """All entries of one huge folder, kept in compact parallel arrays.
+
+    Only the entries in [start, end) have Treeview rows; the rest exist only
+    here, so a folder with 100k+ entries costs a window of rows instead of one
+    Tk item (and several full-path strings) per entry. Rows above and below
+    the window are represented by one "more entries" row each (see
+    FileOperations.page_listing).
+    """
+
+    def __init__(self, folder, folder_id):
+        self.folder = folder
+        self.folder_id = folder_id # Tree row of the folder
+        self.names = []
+        self.kinds = bytearray()
+        self.binary = bytearray()
+        self.sizes = array("q")
+        self.mtimes = array("d")
+        self.errors = {} # Entry name -> error text, for entries that could not be stat'ed
+        self.unknown_binary = [] # Indexes of files listed without a binary classification (see copy_binary)
+        self.start = 0
+        self.end = 0
+        self.before_id = f"{folder_id}_placeholder_before" # Row standing in for entries above the window
+        self.after_id = f"{folder_id}_placeholder_after" # Row standing in for entries below the window
+
+    def __len__(self):
+        return len(self.names)
+
+    def extend(self, entries):
+        """Append scanned entries (see scanner.ScanEntry), in listing order"""
+        for entry in entries:
+            if entry.is_binary is None:
+                self.unknown_binary.append(len(self.names))
+            self.insert(len(self.names), entry)
+
+    def insert(self, index, entry):
+        """Insert one scanned entry at index (see position)"""
+        if entry.error:
+            self.errors[entry.name] = entry.error
+        self.names.insert(index, entry.name)
+        self.kinds.insert(index, kind_of(entry))
+        self.binary.insert(index, 1 if entry.is_binary else 0)
+        self.sizes.insert(index, entry.size or 0)
+        self.mtimes.insert(index, entry.mtime or 0.0)
+
+    def remove(self, index):
+        """Drop the entry at index"""
+        self.errors.pop(self.names.pop(index), None)
+        del self.kinds[index]
+        del self.binary[index]
+        del self.sizes[index]
+        del self.mtimes[index]
+
+    def replace(self, index, entry):
+        """Update the entry at index from a fresh entry of the same kind; an unknown binary state is kept"""
+        if entry.error:
+            self.errors[entry.name] = entry.error
+        if entry.is_binary is not None:
+            self.binary[index] = 1 if entry.is_binary else 0
+        self.sizes[index] = entry.size or 0
+        self.mtimes[index] = entry.mtime or 0.0
+
+    def index_of(self, name):
+        """Index of the entry called name, or None"""
+        try:
+            return self.names.index(name)
+        except ValueError:
+            return None
+
+    def position(self, entry):
+        """Index at which entry belongs, sorted like scan_directory (folders first, then by name)"""
+        key = (not entry.is_dir, entry.name.lower())
+        low, high = 0, len(self.names)
+        while low < high:
+            middle = (low + high) // 2
+            if (self.kinds[middle] != KIND_DIR, self.names[middle].lower()) < key:
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def set_binary(self, flags):
+        """Apply {name: is_binary} for files classified after they were listed"""
+        positions = {name: i for i, name in enumerate(self.names)}
+        for name, is_binary in flags.items():
+            index = positions.get(name)
+            if index is not None:
+                self.binary[index] = 1 if is_binary else 0
+
+    def copy_binary(self, other):
+        """Take the binary flags of other (an older listing of the folder) for entries listed as unknown"""
+        positions = {name: i for i, name in enumerate(other.names)}
+        for index in self.unknown_binary:
+            old = positions.get(self.names[index])
+            if old is not None:
+                self.binary[index] = other.binary[old]
+        self.unknown_binary = []
+
+    def entry(self, index):
+        """The ScanEntry at index, rebuilt from the arrays"""
+        kind = self.kinds[index]
+        name = self.names[index]
+        path = os.path.join(self.folder, name)
+        if kind == KIND_ERROR:
+            return ScanEntry(name, path, False, None, None, self.errors[name])
+        return ScanEntry(name, path, kind == KIND_DIR, self.sizes[index], self.mtimes[index], None, bool(self.binary[index]))
+
+    def state(self):
+        """Map of name -> (kind, size, mtime, binary), to compare two listings of the folder"""
+        return {name: (self.kinds[i], self.sizes[i], self.mtimes[i], self.binary[i]) for i, name in enumerate(self.names)}
+
+    def state_of(self, index):
+        """The (kind, size, mtime, binary) of the entry at index, as in state()"""
+        return (self.kinds[index], self.sizes[index], self.mtimes[index], self.binary[index])
+
+    def window_names(self):
+        """Names of the entries in the window, i.e. those with tree rows"""
+        return self.names[self.start:self.end]